@@ -0,0 +1,183 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import sentiment_store as store
+
+# stored columns used and the sentiment sources among them
+FIELDS = ['reddit', 'news', 'twitter', 'mean', 'close', 'vol']
+SOURCES = ['reddit', 'news', 'twitter', 'mean']
+
+
+def to_panel(data):
+    """
+    Turn stored rows for several tickers into a panel
+    :param data: df with ticker and date columns as from sentiment_store.read_many
+    :return: df indexed by date with (field, ticker) columns
+    """
+    data = data.drop_duplicates(subset=['ticker', 'date'], keep='last')
+    panel = data.pivot(index='date', columns='ticker', values=FIELDS)
+    return panel.sort_index()
+
+
+def compute(panel, window=20, max_lag=3, min_periods=5):
+    """
+    Calculate metrics for every ticker in a panel at once
+    :param panel: df indexed by date with (field, ticker) columns from to_panel
+    :param window: days in each rolling window
+    :param max_lag: most days sentiment is shifted by for lead/lag correlations
+    :param min_periods: fewest days with data for a rolling value
+    :return: df indexed by date with (metric, ticker) columns. Metrics are return, the rolling mean and z-score
+    of volume and each source (<source>_mean, <source>_z) and the rolling correlation of each source lagged by
+    k days with returns (<source>_lag<k>), a positive k is sentiment leading price
+    """
+    close = panel['close']
+    returns = close / close.shift(1) - 1
+    metrics = {'return': returns}
+
+    def rolling(name, x):
+        mean = x.rolling(window, min_periods=min_periods).mean()
+        std = x.rolling(window, min_periods=min_periods).std()
+        metrics[name + '_mean'] = mean
+        metrics[name + '_z'] = (x - mean) / std
+
+    rolling('vol', panel['vol'])
+    for source in SOURCES:
+        x = panel[source]
+        rolling(source, x)
+        for lag in range(-max_lag, max_lag + 1):
+            metrics['{}_lag{}'.format(source, lag)] = x.shift(lag).rolling(window, min_periods=min_periods) \
+                .corr(returns)
+    return pd.concat(metrics, axis=1)
+
+
+class SentimentAnalytics:
+    """
+    Rolling metrics over the stored sentiment and price data for many tickers. Only the last days of each
+    ticker needed for the windows and lags are kept, so adding a day computes O(window) rows rather than the
+    whole history
+    """
+
+    def __init__(self, window=20, max_lag=3, min_periods=5):
+        self.window = window
+        self.max_lag = max_lag
+        self.min_periods = min_periods
+        self.lock = threading.Lock()
+        self.history = {}  # ticker: df of the last days of stored fields needed for the next day
+        self.metrics = None  # df indexed by date with (metric, ticker) columns
+
+    def update(self, data):
+        """
+        Add stored rows and calculate metrics for them. Rows for days already seen replace them
+        :param data: df with ticker and date columns as from sentiment_store.read_many
+        :return: df of metrics for the rows added, indexed by date with (metric, ticker) columns
+        """
+        if data.empty:
+            return pd.DataFrame()
+        with self.lock:
+            new = to_panel(data)
+            tickers = list(new.columns.get_level_values(1).unique())
+            # each ticker's new days plus the days before them needed for the rolling windows and lags. The
+            # last max_lag days before are calculated again as their negative lags use the new days
+            panels = {}
+            recalculate = {}
+            for ticker in tickers:
+                rows = new.xs(ticker, axis=1, level=1).dropna(how='all')
+                if rows.empty:
+                    # nothing stored for any field, a quiet ticker or dead apis. Its history is kept as it was
+                    continue
+                history = self.history.get(ticker)
+                if history is not None:
+                    history = history[history.index < rows.index.min()]
+                    rows = pd.concat([history, rows])
+                    recalculate[ticker] = rows.index[max(len(history) - self.max_lag, 0):]
+                else:
+                    recalculate[ticker] = rows.index
+                self.history[ticker] = rows.iloc[-(self.window + 2 * self.max_lag + 1):]
+                panels[ticker] = rows
+            if not panels:
+                return pd.DataFrame()
+            panel = pd.concat(panels, axis=1).swaplevel(axis=1).sort_index()
+
+            result = compute(panel, self.window, self.max_lag, self.min_periods)
+            # only keep the days calculated for each ticker
+            mask = pd.DataFrame({t: result.index.isin(dates) for t, dates in recalculate.items()}, index=result.index)
+            result = result.loc[mask.any(axis=1)]
+            mask = mask.loc[result.index]
+            result = result.where(mask.reindex(columns=result.columns.get_level_values(1)).to_numpy())
+
+            self._merge(result, mask)
+            return result
+
+    def _merge(self, result, mask):
+        # the days calculated for each ticker are written over their rows in place rather than combining the
+        # whole history with them. The frame is only copied when new days or tickers are added, and kept as
+        # one block of floats so whole rows can be written at once
+        if self.metrics is None:
+            self.metrics = pd.DataFrame(result.to_numpy(dtype=float), index=result.index, columns=result.columns)
+            return
+        rows = result.index.difference(self.metrics.index)
+        columns = result.columns.difference(self.metrics.columns)
+        if len(rows) or len(columns):
+            metrics = self.metrics.reindex(index=self.metrics.index.union(rows),
+                                           columns=self.metrics.columns.union(columns))
+            self.metrics = pd.DataFrame(metrics.to_numpy(dtype=float), index=metrics.index, columns=metrics.columns)
+        positions = self.metrics.index.get_indexer(result.index)
+        calculated = mask.reindex(columns=self.metrics.columns.get_level_values(1), fill_value=False).to_numpy()
+        new = result.reindex(columns=self.metrics.columns).to_numpy(dtype=float)
+        self.metrics.iloc[positions] = np.where(calculated, new, self.metrics.iloc[positions].to_numpy())
+
+    def refresh(self, conn, tickers):
+        """
+        Read days stored since the last refresh for each ticker and calculate their metrics. The last day seen
+        is read again as runs fetch it again
+        :param conn: sentiment store connection
+        :param tickers: list of tickers
+        :return: df of metrics for the days read
+        """
+        with self.lock:
+            starts = [self.history[t].index.max() if t in self.history else None for t in tickers]
+        start = None if None in starts else min(starts)
+        data = store.read_many(conn, tickers, start=start)
+        # tickers already seen only need days from their own last day
+        seen = data['ticker'].map(dict(zip(tickers, starts)))
+        data = data[seen.isna() | (data['date'] >= seen)]
+        return self.update(data)
+
+    def query(self, metric, tickers=None, start=None, end=None):
+        """
+        Get a metric for tickers over a date range
+        :param metric: metric name e.g. return, reddit_z or news_lag1, see compute
+        :param tickers: list of tickers, None for all
+        :param start: first date string, None for the start
+        :param end: last date string, None for the end
+        :return: df indexed by date with a column per ticker
+        """
+        with self.lock:
+            if self.metrics is None or metric not in self.metrics.columns.get_level_values(0):
+                return pd.DataFrame()
+            data = self.metrics[metric]
+        if tickers is not None:
+            data = data.reindex(columns=list(tickers))
+        return data.loc[start:end]
+
+    def lead_lag(self, ticker, source='reddit', date=None):
+        """
+        Rolling correlation of a source with returns at each lag
+        :param ticker: stock ticker
+        :param source: sentiment source, one of SOURCES
+        :param date: date string, None for the latest day with a value
+        :return: series of correlation indexed by lag, a positive lag is sentiment leading price
+        """
+        lags = range(-self.max_lag, self.max_lag + 1)
+        empty = pd.Series(dtype=float, index=pd.Index(lags, name='lag'))
+        columns = {lag: self.query('{}_lag{}'.format(source, lag), [ticker]).get(ticker) for lag in lags}
+        # no metrics calculated yet
+        if any(column is None for column in columns.values()):
+            return empty
+        data = pd.DataFrame(columns).dropna(how='all')
+        if data.empty:
+            return empty
+        row = data.iloc[-1] if date is None else data.loc[:date].iloc[-1]
+        return row.rename_axis('lag')
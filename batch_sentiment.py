@@ -0,0 +1,195 @@
+import argparse
+import datetime as dt
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import stock_funcs as sf
+import sentiment_store as store
+
+
+def read_watchlist(filename):
+    """
+    Read tickers from a watchlist file, one per line or comma separated. Lines starting with # are ignored
+    :param filename: watchlist filename
+    :return: list of tickers
+    """
+    tickers = []
+    with open(filename, 'r') as file:
+        for line in file:
+            line = line.split('#')[0]
+            tickers.extend(t.strip().upper() for t in line.split(',') if t.strip())
+    return tickers
+
+
+def load_checkpoint(filename, run_date):
+    """
+    Load tickers already completed in a batch for the same day
+    :param filename: checkpoint filename
+    :param run_date: date string of this batch
+    :return: set of completed tickers
+    """
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, 'r') as file:
+        checkpoint = json.load(file)
+    if checkpoint.get('date') != run_date:
+        return set()
+    return set(checkpoint.get('done', []))
+
+
+def save_checkpoint(filename, run_date, done):
+    # write then rename so an interrupted write never leaves a broken checkpoint
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump({'date': run_date, 'done': sorted(done)}, file)
+    os.replace(tmp, filename)
+
+
+def get_windows(tickers, config):
+    """
+    Get the start and end time to fetch for each ticker
+    :param tickers: list of tickers
+    :param config: config dict
+    :return: dict of ticker: (start time, end time)
+    """
+    store_path = config['GLOBAL'].get('store', 'sentiment.db')
+    conn = store.connect(store_path)
+    windows = {}
+    for ticker in tickers:
+        windows[ticker] = sf.get_time_window(conn, ticker, config['GLOBAL']['lookback'], store_path)[:2]
+    conn.close()
+    return windows
+
+
+def prefetch_prices(windows, store_path=None):
+    """
+    Get price data for every ticker, downloading the dates missing from the store in as few requests as possible
+    :param windows: dict of ticker: (start time, end time)
+    :param store_path: sentiment store filename, None to download everything
+    :return: dict of ticker: df of price data
+    """
+    start_time = min(w[0] for w in windows.values())
+    end_time = max(w[1] for w in windows.values())
+
+    print('downloading stock data for {} tickers'.format(len(windows)))
+    try:
+        return sf.get_stock_data_many(list(windows), start=start_time.strftime('%Y-%m-%d'),
+                                      end=end_time.strftime('%Y-%m-%d'), store_path=store_path)
+    except Exception as e:
+        print('error downloading stock data, fetching per ticker instead')
+        print(e)
+        return {}
+
+
+def prefetch_reddit(windows, config, limiter=None):
+    """
+    Fetch each sub once for the whole batch and split the posts and comments between the tickers
+    :param windows: dict of ticker: (start time, end time)
+    :param config: config dict
+    :param limiter: RateLimiter shared for reddit fetches
+    :return: dict of ticker: Documents trimmed to that ticker's window
+    """
+    start_time = min(w[0] for w in windows.values())
+    end_time = max(w[1] for w in windows.values())
+    try:
+        ticker_data = sf.process_reddit_many(list(windows), config['REDDIT']['subs'], start_time, end_time,
+                                             config['REDDIT'], limit=config['GLOBAL']['sublimit'], limiter=limiter)
+    except Exception as e:
+        print('error fetching reddit data for batch, fetching per ticker instead')
+        print(e)
+        return {}
+    trimmed = {}
+    for t, docs in ticker_data.items():
+        dates = [date.strftime('%Y-%m-%d') for date in sf.daterange(*windows[t])]
+        trimmed[t] = docs.between(dates[0], dates[-1])
+    return trimmed
+
+
+def run_batch(tickers, config, workers=4, checkpoint=None, single_pass_reddit=False):
+    """
+    Run sentiment for a watchlist of tickers on a shared pool, skipping tickers already done today
+    :param tickers: list of tickers
+    :param config: config dict
+    :param workers: number of tickers run at the same time
+    :param checkpoint: checkpoint filename to resume from and record progress in, None to disable
+    :param single_pass_reddit: fetch each sub once for all tickers instead of searching it per ticker
+    :return: dict of ticker: True if it completed
+    """
+    run_date = dt.date.today().strftime('%Y-%m-%d')
+    done = load_checkpoint(checkpoint, run_date) if checkpoint else set()
+    todo = [ticker for ticker in dict.fromkeys(tickers) if ticker not in done]
+    print('batch for {} tickers, {} already done'.format(len(todo) + len(done), len(done)))
+    if not todo:
+        return {ticker: True for ticker in tickers}
+
+    windows = get_windows(todo, config)
+    prices = prefetch_prices(windows, config['GLOBAL'].get('store', 'sentiment.db'))
+
+    sf.get_scorer(config.get('SENTIMENT', {}).get('customwords'), config.get('SENTIMENT', {}).get('engine'))
+    limiter = sf.RateLimiter(config['REDDIT'].get('requests_per_minute', 60))
+    reddit = prefetch_reddit(windows, config, limiter) if single_pass_reddit else {}
+    lock = threading.Lock()
+    results = {ticker: True for ticker in done}
+
+    def run(ticker):
+        prefetched = {}
+        if ticker in prices:
+            prefetched['price'] = prices[ticker]
+        if ticker in reddit:
+            prefetched['reddit'] = reddit[ticker]
+        try:
+            sf.run_sentiment(ticker, config=config, prefetched=prefetched, pool=pool, limiter=limiter)
+        except Exception as e:
+            print('error running sentiment for: ', ticker)
+            print(e)
+            return ticker, False
+        with lock:
+            done.add(ticker)
+            if checkpoint:
+                save_checkpoint(checkpoint, run_date, done)
+        return ticker, True
+
+    pool = sf.make_score_pool(config.get('SENTIMENT', {}).get('workers'))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for ticker, ok in executor.map(run, todo):
+                results[ticker] = ok
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = [ticker for ticker, ok in results.items() if not ok]
+    print('batch finished, {} done, {} failed: {}'.format(len(results) - len(failed), len(failed), failed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run stock sentiment for a watchlist of tickers')
+    parser.add_argument('tickers', nargs='*', help='tickers to run')
+    parser.add_argument('-w', '--watchlist', help='file of tickers, one per line or comma separated')
+    parser.add_argument('-c', '--config', default='config.yaml', help='config file')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='tickers run at the same time')
+    parser.add_argument('--checkpoint', default='batch_checkpoint.json',
+                        help='file recording completed tickers so an interrupted batch can resume')
+    parser.add_argument('--single-pass-reddit', action='store_true',
+                        help='fetch every post in each sub once and match it against all tickers')
+    parser.add_argument('--no-checkpoint', action='store_true', help='run every ticker, ignoring the checkpoint')
+    args = parser.parse_args()
+
+    tickers = [t.upper() for t in args.tickers]
+    if args.watchlist:
+        tickers.extend(read_watchlist(args.watchlist))
+    if not tickers:
+        parser.error('no tickers given')
+
+    config = sf.load_config(args.config)
+    checkpoint = None if args.no_checkpoint else args.checkpoint
+    results = run_batch(tickers, config, workers=args.jobs, checkpoint=checkpoint,
+                        single_pass_reddit=args.single_pass_reddit)
+    return 0 if all(results.values()) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
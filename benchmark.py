@@ -0,0 +1,755 @@
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import stock_funcs as sf
+from dedupe import cluster_texts
+from documents import Documents, DocumentBuilder
+from instrumentation import RunReport
+
+# words for synthetic text, a mix of neutral words, VADER lexicon words and the custom trading terms
+WORDS = ['the', 'stock', 'is', 'going', 'to', 'moon', 'today', 'earnings', 'report', 'market', 'price', 'shares',
+         'company', 'quarter', 'guidance', 'revenue', 'this', 'that', 'not', 'very', 'really', 'good', 'great',
+         'bad', 'terrible', 'love', 'hate', 'amazing', 'awful', 'happy', 'sad', 'win', 'loss', 'crash', 'rally',
+         'call', 'put', 'buy', 'sell', 'calls', 'puts', 'tendies', '!', 'LOL', 'NOT', 'GREAT', ':)', ':(']
+
+SUBS = ['wallstreetbets', 'investing', 'stocks']
+
+# seconds allowed to import each module in a fresh interpreter, most of it is pandas and numpy
+IMPORT_BUDGETS = {'stock_funcs': 0.75, 'batch_sentiment': 0.75}
+# source clients that must only be imported when first used
+LAZY_MODULES = ['vaderSentiment', 'praw', 'psaw', 'newsapi', 'yfinance', 'dash']
+
+
+def _text(rng, n_words):
+    return ' '.join(rng.choice(WORDS) for i in range(n_words))
+
+
+def make_fixtures(n_docs, lookback=30, subs=SUBS, seed=0):
+    """
+    Generate synthetic source responses for a run. Roughly 10% of documents are news articles, 20% reddit
+    posts and 70% reddit comments, spread over the lookback window
+    :param n_docs: total number of documents
+    :param lookback: days of history
+    :param subs: subs to generate reddit data for
+    :param seed: random seed, the same seed gives the same fixtures
+    :return: fixtures dict as from load_fixtures
+    """
+    rng = random.Random(seed)
+    now = dt.datetime.now()
+    start_time = now - dt.timedelta(days=lookback)
+    end_time = now - dt.timedelta(days=1)
+    dates = [d.strftime('%Y-%m-%d') for d in sf.daterange(start_time, end_time)]
+
+    n_news = max(n_docs // 10, 1)
+    n_posts = max(n_docs // 5, 1)
+    n_comments = max(n_docs - n_news - n_posts, 0)
+
+    articles = []
+    for i in range(n_news):
+        published = start_time + dt.timedelta(seconds=rng.randrange(int((end_time - start_time).total_seconds())))
+        articles.append({'title': _text(rng, 10), 'content': _text(rng, 40), 'url': 'https://news/{}'.format(i),
+                         'publishedAt': published.strftime('%Y-%m-%dT%H:%M:%SZ')})
+
+    builders = {sub: DocumentBuilder(sub) for sub in subs}
+    for i in range(n_posts):
+        builder = builders[rng.choice(subs)]
+        builder.add_post(rng.choice(dates), 'p{}'.format(i), _text(rng, 12), _text(rng, rng.randrange(0, 60)))
+    for i in range(n_comments):
+        builder = builders[rng.choice(subs)]
+        builder.add_comment(rng.choice(dates), 'c{}'.format(i), _text(rng, rng.randrange(3, 30)))
+    reddit = {sub: builder.build() for sub, builder in builders.items()}
+
+    days = pd.date_range(start_time.date(), end_time.date(), freq='B')
+    close = 100 + np.cumsum(np.random.default_rng(seed).normal(0, 1, len(days)))
+    prices = pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close, 'Adj Close': close,
+                           'Volume': 1000000}, index=days)
+
+    twitter = (200, dates, [rng.randrange(-100, 100) for d in dates], [1.], [1.], [1.])
+
+    return {'news': {'status': 'ok', 'totalResults': n_news, 'articles': articles}, 'twitter': twitter,
+            'reddit': reddit, 'prices': prices, 'lookback': lookback}
+
+
+def record_fixtures(ticker, config, directory):
+    """
+    Record real responses from every source for a ticker so they can be replayed offline
+    :param ticker: stock ticker
+    :param config: config dict
+    :param directory: directory to write fixtures to
+    """
+    lookback = config['GLOBAL']['lookback']
+    end_time = dt.datetime.now() - dt.timedelta(days=1)
+    start_time = dt.datetime.now() - dt.timedelta(days=lookback)
+    reddit = {}
+    for sub in config['REDDIT']['subs']:
+        reddit[sub] = sf.reddit_scrape(ticker, sub, start_time, end_time, config['REDDIT'],
+                                       limit=config['GLOBAL']['sublimit'])
+    fixtures = {
+        'news': sf.get_news(ticker, start_time, config['APIKEYS']['newsapi'], **config.get('NEWS', {})),
+        'twitter': sf.get_twtr_sentiment(ticker, config['APIKEYS']['socialsentiment']),
+        'reddit': reddit,
+        'prices': sf.get_stock_data(ticker, start=start_time.strftime('%Y-%m-%d'),
+                                    end=end_time.strftime('%Y-%m-%d')),
+        'lookback': lookback,
+    }
+    save_fixtures(fixtures, directory)
+
+
+def save_fixtures(fixtures, directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'sources.json'), 'w') as file:
+        json.dump({'lookback': fixtures['lookback'], 'news': fixtures['news'],
+                   'twitter': list(fixtures['twitter']),
+                   'reddit': {sub: v.to_dict() for sub, v in fixtures['reddit'].items()}}, file)
+    fixtures['prices'].to_csv(os.path.join(directory, 'prices.csv'))
+
+
+def load_fixtures(directory):
+    """
+    Load recorded or saved fixtures
+    :param directory: directory written by save_fixtures or record_fixtures
+    :return: dict of news response, twitter response, reddit Documents per sub and prices df
+    """
+    with open(os.path.join(directory, 'sources.json'), 'r') as file:
+        sources = json.load(file)
+    prices = pd.read_csv(os.path.join(directory, 'prices.csv'), index_col=0, parse_dates=True)
+    reddit = {}
+    for sub, v in sources['reddit'].items():
+        # fixtures saved as (post dict, comments dict) per sub are converted
+        reddit[sub] = Documents.from_dict(v) if isinstance(v, dict) else _from_nested(sub, *v)
+    return {'news': sources['news'], 'twitter': tuple(sources['twitter']), 'reddit': reddit, 'prices': prices,
+            'lookback': sources['lookback']}
+
+
+def _from_nested(sub, post_dict, comments_dict):
+    builder = DocumentBuilder(sub)
+    for d, posts in post_dict.items():
+        for id, title, body in zip(posts['id'], posts['title'], posts['body']):
+            builder.add_post(d, id, title, body)
+    for d, comments in comments_dict.items():
+        for id, body in zip(comments['comment_id'], comments['comment_body']):
+            builder.add_comment(d, id, body)
+    return builder.build()
+
+
+@contextlib.contextmanager
+def replay(fixtures, latency=0.):
+    """
+    Swap the source fetch functions in stock_funcs for stand-ins that return the fixtures
+    :param fixtures: fixtures dict
+    :param latency: seconds each stand-in waits before returning, to mimic network round trips
+    """
+    def delayed(result):
+        if latency:
+            time.sleep(latency)
+        return result
+
+    stand_ins = {
+        'get_news': lambda q, from_date, apikey, **kwargs: delayed(fixtures['news']),
+        'get_twtr_sentiment': lambda ticker, apikey: delayed(fixtures['twitter']),
+        'get_stock_data': lambda ticker, start, end, store_path=None: delayed(fixtures['prices']),
+        'reddit_scrape': lambda q, sub, start_time, end_time, config, **kwargs:
+            delayed(fixtures['reddit'].get(sub, Documents.empty())),
+    }
+    originals = {name: getattr(sf, name) for name in stand_ins}
+    for name, func in stand_ins.items():
+        setattr(sf, name, func)
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            setattr(sf, name, func)
+
+
+def run_once(fixtures, workers=1, latency=0., memory=True, verbose=False, engine='vader'):
+    """
+    Time run_sentiment end to end against fixtures with an empty store
+    :return: dict of wall seconds, peak traced memory in MB, stage timings and counters
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {
+            'GLOBAL': {'lookback': fixtures.get('lookback', 30), 'sublimit': 1,
+                       'store': os.path.join(tmp, 'bench.db')},
+            'APIKEYS': {'socialsentiment': '', 'newsapi': ''},
+            'REDDIT': {'subs': list(fixtures['reddit'])},
+            'SENTIMENT': {'workers': workers, 'engine': engine},
+        }
+        report = RunReport('BENCH')
+        # load the scorer first so the lexicon is not counted in the run
+        sf.get_scorer(engine=engine)
+        out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with replay(fixtures, latency), out:
+            if memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            sf.run_sentiment('BENCH', config=config, report=report)
+            wall = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] / 1e6 if memory else None
+            if memory:
+                tracemalloc.stop()
+
+    data = report.to_dict()
+    return {'wall': wall, 'peak_mb': peak, 'stages': {k: v['wall'] for k, v in data['stages'].items()},
+            'counters': data['counters']}
+
+
+def _score_per_call(sentence, customwords):
+    # how each sentence was scored before the shared scorer, loading the lexicon every time
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    analyser = SentimentIntensityAnalyzer()
+    analyser.lexicon.update(customwords)
+    try:
+        return analyser.polarity_scores(sentence)['compound']
+    except:
+        return np.nan
+
+
+def measure_scorer(n_texts=100000, per_call_texts=200, seed=0):
+    """
+    Compare sentences per second building a VADER analyser for every sentence with the shared scorer
+    :param n_texts: number of texts scored with the shared scorer, short comment length
+    :param per_call_texts: number of those texts scored building an analyser each, it is far slower
+    :param seed: random seed
+    :return: dict of sentences per second each way, seconds to load the shared scorer and whether the scores
+    of the texts scored both ways match
+    """
+    rng = random.Random(seed)
+    texts = [_text(rng, rng.randint(0, 40)) for i in range(n_texts)]
+    per_call_texts = min(per_call_texts, n_texts)
+
+    started = time.perf_counter()
+    per_call = [_score_per_call(text, sf.DEFAULT_CUSTOMWORDS) for text in texts[:per_call_texts]]
+    per_call_rate = per_call_texts / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    scorer = sf.SentimentScorer(engine='vader')
+    load = time.perf_counter() - started
+    started = time.perf_counter()
+    shared = scorer.score_many(texts)
+    shared_rate = n_texts / (time.perf_counter() - started)
+    return {'rates': {'per_call': per_call_rate, 'shared': shared_rate}, 'load': load,
+            'match': per_call == shared[:per_call_texts]}
+
+
+def measure_scaling(n_texts=100000, workers=None, chunksize=500, seed=0, engine='vader'):
+    """
+    Time scoring the same synthetic texts on pools of more and more processes against scoring them serially,
+    checking every pool gives exactly the serial scores
+    :param n_texts: number of texts, short comment length
+    :param workers: list of pool sizes, None for powers of two up to every core
+    :param chunksize: number of texts sent to a worker at a time
+    :param seed: random seed
+    :param engine: sentiment engine
+    :return: dict of serial texts per second and a list of (workers, texts per second, speedup, scores match)
+    """
+    if workers is None:
+        cores = os.cpu_count() or 1
+        workers = sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+    rng = random.Random(seed)
+    texts = [_text(rng, rng.randint(0, 40)) for i in range(n_texts)]
+    sf.get_scorer(engine=engine)
+    started = time.perf_counter()
+    serial = np.array(sf.get_scorer().score_many(texts))
+    serial_rate = n_texts / (time.perf_counter() - started)
+
+    curve = []
+    for n in workers:
+        pool = sf.make_score_pool(n)
+        try:
+            # the workers load the lexicon on their first chunk, not counted as with a long lived pool
+            sf.score_texts(texts[:n * chunksize], chunksize=chunksize, pool=pool)
+            started = time.perf_counter()
+            scores = np.array(sf.score_texts(texts, chunksize=chunksize, pool=pool))
+            rate = n_texts / (time.perf_counter() - started)
+        finally:
+            pool.close()
+            pool.join()
+        curve.append((n, rate, rate / serial_rate, np.array_equal(scores, serial, equal_nan=True)))
+    return {'serial': serial_rate, 'curve': curve}
+
+
+def _loop_final_sentiment(stock_data, sent_data, reddit_sentiment, news_sentiment, twtr_data):
+    # daily aggregation as it was before the groupby, one date at a time over dicts of lists
+    lastopen = lasthigh = lastlow = lastclose = lastvol = np.nan
+    for i, d in enumerate(news_sentiment.keys()):
+        try:
+            sent_data[d]['reddit'] = np.mean(reddit_sentiment[d])
+        except Exception as e:
+            print('error calculating reddit sentiment for: ', d)
+        try:
+            sent_data[d]['news'] = np.mean(news_sentiment[d])
+        except Exception as e:
+            print('error calculating news sentiment for: ', d)
+        try:
+            sent_data[d]['mean'] = np.mean([news_sentiment[d] + reddit_sentiment[d]])
+        except Exception as e:
+            print('error calculating mean sentiment for: ', d)
+        try:
+            sent_data[d]['twitter'] = twtr_data[d] / 100.
+        except Exception as e:
+            print('error calculating socialsentiment.io values')
+            sent_data[d]['twitter'] = np.nan
+        try:
+            sent_data[d]['open'] = stock_data['Open'][d]
+            sent_data[d]['high'] = stock_data['High'][d]
+            sent_data[d]['low'] = stock_data['Low'][d]
+            sent_data[d]['close'] = stock_data['Close'][d]
+            sent_data[d]['vol'] = stock_data['Volume'][d]
+            lastopen = stock_data['Open'][d]
+            lasthigh = stock_data['High'][d]
+            lastlow = stock_data['Low'][d]
+            lastclose = stock_data['Close'][d]
+            lastvol = stock_data['Volume'][d]
+        except Exception as ed:
+            sent_data[d]['open'] = lastopen
+            sent_data[d]['high'] = lasthigh
+            sent_data[d]['low'] = lastlow
+            sent_data[d]['close'] = lastclose
+            sent_data[d]['vol'] = lastvol
+    return sent_data
+
+
+def measure_aggregation(days=365, docs_per_day=1000, seed=0, repeat=3):
+    """
+    Time daily aggregation of scored documents and prices with the per date loop it replaced and with
+    get_final_sentiment
+    :param days: days of synthetic data
+    :param docs_per_day: scored news and reddit documents per day
+    :param seed: random seed
+    :param repeat: runs of each, the fastest is kept
+    :return: dict of seconds for each and the largest difference between their outputs
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2021-01-01', periods=days, freq='D')
+    date_strings = list(dates.strftime('%Y-%m-%d'))
+    n = days * docs_per_day
+    scored = pd.DataFrame({'date': np.repeat(date_strings, docs_per_day),
+                           'source': rng.choice(['news', 'reddit'], size=n, p=[0.2, 0.8]),
+                           'score': rng.uniform(-1, 1, size=n).round(4)})
+    trading = dates[dates.dayofweek < 5]
+    close = 100 + np.cumsum(rng.normal(0, 1, len(trading)))
+    prices = pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close, 'Adj Close': close,
+                           'Volume': 1000000.}, index=trading)
+    twitter = {d: float(rng.integers(-100, 100)) for d in date_strings}
+
+    # the loop took lists of scores per date per source
+    lists = {source: {d: [] for d in date_strings} for source in ('news', 'reddit')}
+    for d, source, score in zip(scored['date'], scored['source'], scored['score']):
+        lists[source][d].append(score)
+
+    times = {'loop': [], 'groupby': []}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeat):
+            started = time.perf_counter()
+            loop = _loop_final_sentiment(prices, {d: {} for d in date_strings}, lists['reddit'], lists['news'],
+                                         twitter)
+            times['loop'].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            grouped = sf.get_final_sentiment(prices, scored, twitter, date_strings)
+            times['groupby'].append(time.perf_counter() - started)
+    loop = pd.DataFrame.from_dict(loop, orient='index')[grouped.columns].astype(float)
+    difference = np.nanmax(np.abs(loop.values - grouped.values))
+    return {'seconds': {k: min(v) for k, v in times.items()}, 'difference': float(difference)}
+
+
+def measure_graph(years=(1, 5, 10), seed=0, repeat=3):
+    """
+    Measure the graph callback payload and time for histories of daily sentiment and prices. Compares a
+    figure of every stored day, as drawn after each run before, with the downsampled figure drawn for a new
+    ticker and the update sent after a run for the ticker already drawn
+    :param years: lengths of history in years
+    :param seed: random seed
+    :param repeat: calls of each, the fastest is kept
+    :return: dict of years: dict of way: (json bytes, seconds)
+    """
+    import importlib
+    import plotly.utils
+    import sentiment_store as store
+
+    rng = np.random.default_rng(seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # the dashboard loads config.yaml from the working directory when it is imported
+        with open(os.path.join(directory, 'config.yaml'), 'w') as file:
+            json.dump({'GLOBAL': {'store': os.path.join(directory, 'sentiment.db')},
+                       'SENTIMENT': {'engine': 'fast', 'workers': 1}}, file)
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                dashboard = importlib.import_module('stock_sentiment_analysis')
+        finally:
+            os.chdir(cwd)
+        conn = store.connect(dashboard.store_path)
+        max_points = dashboard.max_points
+        for n in years:
+            ticker = 'Y{}'.format(n)
+            dates = pd.date_range('2021-01-01', periods=365 * n, freq='D').strftime('%Y-%m-%d')
+            close = 100 + np.cumsum(rng.normal(0, 1, len(dates)))
+            store.upsert(conn, ticker, {d: {'news': rng.uniform(-1, 1), 'reddit': rng.uniform(-1, 1),
+                                            'twitter': rng.uniform(-1, 1), 'close': c}
+                                        for d, c in zip(dates, close)})
+            # after a run the graph was drawn up to the day before the last one stored
+            cases = {'full': (0, None), 'first': (max_points, None),
+                     'update': (max_points, {'ticker': ticker, 'last_date': dates[-2]})}
+            results[n] = {}
+            for way, (points, shown) in cases.items():
+                # below 3 points lttb keeps every point, as the figure was drawn before
+                dashboard.max_points = points
+                times = []
+                for i in range(repeat):
+                    started = time.perf_counter()
+                    update, state = dashboard.graph_update(conn, ticker, shown)
+                    payload = json.dumps(update, cls=plotly.utils.PlotlyJSONEncoder)
+                    times.append(time.perf_counter() - started)
+                results[n][way] = (len(payload), min(times))
+            dashboard.max_points = max_points
+        conn.close()
+    return results
+
+
+def compare_engines(n_texts=100000, seed=0, tolerance=1e-4):
+    """
+    Score the same synthetic texts with each sentiment engine, checking the fast engine matches VADER
+    :param n_texts: number of texts, short comment length
+    :param seed: random seed
+    :param tolerance: largest allowed difference in compound score
+    :return: dict of engine: texts per second, and the number of texts outside the tolerance
+    """
+    rng = random.Random(seed)
+    texts = [_text(rng, rng.randint(0, 40)) for i in range(n_texts)]
+    scores = {}
+    rates = {}
+    for engine in ('vader', 'fast'):
+        scorer = sf.SentimentScorer(engine=engine)
+        started = time.perf_counter()
+        scores[engine] = np.array(scorer.score_many(texts))
+        rates[engine] = n_texts / (time.perf_counter() - started)
+    mismatches = int((np.abs(scores['vader'] - scores['fast']) > tolerance).sum())
+    return {'rates': rates, 'mismatches': mismatches}
+
+
+def measure_dedupe(n_texts=100000, copy_rate=0.3, seed=0, threshold=0.8):
+    """
+    Time near duplicate clustering on synthetic texts where some are copies with a word or two changed
+    :param n_texts: number of texts
+    :param copy_rate: fraction of texts that are edited copies of an earlier text
+    :param seed: random seed
+    :param threshold: similarity threshold for MinHashLSH
+    :return: dict of texts per second and the fraction of unique texts that no longer need scoring
+    """
+    rng = random.Random(seed)
+    texts = []
+    for i in range(n_texts):
+        if texts and rng.random() < copy_rate:
+            words = rng.choice(texts).split()
+            # long texts are edited, short ones copied exactly
+            if len(words) > 20:
+                words[rng.randrange(len(words))] = rng.choice(WORDS)
+            texts.append(' '.join(words))
+        else:
+            texts.append(_text(rng, rng.randint(3, 60)))
+    started = time.perf_counter()
+    clusters, sizes = cluster_texts(texts, threshold=threshold)
+    seconds = time.perf_counter() - started
+    unique = len(clusters)
+    return {'rate': n_texts / seconds, 'unique': unique, 'clusters': len(sizes),
+            'removed': (unique - len(sizes)) / unique}
+
+
+def nested_structures(fixtures):
+    """
+    Build the nested dicts of lists per date that news and reddit data were held in before the documents
+    table, with the same texts, for comparing memory
+    :param fixtures: fixtures dict from make_fixtures
+    :return: news data dict of date: field lists, and sub data dict of sub: posts and comments dicts
+    """
+    news_data = {}
+    for article in fixtures['news']['articles']:
+        d = news_data.setdefault(article['publishedAt'][:10], {'title': [], 'content': [], 'url': []})
+        # copied so the texts are not shared with the fixtures
+        for k in d:
+            d[k].append(''.join(article[k]))
+    sub_data = {}
+    for sub, docs in fixtures['reddit'].items():
+        post_dict = {}
+        comments_dict = {}
+        for d in docs.dates():
+            post_dict.setdefault(d, {'title': [], 'score': [], 'id': [], 'url': [], 'comms_num': [], 'created': [],
+                                     'body': []})
+            comments_dict.setdefault(d, {'comment_id': [], 'comment_parent_id': [], 'comment_body': [],
+                                         'comment_link_id': []})
+        frame = docs.frame()
+        for d, kind, id, text in zip(frame['date'], frame['kind'], frame['id'], frame['text']):
+            if kind == 'comment':
+                comments_dict[d]['comment_id'].append(id)
+                comments_dict[d]['comment_body'].append(text)
+            else:
+                if kind == 'title':
+                    post_dict[d]['id'].append(id)
+                post_dict[d][kind].append(text)
+        sub_data[sub] = {'posts': post_dict, 'comments': comments_dict}
+    return news_data, sub_data
+
+
+def deep_size(obj, seen=None):
+    """
+    Bytes held by an object and everything it refers to, counting shared objects once
+    :param obj: dicts, lists, tuples, strings, numbers, arrays or Documents
+    :return: size in bytes
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif isinstance(obj, Documents):
+        size += obj.nbytes + deep_size(obj.subs, seen)
+    return size
+
+
+def measure_documents(n_docs, seed=0):
+    """
+    Compare the memory of a run's documents held in the documents table and in nested dicts of lists
+    :param n_docs: number of synthetic documents
+    :param seed: random seed
+    :return: dict of bytes held by each and the number of texts
+    """
+    fixtures = make_fixtures(n_docs, seed=seed)
+    nested = nested_structures(fixtures)
+    now = dt.datetime.now()
+    with contextlib.redirect_stdout(io.StringIO()):
+        news = sf.process_news(now - dt.timedelta(days=fixtures['lookback']), now - dt.timedelta(days=1),
+                               fixtures['news'])
+    table = Documents.concat([news] + list(fixtures['reddit'].values()))
+    return {'texts': len(table), 'nested': deep_size(nested), 'table': deep_size(table)}
+
+
+def import_time(module, repeat=3):
+    """
+    Time importing a module in a fresh interpreter with python -X importtime
+    :param module: module name
+    :param repeat: imports to run, the fastest is kept
+    :return: dict of seconds to import, the slowest imports by their own time and any lazy modules loaded
+    """
+    best = None
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__) or '.')
+        imports = []  # (self us, cumulative us, name)
+        for line in output.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line and 'self [us]' not in line:
+                own, cumulative, name = line[len('import time:'):].split('|')
+                imports.append((int(own), int(cumulative), name.strip()))
+        total = next(cumulative for own, cumulative, name in imports if name == module)
+        if best is None or total < best[0]:
+            best = total, imports
+    total, imports = best
+    return {
+        'seconds': total / 1e6,
+        'slowest': [(name, own / 1e6) for own, cumulative, name in sorted(imports, reverse=True)[:5]],
+        'lazy_loaded': sorted({name.split('.')[0] for own, cumulative, name in imports} & set(LAZY_MODULES)),
+    }
+
+
+def check_imports(budgets=IMPORT_BUDGETS, repeat=3):
+    """
+    Check each module imports within its budget without loading the source clients
+    :param budgets: dict of module: seconds allowed
+    :param repeat: imports per module, the fastest is kept
+    :return: list of problems, empty if every module is within budget
+    """
+    problems = []
+    for module, budget in budgets.items():
+        result = import_time(module, repeat)
+        print('import {:<16} {:8.3f}s  budget {:.3f}s'.format(module, result['seconds'], budget))
+        for name, seconds in result['slowest']:
+            print('  {:<28} {:8.3f}s'.format(name, seconds))
+        if result['seconds'] > budget:
+            problems.append('{} took {:.3f}s to import, budget {:.3f}s'.format(module, result['seconds'], budget))
+        if result['lazy_loaded']:
+            problems.append('{} imports {} at import time'.format(module, ', '.join(result['lazy_loaded'])))
+    return problems
+
+
+def compare(results, baseline, tolerance):
+    """
+    Flag results slower than the baseline
+    :param results: dict of name: result from run_once
+    :param baseline: dict of name: result from a previous run
+    :param tolerance: allowed slowdown as a fraction e.g. 0.2 for 20%
+    :return: list of regression messages
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['wall'] > base['wall'] * (1 + tolerance):
+            regressions.append('{} wall {:.2f}s vs baseline {:.2f}s'.format(name, result['wall'], base['wall']))
+        if result.get('peak_mb') and base.get('peak_mb') and result['peak_mb'] > base['peak_mb'] * (1 + tolerance):
+            regressions.append('{} peak memory {:.1f}MB vs baseline {:.1f}MB'.format(name, result['peak_mb'],
+                                                                                  base['peak_mb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark run_sentiment offline against recorded or '
+                                                 'synthetic source data')
+    parser.add_argument('-s', '--scales', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='numbers of synthetic documents to run at')
+    parser.add_argument('-f', '--fixtures', help='directory of recorded fixtures to replay instead of synthetic data')
+    parser.add_argument('--record', metavar='TICKER', help='record fixtures for a ticker from the real sources '
+                                                           'into --fixtures and exit')
+    parser.add_argument('-c', '--config', default='config.yaml', help='config file used when recording')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per scale, the fastest is kept')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='scoring processes')
+    parser.add_argument('--latency', type=float, default=0., help='seconds of simulated latency per source call')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace peak memory, it slows runs down')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='save these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    parser.add_argument('-o', '--output', help='write results as json')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show run_sentiment output')
+    parser.add_argument('--imports', action='store_true', help='check import times against their budgets and exit')
+    parser.add_argument('--engine', default='vader', choices=['vader', 'fast'], help='sentiment engine for runs')
+    parser.add_argument('--engines', action='store_true',
+                        help='compare the sentiment engines for speed and matching scores and exit')
+    parser.add_argument('--scorer', action='store_true',
+                        help='compare sentences per second building an analyser per sentence with the shared '
+                             'scorer and exit')
+    parser.add_argument('--scaling', type=int, nargs='*', metavar='WORKERS',
+                        help='time scoring on pools of each number of processes, powers of two up to every core if '
+                             'none are given, check the scores match serial scoring and exit')
+    parser.add_argument('--aggregation', type=int, nargs='?', const=365, metavar='DAYS',
+                        help='time daily aggregation with the old per date loop and the groupby over DAYS days of '
+                             'synthetic data (a year by default) with --scales documents per day and exit')
+    parser.add_argument('--graph', type=int, nargs='*', metavar='YEARS',
+                        help='measure the graph callback payload and time over 1, 5 and 10 years of daily data '
+                             '(or the years given) and exit')
+    parser.add_argument('--documents', action='store_true',
+                        help='compare the memory of the documents table and nested dicts at each scale and exit')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='measure near duplicate clustering speed and the scoring it saves and exit')
+    args = parser.parse_args()
+
+    if args.scorer:
+        result = measure_scorer(max(args.scales))
+        for way, rate in result['rates'].items():
+            print('{:<10} {:12.0f} sentences/s'.format(way, rate))
+        print('shared scorer loaded in {:.3f}s, {:.0f}x faster per sentence, scores {}'.format(
+            result['load'], result['rates']['shared'] / result['rates']['per_call'],
+            'match' if result['match'] else 'DIFFER'))
+        return 0 if result['match'] else 1
+
+    if args.scaling is not None:
+        result = measure_scaling(max(args.scales), workers=args.scaling or None, engine=args.engine)
+        print('serial     {:12.0f} texts/s'.format(result['serial']))
+        for n, rate, speedup, match in result['curve']:
+            print('workers {:<3}{:12.0f} texts/s  {:5.2f}x  scores {}'.format(n, rate, speedup,
+                                                                          'match' if match else 'DIFFER'))
+        return 0 if all(match for n, rate, speedup, match in result['curve']) else 1
+
+    if args.aggregation:
+        result = measure_aggregation(args.aggregation, max(args.scales))
+        for way, seconds in result['seconds'].items():
+            print('{:<8} {:10.4f}s'.format(way, seconds))
+        print('{:.0f}x faster, largest difference {:.2e}'.format(
+            result['seconds']['loop'] / result['seconds']['groupby'], result['difference']))
+        return 0 if result['difference'] < 1e-9 else 1
+
+    if args.graph is not None:
+        for n, ways in measure_graph(args.graph or (1, 5, 10), repeat=args.repeat).items():
+            for way, (size, seconds) in ways.items():
+                print('{:>2} years {:<8} {:10.1f}KB {:10.4f}s'.format(n, way, size / 1e3, seconds))
+        return 0
+
+    if args.documents:
+        for n in args.scales:
+            result = measure_documents(n)
+            print('docs_{:<10} {:>9} texts  nested {:9.1f}MB  table {:9.1f}MB  {:5.1f}% less'.format(
+                n, result['texts'], result['nested'] / 1e6, result['table'] / 1e6,
+                100 * (1 - result['table'] / result['nested'])))
+        return 0
+
+    if args.dedupe:
+        result = measure_dedupe(max(args.scales))
+        print('dedupe {:12.0f} texts/s, {} unique texts in {} clusters, {:.1f}% less scoring'.format(
+            result['rate'], result['unique'], result['clusters'], 100 * result['removed']))
+        return 0
+
+    if args.engines:
+        result = compare_engines(max(args.scales))
+        for engine, rate in result['rates'].items():
+            print('{:<8} {:12.0f} texts/s'.format(engine, rate))
+        print('fast engine scores differing from vader: {}'.format(result['mismatches']))
+        return 1 if result['mismatches'] else 0
+
+    if args.imports:
+        problems = check_imports(repeat=args.repeat)
+        for problem in problems:
+            print('REGRESSION', problem)
+        return 1 if problems else 0
+
+    if args.record:
+        if not args.fixtures:
+            parser.error('--record needs --fixtures')
+        record_fixtures(args.record, sf.load_config(args.config), args.fixtures)
+        print('fixtures recorded to', args.fixtures)
+        return 0
+
+    if args.fixtures:
+        cases = {'fixtures': lambda: load_fixtures(args.fixtures)}
+    else:
+        cases = {'docs_{}'.format(n): (lambda n=n: make_fixtures(n)) for n in args.scales}
+
+    results = {}
+    for name, make in cases.items():
+        fixtures = make()
+        runs = [run_once(fixtures, workers=args.workers, latency=args.latency, memory=not args.no_memory,
+                         verbose=args.verbose, engine=args.engine) for i in range(args.repeat)]
+        results[name] = min(runs, key=lambda r: r['wall'])
+        result = results[name]
+        peak = '' if result['peak_mb'] is None else '  peak {:8.1f}MB'.format(result['peak_mb'])
+        print('{:<16} wall {:8.3f}s{}'.format(name, result['wall'], peak))
+        for stage, wall in sorted(result['stages'].items(), key=lambda s: -s[1]):
+            print('  {:<28} {:8.3f}s'.format(stage, wall))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print('baseline saved to', args.baseline)
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,168 @@
+from itertools import chain
+
+import numpy as np
+
+# MinHash permutations are (a * h + b) % PRIME with a, b and the shingle hashes h all below PRIME,
+# small enough that the products fit in uint64
+PRIME = (1 << 31) - 1
+
+
+def components(n, pairs):
+    """
+    Join items into groups from pairs that belong together
+    :param n: number of items
+    :param pairs: iterable of (i, j) item pairs
+    :return: list of the index of each item's representative, the lowest index in its group
+    """
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+    return [find(i) for i in range(n)]
+
+
+class MinHashLSH:
+    """
+    Finds near duplicate texts. Each text is reduced to a MinHash signature of its word shingles and
+    signatures are split into bands, texts sharing any band are candidates and are clustered if their
+    signatures estimate a Jaccard similarity of at least threshold
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, shingle=3, min_words=6, batch=2000,
+                 max_shingles=50000, seed=0):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle = shingle
+        # texts need at least one shingle to be fingerprinted
+        self.min_words = max(min_words, shingle)
+        self.batch = batch
+        # every permutation of this many shingles is held at once, num_perm * 8 bytes each
+        self.max_shingles = max_shingles
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, size=(num_perm, 1)).astype(np.uint64)
+        self.b = rng.randint(0, PRIME, size=(num_perm, 1)).astype(np.uint64)
+        # combine word hashes into shingle hashes, and a band of a signature into one bucket key
+        self.word_weights = rng.randint(1, PRIME, size=shingle).astype(np.uint64)
+        self.band_weights = rng.randint(1, PRIME, size=num_perm // bands).astype(np.uint64)
+
+    def _batches(self, texts):
+        # up to batch texts at a time, fewer if they are long so a batch has at most max_shingles words
+        # unless it is a single text
+        start = 0
+        while start < len(texts):
+            words = []
+            total = 0
+            for text in texts[start:start + self.batch]:
+                text_words = text.lower().split()
+                if words and total + len(text_words) > self.max_shingles:
+                    break
+                words.append(text_words)
+                total += len(text_words)
+            yield start, words
+            start += len(words)
+
+    def signatures(self, texts):
+        """
+        :param texts: list of texts with at least min_words words
+        :return: array of MinHash signatures, one row per text. Values are below PRIME so are kept as uint32
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for start, words in self._batches(texts):
+            lengths = np.array([len(w) for w in words])
+            # the process hash is fine as signatures are only compared within a run
+            hashes = (np.fromiter(map(hash, chain.from_iterable(words)), dtype=np.int64, count=lengths.sum())
+                      % PRIME).astype(np.uint64)
+
+            # word shingles, shingle i of a text is made from its words i to i + shingle
+            counts = lengths - self.shingle + 1
+            offsets = np.cumsum(counts) - counts
+            first_word = np.repeat(np.cumsum(lengths) - lengths - offsets, counts) + np.arange(counts.sum())
+            shingles = np.zeros(len(first_word), dtype=np.uint64)
+            for j, weight in enumerate(self.word_weights):
+                shingles = (shingles + hashes[first_word + j] * weight) % PRIME
+
+            # every permutation of max_shingles shingles at a time, then the min per text. A text split
+            # between chunks takes the min of its parts
+            owner = np.repeat(np.arange(len(words)), counts)
+            batch = np.full((len(words), self.num_perm), PRIME, dtype=np.uint64)
+            for chunk in range(0, len(shingles), self.max_shingles):
+                texts_in = owner[chunk:chunk + self.max_shingles]
+                starts = np.r_[0, np.flatnonzero(np.diff(texts_in)) + 1]
+                values = (self.a * shingles[chunk:chunk + self.max_shingles] + self.b) % PRIME
+                rows = texts_in[starts]
+                batch[rows] = np.minimum(batch[rows], np.minimum.reduceat(values, starts, axis=1).T)
+            signatures[start:start + len(words)] = batch
+        return signatures
+
+    def similar_pairs(self, signatures):
+        """
+        Find pairs of near duplicates among signatures
+        :param signatures: array of signatures from signatures
+        :return: array of (i, j) row pairs estimated to be at least threshold similar
+        """
+        if len(signatures) < 2:
+            return np.empty((0, 2), dtype=np.int64)
+        rows = self.num_perm // self.bands
+        pairs = []
+        for band in range(self.bands):
+            keys = (signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) * self.band_weights).sum(axis=1)
+            # texts with the same key share a bucket, each is paired with the first in its bucket
+            # rather than with every other member
+            order = np.argsort(keys, kind='stable')
+            same = keys[order][1:] == keys[order][:-1]
+            bucket_first = order[np.maximum.accumulate(np.where(np.r_[False, same], 0, np.arange(len(order))))]
+            pairs.append(np.stack([bucket_first[1:][same], order[1:][same]], axis=1))
+        pairs = np.unique(np.concatenate(pairs), axis=0)
+        # keys can collide so check the signatures really are similar
+        similar = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1) >= self.threshold
+        return pairs[similar]
+
+    def clusters(self, texts):
+        """
+        Group exact and near duplicate texts
+        :param texts: list of texts, non text values and texts under min_words words only match exactly
+        :return: list of the index of each text's representative, the first text of its cluster
+        """
+        first = {}
+        pairs = []
+        fingerprinted = []
+        for i, text in enumerate(texts):
+            if text in first:
+                pairs.append((first[text], i))
+                continue
+            first[text] = i
+            if isinstance(text, str) and len(text.split()) >= self.min_words:
+                fingerprinted.append(i)
+
+        fingerprinted = np.array(fingerprinted, dtype=np.int64)
+        similar = self.similar_pairs(self.signatures([texts[i] for i in fingerprinted]))
+        pairs.extend(fingerprinted[similar].tolist())
+        return components(len(texts), pairs)
+
+
+def cluster_texts(texts, **kwargs):
+    """
+    Map each text to the representative of its cluster of exact and near duplicates
+    :param texts: iterable of texts
+    :param kwargs: MinHashLSH settings
+    :return: dict of text: representative text, and dict of representative text: number of texts in its cluster
+    """
+    texts = list(texts)
+    reps = MinHashLSH(**kwargs).clusters(texts)
+    clusters = {}
+    sizes = {}
+    for text, rep in zip(texts, reps):
+        clusters[text] = texts[rep]
+        sizes[texts[rep]] = sizes.get(texts[rep], 0) + 1
+    return clusters, sizes
@@ -0,0 +1,346 @@
+import numpy as np
+import pandas as pd
+
+# categories of the source and kind columns, stored as codes into these lists
+SOURCES = ['news', 'reddit']
+KINDS = ['title', 'body', 'content', 'comment']
+# rows decoded at a time when reading strings out of a StringColumn
+CHUNK_ROWS = 50000
+# score cache key of each source and kind of text, from the document id
+KEY_FORMATS = {('news', 'title'): 'news:{}:title', ('news', 'content'): 'news:{}:content',
+               ('reddit', 'title'): 'reddit:{}:title', ('reddit', 'body'): 'reddit:{}:body',
+               ('reddit', 'comment'): 'reddit:comment:{}'}
+
+
+class StringColumn:
+    """
+    utf-8 strings stored end to end in one byte array with an offset per string, the same layout as an
+    Arrow string column, rather than as a Python object each. Missing values are kept as None
+    """
+
+    def __init__(self, data, offsets, valid):
+        self.data = data  # uint8 array of every string's bytes
+        self.offsets = offsets  # int64 array, string i is data[offsets[i]:offsets[i + 1]]
+        self.valid = valid  # bool array, False where the value is None
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        :param values: iterable of str or None, other values are stored as None
+        :return: StringColumn
+        """
+        values = list(values)
+        valid = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+        encoded = [v.encode('utf-8') if ok else b'' for v, ok in zip(values, valid)]
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(values)), out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, valid)
+
+    @classmethod
+    def concat(cls, columns):
+        columns = list(columns)
+        if not columns:
+            return cls.from_list([])
+        offsets = [np.zeros(1, dtype=np.int64)]
+        total = 0
+        for column in columns:
+            offsets.append(column.offsets[1:] + total)
+            total += column.offsets[-1]
+        return cls(np.concatenate([c.data for c in columns]), np.concatenate(offsets),
+                   np.concatenate([c.valid for c in columns]))
+
+    def __len__(self):
+        return len(self.valid)
+
+    def __getitem__(self, i):
+        if not self.valid[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def take(self, indices):
+        """
+        :param indices: array of row numbers
+        :return: StringColumn of those rows
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if not len(indices):
+            return StringColumn.from_list([])
+        # copy runs of consecutive rows in one slice each, filtering usually keeps long runs
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        firsts = indices[np.r_[0, breaks]]
+        lasts = indices[np.r_[breaks, len(indices)] - 1]
+        data = np.concatenate([self.data[self.offsets[a]:self.offsets[b + 1]] for a, b in zip(firsts, lasts)])
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(self.offsets[indices + 1] - self.offsets[indices], out=offsets[1:])
+        return StringColumn(data, offsets, self.valid[indices])
+
+    def tolist(self, rows=None, decode=True):
+        """
+        :param rows: array of row numbers, None for every row
+        :param decode: give str values, else the utf-8 bytes
+        :return: list of str, or bytes, or None
+        """
+        values = []
+        n = len(self) if rows is None else len(rows)
+        for start in range(0, n, CHUNK_ROWS):
+            # one chunk of rows is copied out of the array at a time
+            if rows is None:
+                column = StringColumn(self.data, self.offsets[start:start + CHUNK_ROWS + 1],
+                                      self.valid[start:start + CHUNK_ROWS])
+            else:
+                column = self.take(rows[start:start + CHUNK_ROWS])
+            first = column.offsets[0]
+            buffer = column.data[first:column.offsets[-1]].tobytes()
+            offsets = (column.offsets - first).tolist()
+            values.extend((buffer[offsets[i]:offsets[i + 1]].decode('utf-8') if decode
+                           else buffer[offsets[i]:offsets[i + 1]]) if ok else None
+                          for i, ok in enumerate(column.valid.tolist()))
+        return values
+
+    def hashes(self):
+        """
+        Hash every string's bytes without making a Python string of each, for finding identical values
+        :return: int64 array of hashes, 0 for None
+        """
+        hashes = np.zeros(len(self), dtype=np.int64)
+        for start in range(0, len(self), CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, len(self))
+            buffer = self.data[self.offsets[start]:self.offsets[stop]].tobytes()
+            offsets = (self.offsets[start:stop + 1] - self.offsets[start]).tolist()
+            hashes[start:stop] = [hash(buffer[offsets[i]:offsets[i + 1]]) for i in range(stop - start)]
+        hashes[~self.valid] = 0
+        return hashes
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes + self.valid.nbytes
+
+
+class Documents:
+    """
+    Every scraped text of a run in one table of typed NumPy columns: source, sub, date, id, kind, doc, text
+    and score. A news article or reddit post is a row per text (title and content or body) sharing a doc
+    number, a comment is one row. Source, sub and kind are stored as codes and the texts and ids as
+    StringColumns, so the table holds a handful of arrays however many documents there are
+    """
+
+    def __init__(self, source, sub, date, id, kind, doc, text, subs=(), score=None, cluster=None):
+        self.source = source  # uint8 codes into SOURCES
+        self.sub = sub  # int16 codes into subs, -1 for none
+        self.subs = list(subs)
+        self.date = date  # datetime64[D]
+        self.id = id  # StringColumn of article urls and reddit ids
+        self.kind = kind  # uint8 codes into KINDS
+        self.doc = doc  # int64 document number, the rows of one article or post share it
+        self.text = text  # StringColumn
+        # float64 compound sentiment filled in by scoring, nan until then
+        self.score = np.full(len(doc), np.nan) if score is None else score
+        # int64 row of the representative of each row's near duplicate cluster, None until clustered
+        self.cluster = cluster
+
+    @classmethod
+    def from_columns(cls, source, date, id, kind, doc, text, sub=None):
+        """
+        Build a table from columns of Python values
+        :param source: source name of each row, one of SOURCES
+        :param date: date string of each row
+        :param id: document id of each row
+        :param kind: kind of each row, one of KINDS
+        :param doc: document number of each row
+        :param text: text of each row
+        :param sub: sub of each row, None for none
+        :return: Documents
+        """
+        n = len(doc)
+        if sub is None:
+            sub_codes, subs = np.full(n, -1, dtype=np.int16), []
+        else:
+            codes, subs = pd.factorize(pd.Series(sub, dtype=object))
+            sub_codes, subs = codes.astype(np.int16), list(subs)
+        return cls(pd.Categorical(source, categories=SOURCES).codes.astype(np.uint8), sub_codes,
+                   np.array(date, dtype='datetime64[D]').reshape(n), StringColumn.from_list(id),
+                   pd.Categorical(kind, categories=KINDS).codes.astype(np.uint8),
+                   np.asarray(doc, dtype=np.int64).reshape(n), StringColumn.from_list(text), subs=subs)
+
+    @classmethod
+    def empty(cls):
+        return cls.from_columns([], [], [], [], [], [])
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Join tables, renumbering documents so they stay distinct
+        :param tables: iterable of Documents
+        :return: Documents
+        """
+        tables = [t for t in tables if t is not None]
+        if not tables:
+            return cls.empty()
+        subs = list(dict.fromkeys(s for t in tables for s in t.subs))
+        sub_codes = []
+        docs = []
+        offset = 0
+        for t in tables:
+            remap = np.array([subs.index(s) for s in t.subs] + [-1], dtype=np.int16)
+            sub_codes.append(remap[t.sub])
+            docs.append(t.doc + offset)
+            offset += int(t.doc.max()) + 1 if len(t) else 0
+        clusters = None
+        if all(t.cluster is not None for t in tables):
+            starts = np.cumsum([0] + [len(t) for t in tables[:-1]])
+            clusters = np.concatenate([t.cluster + start for t, start in zip(tables, starts)])
+        return cls(np.concatenate([t.source for t in tables]), np.concatenate(sub_codes), subs=subs,
+                   date=np.concatenate([t.date for t in tables]), id=StringColumn.concat(t.id for t in tables),
+                   kind=np.concatenate([t.kind for t in tables]), doc=np.concatenate(docs),
+                   text=StringColumn.concat(t.text for t in tables),
+                   score=np.concatenate([t.score for t in tables]), cluster=clusters)
+
+    def __len__(self):
+        return len(self.doc)
+
+    def take(self, rows):
+        """
+        :param rows: bool mask or array of row numbers
+        :return: Documents of those rows, clusters are dropped as they refer to rows
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        return Documents(self.source[rows], self.sub[rows], self.date[rows], self.id.take(rows), self.kind[rows],
+                         self.doc[rows], self.text.take(rows), subs=self.subs, score=self.score[rows])
+
+    def between(self, start_date, end_date):
+        """
+        :param start_date: first date string to keep
+        :param end_date: last date string to keep
+        :return: Documents dated between the dates
+        """
+        return self.take((self.date >= np.datetime64(start_date, 'D')) & (self.date <= np.datetime64(end_date, 'D')))
+
+    def mask(self, source=None, kind=None):
+        """
+        :param source: source name, None for any
+        :param kind: kind name or list of kinds, None for any
+        :return: bool array of the rows matching
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if source is not None:
+            mask &= self.source == SOURCES.index(source)
+        if kind is not None:
+            kinds = [kind] if isinstance(kind, str) else kind
+            mask &= np.isin(self.kind, [KINDS.index(k) for k in kinds])
+        return mask
+
+    def count(self, source=None, kind=None):
+        return int(self.mask(source, kind).sum())
+
+    def texts(self, rows=None):
+        """
+        :param rows: array of row numbers, None for every row
+        :return: list of texts
+        """
+        return self.text.tolist(rows)
+
+    def unique_texts(self):
+        """
+        Find identical texts from the hash and length of their bytes, without a Python string per row
+        :return: array of the first row of each distinct text in row order, and array of the number of each
+        row's text in it, -1 for None
+        """
+        rows = np.flatnonzero(self.text.valid)
+        fingerprints = np.stack([self.text.hashes()[rows], self.text.lengths()[rows]], axis=1)
+        first, inverse = np.unique(fingerprints, axis=0, return_index=True, return_inverse=True)[1:]
+        # number texts in the order they first appear
+        order = np.argsort(first)
+        numbers = np.empty(len(first), dtype=np.int64)
+        numbers[order] = np.arange(len(first))
+        codes = np.full(len(self), -1, dtype=np.int64)
+        codes[rows] = numbers[inverse.reshape(-1)]
+        return rows[first[order]], codes
+
+    def dates(self):
+        """
+        :return: array of date strings
+        """
+        return np.datetime_as_string(self.date, unit='D')
+
+    def keys(self, rows=None):
+        """
+        :param rows: array of row numbers, None for every row
+        :return: list of score cache keys, None for rows without an id
+        """
+        rows = np.arange(len(self)) if rows is None else rows
+        formats = {(SOURCES.index(s), KINDS.index(k)): f for (s, k), f in KEY_FORMATS.items()}
+        return [formats[s, k].format(id) if id else None
+                for s, k, id in zip(self.source[rows].tolist(), self.kind[rows].tolist(), self.id.tolist(rows))]
+
+    @property
+    def nbytes(self):
+        arrays = [self.source, self.sub, self.date, self.kind, self.doc, self.score]
+        if self.cluster is not None:
+            arrays.append(self.cluster)
+        return sum(a.nbytes for a in arrays) + self.id.nbytes + self.text.nbytes
+
+    def frame(self):
+        """
+        :return: df of the table with Python values, for inspection
+        """
+        subs = np.array(self.subs + [None], dtype=object)
+        return pd.DataFrame({'source': pd.Categorical.from_codes(self.source, SOURCES), 'sub': subs[self.sub],
+                             'date': self.dates(), 'id': self.id.tolist(),
+                             'kind': pd.Categorical.from_codes(self.kind, KINDS), 'doc': self.doc,
+                             'text': self.texts(), 'score': self.score})
+
+    def to_dict(self):
+        """
+        :return: dict of json serialisable columns, see from_dict
+        """
+        subs = self.subs + [None]
+        return {'source': [SOURCES[c] for c in self.source], 'sub': [subs[c] for c in self.sub],
+                'date': self.dates().tolist(), 'id': self.id.tolist(), 'kind': [KINDS[c] for c in self.kind],
+                'doc': self.doc.tolist(), 'text': self.texts()}
+
+    @classmethod
+    def from_dict(cls, columns):
+        return cls.from_columns(sub=columns['sub'] if any(s is not None for s in columns['sub']) else None,
+                                **{k: v for k, v in columns.items() if k != 'sub'})
+
+
+class DocumentBuilder:
+    """
+    Collects documents one at a time, e.g. as submissions are fetched, then builds a Documents table
+    """
+
+    def __init__(self, sub=None):
+        self.sub = sub
+        self.columns = {'source': [], 'date': [], 'id': [], 'kind': [], 'doc': [], 'text': []}
+        self.docs = 0
+
+    def _add(self, source, date, id, parts):
+        for kind, text in parts:
+            self.columns['source'].append(source)
+            self.columns['date'].append(date)
+            self.columns['id'].append(id)
+            self.columns['kind'].append(kind)
+            self.columns['doc'].append(self.docs)
+            self.columns['text'].append(text)
+        self.docs += 1
+
+    def add_article(self, date, url, title, content):
+        self._add('news', date, url, [('title', title), ('content', content)])
+
+    def add_post(self, date, id, title, body):
+        self._add('reddit', date, id, [('title', title), ('body', body)])
+
+    def add_comment(self, date, id, body):
+        self._add('reddit', date, id, [('comment', body)])
+
+    def __len__(self):
+        return self.docs
+
+    def build(self):
+        sub = None if self.sub is None else [self.sub] * len(self.columns['doc'])
+        return Documents.from_columns(sub=sub, **self.columns)
@@ -0,0 +1,218 @@
+import math
+import string
+
+from vaderSentiment import vaderSentiment as vader
+
+NEGATE = set(vader.NEGATE)
+# tokens seen are cached with their stripped, lower case and all caps forms, cleared when it gets this big
+TOKEN_CACHE_SIZE = 1000000
+
+
+def _normalize(score, alpha=15):
+    norm_score = score / math.sqrt((score * score) + alpha)
+    return max(-1.0, min(1.0, norm_score))
+
+
+def _negated(word):
+    return word in NEGATE or "n't" in word
+
+
+class FastSentimentAnalyzer:
+    """
+    Compound score only version of VADER's SentimentIntensityAnalyzer giving the same scores. VADER builds
+    a lower case copy of the whole text for every word it checks for negations and idioms, this lower cases
+    each text once, caches the forms of each token and reads the booster, negation and special case tables
+    directly. The neg, neu and pos proportions are not calculated
+    """
+
+    def __init__(self):
+        analyser = vader.SentimentIntensityAnalyzer()
+        # updated in place with custom words, as with SentimentIntensityAnalyzer.lexicon
+        self.lexicon = analyser.lexicon
+        self.emojis = analyser.emojis
+        self.tokens = {}
+
+    def _replace_emojis(self, text):
+        # emojis are swapped for their description, same as VADER
+        parts = []
+        prev_space = True
+        for ch in text:
+            description = self.emojis.get(ch)
+            if description is not None:
+                if not prev_space:
+                    parts.append(' ')
+                parts.append(description)
+                prev_space = False
+            else:
+                parts.append(ch)
+                prev_space = ch == ' '
+        return ''.join(parts)
+
+    def _token(self, token):
+        info = self.tokens.get(token)
+        if info is None:
+            if len(self.tokens) >= TOKEN_CACHE_SIZE:
+                self.tokens.clear()
+            # strip punctuation unless that leaves two or fewer characters, likely an emoticon
+            word = token.strip(string.punctuation)
+            if len(word) <= 2:
+                word = token
+            info = self.tokens[token] = (word.lower(), word.isupper())
+        return info
+
+    def compound(self, text):
+        """
+        Score a text
+        :param text: text to score
+        :return: compound sentiment rounded to 4 places as from SentimentIntensityAnalyzer.polarity_scores
+        """
+        if not isinstance(text, str):
+            raise TypeError('text must be a str')
+        if not text.isascii():
+            text = self._replace_emojis(text)
+        text = text.strip()
+
+        lexicon = self.lexicon
+        boosters = vader.BOOSTER_DICT
+        special_cases = vader.SPECIAL_CASES
+        n_scalar = vader.N_SCALAR
+        c_incr = vader.C_INCR
+        token = self._token
+        tokens = [token(t) for t in text.split()]
+        lowers = [t[0] for t in tokens]
+        uppers = [t[1] for t in tokens]
+        n = len(lowers)
+        caps = sum(uppers)
+        is_cap_diff = 0 < caps < n
+        in_lexicon = [lower in lexicon for lower in lowers]
+
+        sentiments = []
+        for i in range(n):
+            lower = lowers[i]
+            if lower in boosters or (lower == 'kind' and i < n - 1 and lowers[i + 1] == 'of') or not in_lexicon[i]:
+                sentiments.append(0)
+                continue
+
+            valence = lexicon[lower]
+            # "no" next to a lexicon word negates that word rather than counting itself
+            if lower == 'no' and i != n - 1 and in_lexicon[i + 1]:
+                valence = 0.0
+            if (i > 0 and lowers[i - 1] == 'no') or (i > 1 and lowers[i - 2] == 'no') \
+                    or (i > 2 and lowers[i - 3] == 'no' and lowers[i - 1] in ('or', 'nor')):
+                valence = lexicon[lower] * n_scalar
+
+            if uppers[i] and is_cap_diff:
+                if valence > 0:
+                    valence += c_incr
+                else:
+                    valence -= c_incr
+
+            # boosters, dampeners and negations in the three words before
+            for start_i in range(3):
+                j = i - (start_i + 1)
+                if i <= start_i or in_lexicon[j]:
+                    continue
+                s = 0.0
+                if lowers[j] in boosters:
+                    s = boosters[lowers[j]]
+                    if valence < 0:
+                        s *= -1
+                    if uppers[j] and is_cap_diff:
+                        if valence > 0:
+                            s += c_incr
+                        else:
+                            s -= c_incr
+                if start_i == 1 and s != 0:
+                    s = s * 0.95
+                if start_i == 2 and s != 0:
+                    s = s * 0.9
+                valence = valence + s
+
+                if start_i == 0:
+                    if _negated(lowers[i - 1]):
+                        valence = valence * n_scalar
+                elif start_i == 1:
+                    if lowers[i - 2] == 'never' and lowers[i - 1] in ('so', 'this'):
+                        valence = valence * 1.25
+                    elif lowers[i - 2] == 'without' and lowers[i - 1] == 'doubt':
+                        pass
+                    elif _negated(lowers[i - 2]):
+                        valence = valence * n_scalar
+                else:
+                    if (lowers[i - 3] == 'never' and lowers[i - 2] in ('so', 'this')) \
+                            or lowers[i - 1] in ('so', 'this'):
+                        valence = valence * 1.25
+                    elif lowers[i - 3] == 'without' and (lowers[i - 2] == 'doubt' or lowers[i - 1] == 'doubt'):
+                        pass
+                    elif _negated(lowers[i - 3]):
+                        valence = valence * n_scalar
+                    valence = self._special_idioms(valence, lowers, i, special_cases, boosters)
+
+            # "least" negates unless it is "at least" or "very least"
+            if i > 1 and not in_lexicon[i - 1] and lowers[i - 1] == 'least':
+                if lowers[i - 2] != 'at' and lowers[i - 2] != 'very':
+                    valence = valence * n_scalar
+            elif i > 0 and not in_lexicon[i - 1] and lowers[i - 1] == 'least':
+                valence = valence * n_scalar
+            sentiments.append(valence)
+
+        if 'but' in lowers:
+            # kept exactly as VADER does it, including matching scores by value, so the results are the same
+            bi = lowers.index('but')
+            for sentiment in sentiments:
+                si = sentiments.index(sentiment)
+                if si < bi:
+                    sentiments[si] = sentiment * 0.5
+                elif si > bi:
+                    sentiments[si] = sentiment * 1.5
+
+        if not sentiments:
+            return 0.0
+        sum_s = float(sum(sentiments))
+        # emphasis from up to 4 exclamation marks and 2 or more question marks
+        ep_amplifier = min(text.count('!'), 4) * 0.292
+        qm_count = text.count('?')
+        qm_amplifier = 0
+        if qm_count > 1:
+            qm_amplifier = qm_count * 0.18 if qm_count <= 3 else 0.96
+        punct_emph_amplifier = ep_amplifier + qm_amplifier
+        if sum_s > 0:
+            sum_s += punct_emph_amplifier
+        elif sum_s < 0:
+            sum_s -= punct_emph_amplifier
+        return round(_normalize(sum_s), 4)
+
+    @staticmethod
+    def _special_idioms(valence, lowers, i, special_cases, boosters):
+        onezero = lowers[i - 1] + ' ' + lowers[i]
+        twoonezero = lowers[i - 2] + ' ' + onezero
+        twoone = lowers[i - 2] + ' ' + lowers[i - 1]
+        threetwoone = lowers[i - 3] + ' ' + twoone
+        threetwo = lowers[i - 3] + ' ' + lowers[i - 2]
+
+        for seq in (onezero, twoonezero, twoone, threetwoone, threetwo):
+            if seq in special_cases:
+                valence = special_cases[seq]
+                break
+        if len(lowers) - 1 > i:
+            zeroone = lowers[i] + ' ' + lowers[i + 1]
+            if zeroone in special_cases:
+                valence = special_cases[zeroone]
+        if len(lowers) - 1 > i + 1:
+            zeroonetwo = lowers[i] + ' ' + lowers[i + 1] + ' ' + lowers[i + 2]
+            if zeroonetwo in special_cases:
+                valence = special_cases[zeroonetwo]
+
+        # booster phrases such as "sort of" or "kind of"
+        for n_gram in (threetwoone, threetwo, twoone):
+            if n_gram in boosters:
+                valence = valence + boosters[n_gram]
+        return valence
+
+    def polarity_scores(self, text):
+        """
+        Same call as SentimentIntensityAnalyzer.polarity_scores
+        :param text: text to score
+        :return: dict with the compound score only
+        """
+        return {'compound': self.compound(text)}
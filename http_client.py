@@ -0,0 +1,279 @@
+import hashlib
+import json
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from instrumentation import record
+
+# statuses worth retrying, rate limited or a server side error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Allows bursts of up to capacity requests then refills at rate per second
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.
+        self.capacity = capacity or max(per_minute / 60., 1.)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _match_host(table, host):
+    # a setting for example.com also covers api.example.com
+    while host:
+        if host in table:
+            return table[host]
+        host = host.partition('.')[2]
+    return None
+
+
+class ResponseCache:
+    """
+    sqlite backed cache of http responses and other fetched data. Entries are fresh for a ttl set per
+    host or source, stale entries with an ETag or Last-Modified are revalidated with a conditional
+    request. The least recently used entries are evicted once the cache is over max_bytes. In offline
+    mode everything is served from the cache whatever its age
+    """
+
+    def __init__(self, path='http_cache.db', max_bytes=200e6, ttls=None, offline=False):
+        self.ttls = ttls or {}
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status INTEGER, headers TEXT, '
+                          'body BLOB, stored REAL, last_used REAL, size INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.conn.commit()
+
+    def ttl(self, name):
+        """
+        :param name: host or source name
+        :return: seconds an entry stays fresh, 0 if it is not cached
+        """
+        return _match_host(self.ttls, name) or 0
+
+    def get(self, key):
+        """
+        :param key: cache key
+        :return: (stored time, status, case insensitive headers dict, body bytes) or None
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT stored, status, headers, body FROM responses WHERE key = ?',
+                                    (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+        stored, status, headers, body = row
+        # header names are stored in whatever case the server sent them
+        return stored, status, CaseInsensitiveDict(json.loads(headers)), body
+
+    def put(self, key, status, headers, body):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (key, status, json.dumps(dict(headers)), body, now, now, len(body)))
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            # evict least recently used until under size
+            while total > self.max_bytes:
+                row = self.conn.execute('SELECT key, size FROM responses ORDER BY last_used LIMIT 1').fetchone()
+                if row is None or row[0] == key:
+                    break
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (row[0],))
+                total -= row[1]
+            self.conn.commit()
+
+    def touch(self, key):
+        # response revalidated so it is fresh again
+        with self.lock:
+            now = time.time()
+            self.conn.execute('UPDATE responses SET stored = ?, last_used = ? WHERE key = ?', (now, now, key))
+            self.conn.commit()
+
+    def call(self, name, key, fetch, keep=None):
+        """
+        Cache the result of a fetch that does not go through the session, e.g. yfinance downloads
+        :param name: source name used for the ttl
+        :param key: key for this call e.g. ticker and dates
+        :param fetch: zero argument function returning a picklable result
+        :param keep: function of the result giving whether to cache it, e.g. to not cache a failed fetch.
+        None caches every result
+        :return: cached or fetched result
+        """
+        ttl = self.ttl(name)
+        key = name + ':' + key
+        entry = self.get(key) if ttl or self.offline else None
+        if entry is not None and (self.offline or time.time() - entry[0] < ttl):
+            record('cache_hits:' + name)
+            return pickle.loads(entry[3])
+        if self.offline:
+            raise LookupError('offline and {} is not cached'.format(key))
+        result = fetch()
+        if ttl and (keep is None or keep(result)):
+            self.put(key, 0, {}, pickle.dumps(result))
+        return result
+
+
+def _cached_response(url, status, headers, body):
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+    return response
+
+
+class HTTPSession(requests.Session):
+    """
+    requests session shared by the fetchers. Keeps a pool of connections per host, rate limits each host
+    with a token bucket and retries 429 and 5xx responses and connection errors with jittered
+    exponential backoff
+    """
+
+    def __init__(self, rate_limits=None, retries=3, backoff=0.5, max_backoff=60., timeout=30, pool_size=10,
+                 cache=None):
+        super().__init__()
+        self.cache = cache
+        self.buckets = {host: TokenBucket(per_minute) for host, per_minute in (rate_limits or {}).items()}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def _bucket(self, host):
+        return _match_host(self.buckets, host)
+
+    def _wait(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # full jitter so retries from many threads do not line up
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _cache_key(self, method, url, kwargs):
+        # key on the full url with params and any credentials so different users do not share responses
+        prepared = self.prepare_request(requests.Request(method, url, params=kwargs.get('params'),
+                                                         headers=kwargs.get('headers'), auth=kwargs.get('auth')))
+        credentials = [prepared.headers.get(h, '') for h in ('Authorization', 'X-Api-Key')]
+        return prepared.url, hashlib.sha1('\n'.join([prepared.method, prepared.url] + credentials)
+                                          .encode('utf-8')).hexdigest()
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).hostname or ''
+        if self.cache is None or method.upper() != 'GET' or not (self.cache.ttl(host) or self.cache.offline):
+            return self._send(method, url, host, **kwargs)
+
+        full_url, key = self._cache_key(method, url, kwargs)
+        entry = self.cache.get(key)
+        if entry is not None and (self.cache.offline or time.time() - entry[0] < self.cache.ttl(host)):
+            record('cache_hits:' + host)
+            return _cached_response(full_url, *entry[1:])
+        if self.cache.offline:
+            raise requests.ConnectionError('offline and {} is not cached'.format(full_url))
+
+        if entry is not None:
+            # stale, ask the server whether it has changed
+            headers = dict(kwargs.get('headers') or {})
+            if 'ETag' in entry[2]:
+                headers['If-None-Match'] = entry[2]['ETag']
+            if 'Last-Modified' in entry[2]:
+                headers['If-Modified-Since'] = entry[2]['Last-Modified']
+            kwargs['headers'] = headers
+
+        response = self._send(method, url, host, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            record('cache_revalidated:' + host)
+            self.cache.touch(key)
+            return _cached_response(full_url, *entry[1:])
+        if response.status_code == 200:
+            self.cache.put(key, response.status_code, response.headers, response.content)
+        return response
+
+    def _send(self, method, url, host, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        bucket = self._bucket(host)
+        for attempt in range(self.retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            record('http_calls:' + host)
+            try:
+                response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                wait = self._wait(attempt)
+                print('error requesting {}, retrying in {:.1f}s: {}'.format(host, wait, e))
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+                wait = self._wait(attempt, response)
+                print('{} from {}, retrying in {:.1f}s'.format(response.status_code, host, wait))
+            record('http_retries:' + host)
+            time.sleep(wait)
+
+
+_session = None
+_session_config = None
+_session_lock = threading.Lock()
+
+
+def get_session(http_config=None):
+    """
+    Get the shared session, building it on first use or when the config changes
+    :param http_config: HTTP section of config.yaml, None to keep the current settings
+    :return: HTTPSession
+    """
+    global _session, _session_config
+    with _session_lock:
+        if _session is None or (http_config is not None and http_config != _session_config):
+            http_config = http_config or {}
+            cache_config = http_config.get('cache')
+            cache = None
+            if cache_config:
+                cache = ResponseCache(path=cache_config.get('path', 'http_cache.db'),
+                                      max_bytes=cache_config.get('max_size_mb', 200) * 1e6,
+                                      ttls=cache_config.get('ttl'), offline=cache_config.get('offline', False))
+            _session = HTTPSession(rate_limits=http_config.get('rate_limits'),
+                                   retries=http_config.get('retries', 3),
+                                   backoff=http_config.get('backoff', 0.5),
+                                   max_backoff=http_config.get('max_backoff', 60.),
+                                   timeout=http_config.get('timeout', 30),
+                                   pool_size=http_config.get('pool_size', 10),
+                                   cache=cache)
+            _session_config = http_config
+        return _session
@@ -0,0 +1,242 @@
+import cProfile
+import contextvars
+import datetime as dt
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class RunReport:
+    """
+    Stage timings and counters for one run_sentiment run. Thread safe so stages running on fetch threads
+    can record into it. Wall time is per stage, cpu time is for the thread the stage ran on
+    """
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.started = dt.datetime.now()
+        self.lock = threading.Lock()
+        self.stages = {}  # name: {'wall': seconds, 'cpu': seconds, 'calls': n}
+        self.counters = {}  # name: count
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the run
+        :param name: stage name, times add up if a stage runs more than once
+        """
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            with self.lock:
+                stage = self.stages.setdefault(name, {'wall': 0., 'cpu': 0., 'calls': 0})
+                stage['wall'] += wall
+                stage['cpu'] += cpu
+                stage['calls'] += 1
+
+    def count(self, name, n=1):
+        """
+        Add to a counter e.g. documents fetched, http calls, retries or cache hits
+        :param name: counter name
+        :param n: amount to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'ticker': self.ticker,
+                'started': self.started.isoformat(),
+                'wall': (dt.datetime.now() - self.started).total_seconds(),
+                'stages': {k: dict(v) for k, v in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def save(self, report_dir):
+        """
+        Write the report as json
+        :param report_dir: directory for reports
+        :return: report filename
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        filename = os.path.join(report_dir, '{}_{}.json'.format(self.ticker, self.started.strftime('%Y%m%dT%H%M%S')))
+        with open(filename, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+        return filename
+
+    def summary(self):
+        lines = ['run report for ' + self.ticker]
+        for name, stage in sorted(self.to_dict()['stages'].items(), key=lambda s: -s[1]['wall']):
+            lines.append('  {:<28} wall {:8.2f}s  cpu {:8.2f}s'.format(name, stage['wall'], stage['cpu']))
+        for name, n in sorted(self.counters.items()):
+            lines.append('  {:<28} {}'.format(name, n))
+        return '\n'.join(lines)
+
+
+class MetricsRegistry:
+    """
+    Totals across every run in the process, exposed in prometheus text format
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_seconds = {}  # (stage, kind): seconds
+        self.stage_calls = {}  # stage: n
+        self.counters = {}  # name: count
+        self.runs = 0
+
+    def count(self, name, n=1):
+        """
+        Add to a counter outside of any run e.g. http retries on the shared session
+        :param name: counter name
+        :param n: amount to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add(self, report):
+        data = report.to_dict()
+        with self.lock:
+            self.runs += 1
+            for name, stage in data['stages'].items():
+                for kind in ('wall', 'cpu'):
+                    self.stage_seconds[name, kind] = self.stage_seconds.get((name, kind), 0.) + stage[kind]
+                self.stage_calls[name] = self.stage_calls.get(name, 0) + stage['calls']
+            for name, n in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def prometheus(self):
+        with self.lock:
+            lines = ['# TYPE stock_sentiment_runs_total counter',
+                     'stock_sentiment_runs_total {}'.format(self.runs),
+                     '# TYPE stock_sentiment_stage_seconds_total counter']
+            for (name, kind), seconds in sorted(self.stage_seconds.items()):
+                lines.append('stock_sentiment_stage_seconds_total{{stage="{}",kind="{}"}} {}'.format(name, kind,
+                                                                                                    seconds))
+            lines.append('# TYPE stock_sentiment_stage_calls_total counter')
+            for name, n in sorted(self.stage_calls.items()):
+                lines.append('stock_sentiment_stage_calls_total{{stage="{}"}} {}'.format(name, n))
+            lines.append('# TYPE stock_sentiment_events_total counter')
+            for name, n in sorted(self.counters.items()):
+                lines.append('stock_sentiment_events_total{{event="{}"}} {}'.format(name, n))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# report of the run the current code is part of, set by reporting and carried to threads started with submit
+_active_report = contextvars.ContextVar('active_report', default=None)
+
+
+@contextmanager
+def reporting(report):
+    """
+    Make a report the active report for the code in the block, see record
+    :param report: RunReport
+    """
+    token = _active_report.set(report)
+    try:
+        yield report
+    finally:
+        _active_report.reset(token)
+
+
+def record(name, n=1):
+    """
+    Add to a counter of the active run's report, or to the registry outside of a run. Runs are added to
+    the registry when they finish so nothing is counted twice
+    :param name: counter name
+    :param n: amount to add
+    """
+    report = _active_report.get()
+    if report is None:
+        REGISTRY.count(name, n)
+    else:
+        report.count(name, n)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    Submit a call to an executor, keeping the active report on the thread it runs on
+    :param executor: concurrent.futures executor
+    :param fn: function to call
+    :return: future
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+_metrics_server = None
+
+
+def start_metrics_server(port, registry=REGISTRY):
+    """
+    Serve the registry on /metrics for prometheus to scrape. Only starts once per process
+    :param port: port to listen on
+    :param registry: registry to serve
+    """
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _metrics_server = HTTPServer(('', port), Handler)
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    print('serving metrics on port', port)
+    return _metrics_server
+
+
+@contextmanager
+def profile(filename, profiler='cprofile'):
+    """
+    Profile the code in the block and dump the result. cProfile only sees the calling thread, pyinstrument
+    (if installed) writes an html report
+    :param filename: output filename without extension
+    :param profiler: 'cprofile' or 'pyinstrument'
+    """
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print('pyinstrument is not installed, using cProfile')
+        else:
+            p = Profiler()
+            p.start()
+            try:
+                yield
+            finally:
+                p.stop()
+                with open(filename + '.html', 'w') as file:
+                    file.write(p.output_html())
+                print('profile saved to', filename + '.html')
+            return
+
+    p = cProfile.Profile()
+    p.enable()
+    try:
+        yield
+    finally:
+        p.disable()
+        p.dump_stats(filename + '.prof')
+        print('profile saved to', filename + '.prof')
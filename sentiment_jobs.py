@@ -0,0 +1,81 @@
+import datetime as dt
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stock_funcs as sf
+
+
+class SentimentJobs:
+    """
+    Runs run_sentiment in background threads so the dashboard does not block on it. Runs write their
+    results to the sentiment store, so only the time each job finished is kept, for ttl seconds keyed on
+    ticker and day. Requests for a ticker already running share the same job. Every job scores on the
+    same pool, made once when the app loads rather than forked from a server thread for each run
+    """
+
+    def __init__(self, workers=2, ttl=3600, run=sf.run_sentiment, pool=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.ttl = ttl
+        self.run = run
+        self.pool = pool  # multiprocessing pool from make_score_pool, None for each run to make its own
+        self.lock = threading.RLock()
+        self.running = {}  # key: future
+        self.done = {}  # key: finished time
+        self.failed = set()
+
+    @staticmethod
+    def key(ticker):
+        return ticker.upper(), dt.date.today().strftime('%Y-%m-%d')
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [k for k, finished in self.done.items() if now - finished > self.ttl]:
+            del self.done[key]
+
+    def submit(self, ticker):
+        """
+        Start a job for a ticker unless it already has a result for today or is running
+        :param ticker: stock ticker
+        :return: job key
+        """
+        key = self.key(ticker)
+        with self.lock:
+            self._expire()
+            if key in self.done or key in self.running:
+                return key
+            self.failed.discard(key)
+            future = self.executor.submit(self.run, key[0], pool=self.pool)
+            self.running[key] = future
+        # added outside the lock as it runs straight away if the job has already finished
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return key
+
+    def _finish(self, key, future):
+        try:
+            data = future.result()
+        except Exception as e:
+            print('error running sentiment for: ', key[0])
+            print(e)
+            data = None
+        with self.lock:
+            self.running.pop(key, None)
+            if data is None or data.empty:
+                self.failed.add(key)
+            else:
+                self.done[key] = time.monotonic()
+
+    def status(self, key):
+        """
+        :param key: job key from submit
+        :return: 'running', 'done' or 'failed'
+        """
+        key = tuple(key)
+        with self.lock:
+            self._expire()
+            if key in self.done:
+                return 'done'
+            if key in self.running:
+                return 'running'
+            return 'failed'
+
@@ -0,0 +1,307 @@
+import sqlite3
+import hashlib
+import time
+import pandas as pd
+import numpy as np
+
+# columns stored for each ticker and date, same order as the old <TICKER>_sentiment.csv files
+COLUMNS = ['reddit', 'news', 'mean', 'twitter', 'open', 'high', 'low', 'close', 'vol']
+
+# daily price columns as downloaded from yfinance and the column each is stored in
+PRICE_COLUMNS = {'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Adj Close': 'adj_close',
+                 'Volume': 'volume'}
+
+
+def connect(path='sentiment.db'):
+    """
+    Open the local sentiment store, creating the table if needed
+    :param path: sqlite database file
+    :return: sqlite3 connection
+    """
+    # batch runs write from several threads so wait on locks rather than fail
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS sentiment (ticker TEXT NOT NULL, date TEXT NOT NULL, '
+        + ', '.join('"{}" REAL'.format(c) for c in COLUMNS)
+        + ', PRIMARY KEY (ticker, date)) WITHOUT ROWID')
+    # scored documents keyed on source and document id, see cached_scores
+    conn.execute('CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, hash TEXT NOT NULL, score REAL, '
+                 'last_used REAL NOT NULL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS documents_last_used ON documents (last_used)')
+    # daily price history and the date range downloaded for each ticker, see read_prices
+    conn.execute('CREATE TABLE IF NOT EXISTS prices (ticker TEXT NOT NULL, date TEXT NOT NULL, '
+                 + ', '.join('"{}" REAL'.format(c) for c in PRICE_COLUMNS.values())
+                 + ', PRIMARY KEY (ticker, date)) WITHOUT ROWID')
+    conn.execute('CREATE TABLE IF NOT EXISTS price_ranges (ticker TEXT PRIMARY KEY, start TEXT NOT NULL, '
+                 'end TEXT NOT NULL)')
+    # running sentiment totals from streaming mode per time bucket, see add_intraday
+    conn.execute('CREATE TABLE IF NOT EXISTS intraday (ticker TEXT NOT NULL, resolution INTEGER NOT NULL, '
+                 'bucket INTEGER NOT NULL, source TEXT NOT NULL, count INTEGER NOT NULL, sum REAL NOT NULL, '
+                 'sumsq REAL NOT NULL, PRIMARY KEY (ticker, resolution, bucket, source)) WITHOUT ROWID')
+    conn.commit()
+    return conn
+
+
+def _value(v):
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(v) else v
+
+
+def upsert(conn, ticker, sent_data):
+    """
+    Insert or replace rows for a ticker
+    :param conn: store connection
+    :param ticker: stock ticker
+    :param sent_data: dict of date: dict of column values, as built by get_final_sentiment
+    :return: number of rows written
+    """
+    rows = [(ticker, d) + tuple(_value(v.get(c)) for c in COLUMNS) for d, v in sent_data.items()]
+    conn.executemany(
+        'INSERT OR REPLACE INTO sentiment (ticker, date, ' + ', '.join('"{}"'.format(c) for c in COLUMNS)
+        + ') VALUES (' + ', '.join('?' * (len(COLUMNS) + 2)) + ')', rows)
+    conn.commit()
+    return len(rows)
+
+
+def latest_date(conn, ticker):
+    """
+    Get the last stored date for a ticker. Uses the primary key index, no table scan
+    :param conn: store connection
+    :param ticker: stock ticker
+    :return: date string YYYY-MM-DD or None if nothing is stored
+    """
+    row = conn.execute('SELECT MAX(date) FROM sentiment WHERE ticker = ?', (ticker,)).fetchone()
+    return row[0]
+
+
+def read(conn, ticker, start=None, end=None):
+    """
+    Read stored rows for a ticker between dates
+    :param conn: store connection
+    :param ticker: stock ticker
+    :param start: first date string to include, None for the start of history
+    :param end: last date string to include, None for the end of history
+    :return: df with a date column and one column per stored value, same layout as the csv files
+    """
+    query = 'SELECT date, ' + ', '.join('"{}"'.format(c) for c in COLUMNS) + ' FROM sentiment WHERE ticker = ?'
+    params = [ticker]
+    if start is not None:
+        query += ' AND date >= ?'
+        params.append(start)
+    if end is not None:
+        query += ' AND date <= ?'
+        params.append(end)
+    query += ' ORDER BY date'
+    data = pd.read_sql_query(query, conn, params=params)
+    data[COLUMNS] = data[COLUMNS].astype(float)
+    return data
+
+
+def read_many(conn, tickers, start=None, end=None):
+    """
+    Read stored rows for several tickers in one query
+    :param conn: store connection
+    :param tickers: list of tickers
+    :param start: first date string to include, None for the start of history
+    :param end: last date string to include, None for the end of history
+    :return: df with ticker and date columns and one column per stored value
+    """
+    tickers = list(tickers)
+    query = 'SELECT ticker, date, ' + ', '.join('"{}"'.format(c) for c in COLUMNS) \
+            + ' FROM sentiment WHERE ticker IN (' + ', '.join('?' * len(tickers)) + ')'
+    params = tickers
+    if start is not None:
+        query += ' AND date >= ?'
+        params.append(start)
+    if end is not None:
+        query += ' AND date <= ?'
+        params.append(end)
+    query += ' ORDER BY ticker, date'
+    data = pd.read_sql_query(query, conn, params=params)
+    data[COLUMNS] = data[COLUMNS].astype(float)
+    return data
+
+
+def import_csv(conn, ticker, filename):
+    """
+    Import an old <TICKER>_sentiment.csv into the store. Duplicate dates from appended re-runs
+    keep the last row written
+    :param conn: store connection
+    :param ticker: stock ticker
+    :param filename: csv filename
+    :return: number of rows imported
+    """
+    data = pd.read_csv(filename)
+    # appended rows were written without a header so the first column is always the date
+    data = data.rename(columns={data.columns[0]: 'date'})
+    data = data.drop_duplicates(subset='date', keep='last').set_index('date')
+    return upsert(conn, ticker, data.to_dict(orient='index'))
+
+
+def text_hash(text, version=''):
+    # texts can be given as str or already utf-8 encoded. The scorer version is hashed in with the text so
+    # a score cached by a different lexicon does not match
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return hashlib.sha1(version.encode('utf-8') + text).hexdigest()
+
+
+def cached_scores(conn, docs, batch=500, version=''):
+    """
+    Look up cached sentiment scores. A document only hits if its text and the scorer are unchanged since it
+    was scored
+    :param conn: store connection
+    :param docs: list of (key, text), key being the source and id e.g. article url or reddit id, text as str or
+    utf-8 bytes
+    :param batch: number of keys per query
+    :param version: version of the scorer, see SentimentScorer.version
+    :return: dict of key: score for documents that hit
+    """
+    hashes = {key: text_hash(text, version) for key, text in docs}
+    keys = list(hashes)
+    hits = {}
+    for i in range(0, len(keys), batch):
+        chunk = keys[i:i + batch]
+        rows = conn.execute('SELECT key, hash, score FROM documents WHERE key IN ('
+                            + ', '.join('?' * len(chunk)) + ')', chunk)
+        for key, h, score in rows:
+            if h == hashes[key]:
+                hits[key] = np.nan if score is None else score
+
+    # mark hits as recently used so they are evicted last
+    now = time.time()
+    conn.executemany('UPDATE documents SET last_used = ? WHERE key = ?', [(now, key) for key in hits])
+    conn.commit()
+    return hits
+
+
+def cache_scores(conn, docs, max_entries=None, version=''):
+    """
+    Store sentiment scores for documents, evicting the least recently used when over size
+    :param conn: store connection
+    :param docs: list of (key, text, score), text as str or utf-8 bytes
+    :param max_entries: maximum documents kept, None for no limit
+    :param version: version of the scorer that gave the scores, see SentimentScorer.version
+    """
+    now = time.time()
+    conn.executemany('INSERT OR REPLACE INTO documents (key, hash, score, last_used) VALUES (?, ?, ?, ?)',
+                     [(key, text_hash(text, version), _value(score), now) for key, text, score in docs])
+    if max_entries is not None:
+        count = conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        if count > max_entries:
+            conn.execute('DELETE FROM documents WHERE key IN '
+                         '(SELECT key FROM documents ORDER BY last_used LIMIT ?)', (count - max_entries,))
+    conn.commit()
+
+
+def price_range(conn, ticker):
+    """
+    Get the dates price history has been downloaded for. Days with no rows in the range are non trading days
+    :param conn: store connection
+    :param ticker: stock ticker
+    :return: (start, end) date strings, end exclusive as for yfinance, or None if nothing is stored
+    """
+    row = conn.execute('SELECT start, end FROM price_ranges WHERE ticker = ?', (ticker,)).fetchone()
+    return None if row is None else tuple(row)
+
+
+def upsert_prices(conn, ticker, data, start, end):
+    """
+    Store downloaded price history and extend the range covered for a ticker. A failed download comes back
+    empty or all nan so the range is only extended when rows came back, and only up to the last of them
+    :param conn: store connection
+    :param ticker: stock ticker
+    :param data: df of price data indexed by date, as from yf.download
+    :param start: first date string the download covered
+    :param end: end date string the download covered, exclusive
+    :return: number of rows written
+    """
+    data = data.reindex(columns=list(PRICE_COLUMNS)).dropna(how='all')
+    if data.empty:
+        return 0
+    dates = pd.to_datetime(data.index).strftime('%Y-%m-%d')
+    # days after the last row may just not be published yet, leave them to be downloaded again
+    end = min(end, (pd.Timestamp(dates.max()) + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+    values = data.to_numpy(dtype=float)
+    rows = [(ticker, d) + tuple(None if np.isnan(v) else v for v in row) for d, row in zip(dates, values)]
+    conn.executemany('INSERT OR REPLACE INTO prices (ticker, date, '
+                     + ', '.join('"{}"'.format(c) for c in PRICE_COLUMNS.values())
+                     + ') VALUES (' + ', '.join('?' * (len(PRICE_COLUMNS) + 2)) + ')', rows)
+    covered = price_range(conn, ticker)
+    if covered is not None:
+        start, end = min(start, covered[0]), max(end, covered[1])
+    conn.execute('INSERT OR REPLACE INTO price_ranges VALUES (?, ?, ?)', (ticker, start, end))
+    conn.commit()
+    return len(rows)
+
+
+def read_prices(conn, ticker, start=None, end=None):
+    """
+    Read stored price history for a ticker between dates
+    :param conn: store connection
+    :param ticker: stock ticker
+    :param start: first date string to include, None for the start of history
+    :param end: end date string, exclusive as for yfinance, None for the end of history
+    :return: df indexed by date with the same columns as yf.download
+    """
+    query = 'SELECT date, ' + ', '.join('"{}"'.format(c) for c in PRICE_COLUMNS.values()) \
+            + ' FROM prices WHERE ticker = ?'
+    params = [ticker]
+    if start is not None:
+        query += ' AND date >= ?'
+        params.append(start)
+    if end is not None:
+        query += ' AND date < ?'
+        params.append(end)
+    query += ' ORDER BY date'
+    data = pd.read_sql_query(query, conn, params=params, index_col='date')
+    data.index = pd.to_datetime(data.index)
+    data.index.name = 'Date'
+    return data.rename(columns={v: k for k, v in PRICE_COLUMNS.items()}).astype(float)
+
+
+def add_intraday(conn, rows):
+    """
+    Add streamed sentiment totals to the stored totals of their time buckets
+    :param conn: store connection
+    :param rows: list of (ticker, resolution, bucket, source, count, sum, sum of squares), resolution being
+    the bucket length in seconds and bucket its start as a unix time
+    :return: number of rows written
+    """
+    conn.executemany('INSERT INTO intraday VALUES (?, ?, ?, ?, ?, ?, ?) '
+                     'ON CONFLICT (ticker, resolution, bucket, source) DO UPDATE SET '
+                     'count = count + excluded.count, sum = sum + excluded.sum, sumsq = sumsq + excluded.sumsq',
+                     rows)
+    conn.commit()
+    return len(rows)
+
+
+def read_intraday(conn, ticker, resolution, start=None, end=None):
+    """
+    Read streamed sentiment for a ticker between buckets
+    :param conn: store connection
+    :param ticker: stock ticker
+    :param resolution: bucket length in seconds
+    :param start: first bucket to include as a unix time, None for the start
+    :param end: bucket to stop before as a unix time, None for the end
+    :return: df of bucket, source, count, sum, sumsq and the mean and standard deviation of sentiment
+    """
+    query = 'SELECT bucket, source, count, sum, sumsq FROM intraday WHERE ticker = ? AND resolution = ?'
+    params = [ticker, resolution]
+    if start is not None:
+        query += ' AND bucket >= ?'
+        params.append(int(start))
+    if end is not None:
+        query += ' AND bucket < ?'
+        params.append(int(end))
+    query += ' ORDER BY bucket, source'
+    data = pd.read_sql_query(query, conn, params=params)
+    count = data['count'].astype(float)
+    data['mean'] = data['sum'] / count
+    # sample standard deviation from the totals, clipped as rounding can take the variance just under 0
+    variance = (data['sumsq'] - count * data['mean'] ** 2) / (count - 1)
+    data['std'] = np.sqrt(variance.clip(lower=0).where(count > 1))
+    return data
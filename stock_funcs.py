@@ -1,15 +1,22 @@
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import requests
-from newsapi import NewsApiClient
+# vaderSentiment, newsapi, praw, psaw and yfinance are slow to import so are imported where first used,
+# a run that only reads the store or a scoring worker does not pay for the clients it never uses
 import datetime as dt
-import praw
-from psaw import PushshiftAPI
 import pandas as pd
 import os
+import re
+import multiprocessing
+import threading
+import time
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import numpy as np
-import yfinance as yf
-from dash.dependencies import Input, Output, State
 import yaml
+import sentiment_store as store
+from dedupe import MinHashLSH, components
+from documents import Documents, DocumentBuilder, SOURCES, KINDS
+from instrumentation import RunReport, REGISTRY, start_metrics_server, profile, reporting, record, submit
+from http_client import get_session
 
 def get_twtr_sentiment(ticker, apikey):
     """
@@ -24,12 +31,10 @@ def get_twtr_sentiment(ticker, apikey):
     :param ticker: stock ticker
     :return: score and avg data for 7, 14 and 30 days
     """
-    
 
-    response = requests.get("https://socialsentiment.io/api/v1/stocks/"+ticker+"/sentiment/daily/",
-                headers={"Authorization": apikey, "Accept": "application/json"})
 
-    data = response.json()
+    response = get_session().get("https://socialsentiment.io/api/v1/stocks/"+ticker+"/sentiment/daily/",
+                headers={"Authorization": apikey, "Accept": "application/json"})
 
     dates = []
     avg_7_days = []
@@ -37,6 +42,12 @@ def get_twtr_sentiment(ticker, apikey):
     avg_30_days = []
     scores = []
 
+    # still failing after retries, the body is an error message not sentiment
+    if response.status_code != 200:
+        return response.status_code, dates, scores, avg_7_days, avg_14_days, avg_30_days
+
+    data = response.json()
+
     for i, d in enumerate(data):
         avg_7_days.append(d['avg_7_days'])
         avg_14_days.append(d['avg_14_days'])
@@ -47,31 +58,264 @@ def get_twtr_sentiment(ticker, apikey):
     return response.status_code, dates, scores, avg_7_days, avg_14_days, avg_30_days
 
 
+# custom trading terms merged into the VADER lexicon, overridden by SENTIMENT.customwords in config.yaml
+DEFAULT_CUSTOMWORDS = {
+    'call': 4.0,
+    'put': -4.0,
+    'buy': 4.0,
+    'sell': -4.0,
+    'calls': 4.0,
+    'puts': -4.0,
+    'tendies': 4.0,
+}
+
+_scorer = None
+
+
+class SentimentScorer:
+    """
+    VADER analyser with the custom lexicon merged in. Loading the VADER lexicon is slow so build this
+    once per process (see get_scorer) and reuse it for every text. The 'fast' engine gives the same
+    compound scores as 'vader' in a fraction of the time, see fast_vader
+    """
+
+    def __init__(self, customwords=None, engine='vader'):
+        if customwords is None:
+            customwords = DEFAULT_CUSTOMWORDS
+        self.customwords = dict(customwords)
+        self.engine = engine
+        if engine == 'fast':
+            from fast_vader import FastSentimentAnalyzer
+            self.analyser = FastSentimentAnalyzer()
+        elif engine == 'vader':
+            from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+            self.analyser = SentimentIntensityAnalyzer()
+        else:
+            raise ValueError('unknown sentiment engine: {}'.format(engine))
+        self.analyser.lexicon.update(self.customwords)
+        # both engines give the same scores from the same lexicon, so cached scores are kept across engines but
+        # not across lexicons or custom words
+        from importlib.metadata import version
+        self.version = store.text_hash(repr((version('vaderSentiment'), sorted(self.customwords.items()))))
+
+    def score(self, sentence):
+        """
+        Analyse sentiment of a sentence
+        :param sentence: text to score
+        :return: compound sentiment, nan if it cannot be scored
+        """
+        try:
+            return self.analyser.polarity_scores(sentence)['compound']
+        except:
+            return np.nan
+
+    def score_many(self, texts):
+        """
+        Analyse sentiment of a batch of texts
+        :param texts: iterable of texts
+        :return: list of compound sentiment, one per text
+        """
+        score = self.score
+        return [score(text) for text in texts]
+
+
+def get_scorer(customwords=None, engine=None):
+    """
+    Get the shared scorer, building it on first use or when the custom words or engine change
+    :param customwords: dict of word: valence to merge into the lexicon, None to keep the current words
+    :param engine: 'vader' or 'fast', None to keep the current engine
+    :return: SentimentScorer
+    """
+    global _scorer
+    if _scorer is None or (customwords is not None and dict(customwords) != _scorer.customwords) \
+            or (engine is not None and engine != _scorer.engine):
+        if _scorer is not None:
+            customwords = _scorer.customwords if customwords is None else customwords
+            engine = engine or _scorer.engine
+        _scorer = SentimentScorer(customwords, engine or 'vader')
+    return _scorer
+
+
 def sentiment_analyzer_scores(sentence):
     """
     Analyse sentiment of a sentence
     :param sentence:
     :return: compound sentiment
     """
-    analyser = SentimentIntensityAnalyzer()
+    return get_scorer().score(sentence)
 
-    customwords = {
-        'call': 4.0,
-        'put': -4.0,
-        'buy': 4.0,
-        'sell': -4.0,
-        'calls': 4.0,
-        'puts': -4.0,
-        'tendies': 4.0,
-    }
 
-    analyser.lexicon.update(customwords)
+def _init_score_worker(customwords, engine):
+    """
+    Process pool initialiser, builds the scorer once per worker
+    :param customwords: custom words used by the parent scorer
+    :param engine: engine used by the parent scorer
+    """
+    get_scorer(customwords, engine)
 
+
+def _score_chunk(texts):
+    return get_scorer().score_many(texts)
+
+
+def make_score_pool(workers=None):
+    """
+    Make a process pool for scoring whose workers load the current scorer once
+    :param workers: number of worker processes, None or 0 for every core
+    :return: multiprocessing pool
+    """
+    if not workers:
+        workers = os.cpu_count() or 1
+    scorer = get_scorer()
+    return multiprocessing.Pool(workers, initializer=_init_score_worker, initargs=(scorer.customwords, scorer.engine))
+
+
+def score_texts(texts, workers=None, chunksize=500, pool=None):
+    """
+    Score a batch of texts, fanning chunks out to a process pool when there is enough work
+    :param texts: list of texts
+    :param workers: number of worker processes, None or 0 for every core
+    :param chunksize: number of texts sent to a worker at a time
+    :param pool: existing pool from make_score_pool to use, one is made for this batch if None
+    :return: list of compound sentiment in the same order as texts
+    """
+    texts = list(texts)
+    if not workers:
+        workers = os.cpu_count() or 1
+    chunksize = max(int(chunksize), 1)
+    if (pool is None and workers <= 1) or len(texts) <= chunksize:
+        return get_scorer().score_many(texts)
+
+    chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+    own_pool = pool is None
+    if own_pool:
+        pool = make_score_pool(min(workers, len(chunks)))
+    scores = []
     try:
-        score = analyser.polarity_scores(sentence)
-        return score['compound']
-    except:
-        return np.nan
+        # map keeps chunk order so scores line up with texts
+        for chunk_scores in pool.map(_score_chunk, chunks):
+            scores.extend(chunk_scores)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+    return scores
+
+
+def cluster_documents(docs, settings=None, report=None, batch=50000):
+    """
+    Group exact and near duplicate news and reddit texts, e.g. syndicated articles and copy pasted comments
+    :param docs: Documents of the run, its cluster column is set
+    :param settings: dict of dedupe.MinHashLSH settings e.g. threshold
+    :param report: RunReport to count duplicates in
+    :param batch: distinct texts read out of the table at a time to fingerprint
+    :return: array of the row of each row's representative text
+    """
+    lsh = MinHashLSH(**(settings or {}))
+    first, codes = docs.unique_texts()
+    # only the signatures are kept, the texts are read out a batch at a time
+    fingerprinted = [np.empty(0, dtype=np.int64)]
+    signatures = [np.empty((0, lsh.num_perm), dtype=np.uint32)]
+    for start in range(0, len(first), batch):
+        texts = docs.texts(first[start:start + batch])
+        long_enough = [i for i, text in enumerate(texts) if len(text.split()) >= lsh.min_words]
+        fingerprinted.append(start + np.array(long_enough, dtype=np.int64))
+        signatures.append(lsh.signatures([texts[i] for i in long_enough]))
+    pairs = np.concatenate(fingerprinted)[lsh.similar_pairs(np.concatenate(signatures))]
+    # distinct texts are numbered in order of their first row so each cluster is represented by its first row
+    reps = np.asarray(components(len(first), pairs.tolist()), dtype=np.int64)
+
+    docs.cluster = np.empty(len(docs), dtype=np.int64)
+    valid = codes >= 0
+    docs.cluster[valid] = first[reps[codes[valid]]]
+    missing = np.flatnonzero(~valid)
+    docs.cluster[missing] = missing[:1]
+    unique = len(first) + min(len(missing), 1)
+    clusters = len(np.unique(docs.cluster))
+    print('{} texts, {} unique, {} after collapsing near duplicates'.format(len(docs), unique, clusters))
+    if report is not None:
+        report.count('texts_exact_duplicates', len(docs) - unique)
+        report.count('texts_near_duplicates', unique - clusters)
+    return docs.cluster
+
+
+def score_all(docs, workers=None, chunksize=500, pool=None, conn=None, max_cached=None, report=None, batch=50000):
+    """
+    Score every news and reddit text for a run in one batch
+    :param docs: Documents of the run, its score column is filled in
+    :param workers: number of worker processes, None or 0 for every core
+    :param chunksize: number of texts sent to a worker at a time
+    :param pool: existing pool from make_score_pool to use
+    :param conn: sentiment store connection used to cache scores between runs, None to score everything
+    :param max_cached: maximum documents kept in the score cache, None for no limit
+    :param report: RunReport to count cache hits and texts scored in
+    :param batch: rows read out of the table at a time, only that many texts are held as Python strings
+    :return: array of compound sentiment per row. Once clustered with cluster_documents near duplicates are
+    given the score of their representative instead of being scored
+    """
+    # identical texts get identical scores so only score each once. Texts that are None stay nan
+    first, codes = docs.unique_texts()
+    unique_scores = np.full(len(first), np.nan)
+    known = np.zeros(len(first), dtype=bool)
+
+    hit = np.zeros(len(docs), dtype=bool)
+    if conn is not None:
+        version = get_scorer().version
+        for start in range(0, len(docs), batch):
+            chunk = np.arange(start, min(start + batch, len(docs)))
+            keys = docs.keys(chunk)
+            cached = store.cached_scores(conn, [(key, text) for key, text in zip(keys, docs.text.tolist(chunk, False))
+                                                if key is not None and text is not None], version=version)
+            found = [i for i, key in enumerate(keys) if key in cached]
+            hit[chunk[found]] = True
+            unique_scores[codes[chunk[found]]] = [cached[keys[i]] for i in found]
+            known[codes[chunk[found]]] = True
+        totals = np.bincount(docs.source, minlength=len(SOURCES))
+        hits = np.bincount(docs.source[hit], minlength=len(SOURCES))
+        for source, total, n in zip(SOURCES, totals, hits):
+            if not total:
+                continue
+            print('score cache hits for {}: {}/{} ({:.1f}%)'.format(source, n, total, 100. * n / total))
+            if report is not None:
+                report.count('score_cache_hits:' + source, int(n))
+                report.count('score_cache_lookups:' + source, int(total))
+
+    # each unique text is scored as the text representing its cluster, itself unless clustered
+    rep = np.arange(len(first))
+    if docs.cluster is not None:
+        rep = codes[docs.cluster[first]]
+    todo = np.unique(rep[~known])
+    todo = todo[~known[todo]]
+    print('scoring sentiment for texts: ', len(todo))
+    if report is not None:
+        report.count('texts_scored', len(todo))
+    # with more than one batch the pool is made once for all of them rather than once per batch
+    own_pool = pool is None and len(todo) > batch and (workers or os.cpu_count() or 1) > 1
+    if own_pool:
+        pool = make_score_pool(workers)
+    try:
+        for start in range(0, len(todo), batch):
+            chunk = todo[start:start + batch]
+            unique_scores[chunk] = score_texts(docs.texts(first[chunk]), workers=workers, chunksize=chunksize,
+                                               pool=pool)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+    # near duplicates given their representative's score are not cached, it is not their own score
+    exact = known | (rep == np.arange(len(first)))
+    unique_scores[~known] = unique_scores[rep[~known]]
+    docs.score = np.where(codes >= 0, unique_scores[codes], np.nan)
+
+    if conn is not None:
+        for start in range(0, len(docs), batch):
+            chunk = np.arange(start, min(start + batch, len(docs)))
+            chunk = chunk[~hit[chunk] & docs.text.valid[chunk]]
+            chunk = chunk[exact[codes[chunk]]]
+            new_docs = {key: (key, text, score) for key, text, score in zip(
+                docs.keys(chunk), docs.text.tolist(chunk, False), docs.score[chunk]) if key is not None}
+            store.cache_scores(conn, list(new_docs.values()), max_entries=max_cached, version=version)
+    return docs.score
 
 
 def get_ticker_name(symbol):
@@ -82,7 +326,7 @@ def get_ticker_name(symbol):
     """
     url = "http://d.yimg.com/autoc.finance.yahoo.com/autoc?query={}&region=1&lang=en".format(symbol)
 
-    result = requests.get(url).json()
+    result = get_session().get(url).json()
 
     for x in result['ResultSet']['Result']:
         if x['symbol'] == symbol:
@@ -94,25 +338,279 @@ def daterange(date1, date2):
         yield date1 + dt.timedelta(n)
 
 
-def get_news(q, from_date, apikey):
+_newsapi_clients = {}
+
+
+def get_newsapi_client(apikey):
+    """
+    Get a NewsApiClient for an api key, made once and using the shared http session
+    :param apikey: newsapi key
+    :return: NewsApiClient
     """
-    Get news for a query
+    session = get_session()
+    client = _newsapi_clients.get(apikey)
+    if client is None or client.request_method is not session:
+        from newsapi import NewsApiClient
+        client = _newsapi_clients[apikey] = NewsApiClient(api_key=apikey, session=session)
+    return client
+
+
+def get_news(q, from_date, apikey, to_date=None, window_hours=24, page_size=100, max_pages=1, workers=4,
+             align=True):
+    """
+    Get news for a query. The time range is split into windows so busy tickers are not cut off at the first
+    page of results, and the pages for every window are fetched at the same time. Requests are rate limited
+    by the shared http session
     :param q: query
     :param from_date: from when date
-    :return:
+    :param apikey: newsapi key
+    :param to_date: up to when date, None for now
+    :param window_hours: hours of news per query
+    :param page_size: articles per page, up to 100
+    :param max_pages: most pages fetched per window, None for every page
+    :param workers: requests made at the same time
+    :param align: round to_date down to the hour and start windows on whole windows from midnight, so runs
+    at different times of day make the same requests and can be served from the response cache. False
+    to query the exact times e.g. when polling
+    :return: dict of status, totalResults and articles as from get_everything, duplicate urls removed
+    """
+    newsapi = get_newsapi_client(apikey)
+    to_date = to_date or dt.datetime.now()
+    step = dt.timedelta(hours=window_hours)
+    if align:
+        to_date = to_date.replace(minute=0, second=0, microsecond=0)
+        midnight = from_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        from_date = midnight + step * ((from_date - midnight) // step)
+    windows = []
+    while from_date < to_date:
+        windows.append((from_date, min(from_date + step, to_date)))
+        from_date += step
+
+    def fetch(window, page):
+        # /v2/everything
+        return newsapi.get_everything(q=q, from_param=window[0], to=window[1], language='en',
+                                      sort_by='publishedAt', page=page, page_size=page_size)
+
+    def fetch_all(calls):
+        futures = [submit(executor, fetch, *c) for c in calls]
+        results = []
+        for (window, page), future in zip(calls, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print('error getting news for {} page {}'.format(window[0], page))
+                print(e)
+                results.append(e)
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first = fetch_all([(window, 1) for window in windows])
+        if windows and all(isinstance(r, Exception) for r in first):
+            raise first[0]
+        # now the number of results in each window is known fetch the rest of the pages
+        more = []
+        for window, result in zip(windows, first):
+            if not isinstance(result, Exception):
+                pages = -(-result.get('totalResults', 0) // page_size)
+                if max_pages is not None:
+                    pages = min(pages, max_pages)
+                more.extend((window, page) for page in range(2, pages + 1))
+        rest = fetch_all(more)
+
+    articles = {}
+    for result in first + rest:
+        if isinstance(result, Exception):
+            continue
+        for article in result.get('articles', []):
+            # articles without a url can not be deduplicated so are always kept
+            articles.setdefault(article.get('url') or len(articles), article)
+    print('got {} news articles from {} requests'.format(len(articles), len(first) + len(rest)))
+    return {'status': 'ok', 'totalResults': len(articles), 'articles': list(articles.values())}
+
+
+class RateLimiter:
+    """
+    Thread safe limiter that spaces calls evenly to stay under a per minute rate
+    """
+
+    def __init__(self, per_minute):
+        self.interval = 60. / per_minute if per_minute else 0.
+        self.lock = threading.Lock()
+        self.next_time = 0.
+
+    def wait(self):
+        """
+        Block until the next call is allowed
+        """
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+_reddit_local = threading.local()
+
+
+def get_reddit_client(config):
+    """
+    Get a praw Reddit instance for the current thread. praw instances are not thread safe so each
+    fetch thread gets its own
+    :param config: reddit config
+    :return: praw.Reddit
+    """
+    reddit = getattr(_reddit_local, 'reddit', None)
+    if reddit is None:
+        import praw
+        reddit = praw.Reddit(client_id=config['id'], client_secret=config['secret'], user_agent=config['appname'],
+                             username=config['username'], password=config['passwd'])
+        _reddit_local.reddit = reddit
+    return reddit
+
+
+def get_pushshift_client():
+    from psaw import PushshiftAPI
+    return PushshiftAPI()
+
+
+def fetch_submission(id, config, limit=1, limiter=None, report=None):
+    """
+    Fetch a submission and its comment tree from reddit
+    :param id: submission id
+    :param config: reddit config
+    :param limit: limit number of comments
+    :param limiter: RateLimiter shared by all fetches
+    :param report: RunReport to count http calls in
+    :return: datestamp, title, body, list of comment ids and list of comments. None if the post was
+    removed or deleted
+    """
+    reddit = get_reddit_client(config)
+    if limiter is not None:
+        limiter.wait()
+    if report is not None:
+        report.count('http_calls:reddit')
+    submission = reddit.submission(id=id)
+    timestamp = submission.created_utc
+    datestamp = dt.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+    if submission.selftext == '[removed]':
+        return None
+    if submission.selftext == '[deleted]':
+        return None
+
+    if limiter is not None:
+        limiter.wait()
+    if report is not None:
+        report.count('http_calls:reddit')
+    submission.comment_sort = "top"
+    submission.comments.replace_more(limit=limit)
+    comments = submission.comments.list()
+
+    return (datestamp, submission.title, submission.selftext, [comment.id for comment in comments],
+            [comment.body for comment in comments])
+
+
+def _window_dates(start_time, end_time):
+    return {date.strftime("%Y-%m-%d") for date in daterange(start_time, end_time)}
+
+
+def _add_submission(builder, id, datestamp, title, body, comment_ids, comments):
+    builder.add_post(datestamp, id, title, body)
+    for comment_id, comment in zip(comment_ids, comments):
+        builder.add_comment(datestamp, comment_id, comment)
+
+
+def iter_submissions(sub, start_time, end_time, config, limit=1, executor=None, limiter=None, q=None,
+                     report=None, max_pending=None):
+    """
+    Search a sub with pushshift and fetch every matching submission and comment tree from reddit, yielding
+    each as it arrives. Only max_pending fetches are in flight so memory stays bounded however many
+    submissions match
+    :param sub: sub to search
+    :param start_time: start date
+    :param end_time: end date
+    :param config: reddit config
+    :param limit: limit number of comments
+    :param executor: thread pool to fetch submissions on, one is made from config['concurrency'] if None
+    :param limiter: RateLimiter shared by all fetches, one is made from config['requests_per_minute'] if None
+    :param q: query term, None for every submission in the sub
+    :param report: RunReport to count http calls in
+    :param max_pending: fetches in flight at once, twice config['concurrency'] if None
+    :return: generator of (id, datestamp, title, body, comment ids, comments) in pushshift order
     """
-    newsapi = NewsApiClient(api_key=apikey)
 
-    # /v2/everything
-    all_articles = newsapi.get_everything(q=q,
-                                          from_param=from_date,
-                                          language='en',
-                                          sort_by='relevancy')
+    if limiter is None:
+        limiter = RateLimiter(config.get('requests_per_minute', 60))
+    if max_pending is None:
+        max_pending = 2 * config.get('concurrency', 8)
 
-    return all_articles
+    psawapi = get_pushshift_client()
 
+    start_time_epoch = int(start_time.timestamp())
+    end_time_epoch = int(end_time.timestamp())
+
+    search = dict(after=start_time_epoch, before=end_time_epoch, subreddit=sub,
+                  filter=['id', 'url', 'author', 'title', 'selftext', 'subreddit'])
+    if q is not None:
+        search['q'] = q
+    if report is not None:
+        report.count('http_calls:pushshift')
 
-def reddit_scrape(q, sub, start_time, end_time, config, limit=1):
+    def collect(id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print('error fetching reddit submission')
+            print(e)
+            return None
+        return None if result is None else (id,) + result
+
+    pending = deque()
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=config.get('concurrency', 8))
+    try:
+        for sm in psawapi.search_submissions(**search):
+            id = sm[-1]['id']
+            pending.append((id, executor.submit(fetch_submission, id, config, limit, limiter, report)))
+            # collect in submission order so the output does not depend on fetch timing
+            while len(pending) >= max_pending:
+                result = collect(*pending.popleft())
+                if result is not None:
+                    yield result
+        while pending:
+            result = collect(*pending.popleft())
+            if result is not None:
+                yield result
+    finally:
+        for id, future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
+
+
+def fetch_submissions(sub, start_time, end_time, config, limit=1, executor=None, limiter=None, q=None,
+                      report=None):
+    """
+    Search a sub with pushshift and fetch every matching submission and comment tree from reddit
+    :param sub: sub to search
+    :param start_time: start date
+    :param end_time: end date
+    :param config: reddit config
+    :param limit: limit number of comments
+    :param executor: thread pool to fetch submissions on, one is made from config['concurrency'] if None
+    :param limiter: RateLimiter shared by all fetches, one is made from config['requests_per_minute'] if None
+    :param q: query term, None for every submission in the sub
+    :param report: RunReport to count http calls in
+    :return: list of (id, datestamp, title, body, comment ids, comments) in pushshift order
+    """
+    # everything is fetched before returning so there is no need to hold back fetches
+    return list(iter_submissions(sub, start_time, end_time, config, limit=limit, executor=executor,
+                                 limiter=limiter, q=q, report=report, max_pending=float('inf')))
+
+
+def reddit_scrape(q, sub, start_time, end_time, config, limit=1, executor=None, limiter=None, report=None):
     """
     Scrape reddit for post and comments for a search query between dates
     :param q: query term
@@ -120,256 +618,651 @@ def reddit_scrape(q, sub, start_time, end_time, config, limit=1):
     :param start_time: start date
     :param end_time: end date
     :param limit: limit number of comments
-    :return: dict of post title, body and comments
+    :param executor: thread pool to fetch submissions on, one is made from config['concurrency'] if None
+    :param limiter: RateLimiter shared by all fetches, one is made from config['requests_per_minute'] if None
+    :param report: RunReport to count http calls in
+    :return: Documents of the post titles, bodies and comments
     """
 
-    id = config['id']
-    secret = config['secret']
-    appname = config['appname']
-    username = config['username']
-    pwd = config['passwd']
+    window = _window_dates(start_time, end_time)
+    builder = DocumentBuilder(sub)
+    for submission in fetch_submissions(sub, start_time, end_time, config, limit=limit, executor=executor,
+                                        limiter=limiter, q=q, report=report):
+        if submission[1] in window:
+            _add_submission(builder, *submission)
 
-    reddit = praw.Reddit(client_id=id, client_secret=secret, user_agent=appname, username=username,
-                         password=pwd)
+    return builder.build()
 
-    subreddit = reddit.subreddit(sub)
 
-    psawapi = PushshiftAPI()
+def build_ticker_matcher(tickers):
+    """
+    Compile one regex matching any of the tickers. Cashtags ($tsla) match in any case, bare tickers
+    only in upper case so words like 'it' or 'all' are not mistaken for tickers
+    :param tickers: list of tickers
+    :return: compiled regex
+    """
+    # longest first so e.g. GOOGL is not matched as GOOG
+    alternatives = '|'.join(re.escape(t) for t in sorted(set(tickers), key=len, reverse=True))
+    return re.compile(r'(?<![\w$])(?:(?i:\$({0}))|({0}))(?!\w)'.format(alternatives))
 
-    start_time_epoch = int(start_time.timestamp())
-    end_time_epoch = int(end_time.timestamp())
 
-    submissions = list(psawapi.search_submissions(q=q, after=start_time_epoch, before=end_time_epoch, subreddit=sub,
-                                                  filter=['id', 'url', 'author', 'title', 'selftext', 'subreddit']))
-
-    post_dict = {}
-    comments_dict = {}
-    for date in daterange(start_time, end_time):
-        datestamp = date.strftime("%Y-%m-%d")
-        post_dict[datestamp] = {
-                        "title": [],  # title of the post
-                        "score": [],  # score of the post
-                        "id": [],  # unique id of the post
-                        "url": [],  # url of the post
-                        "comms_num": [],  # the number of comments on the post
-                        "created": [],  # timestamp of the post
-                        "body": []  # the content of post
-                    }
-        comments_dict[datestamp] = {
-                        "comment_id": [],  # unique comm id
-                        "comment_parent_id": [],  # comment parent id
-                        "comment_body": [],  # text in comment
-                        "comment_link_id": []  # link to the comment
-                    }
-
-    for sm in submissions:
-        id = sm[-1]['id']
-        submission = reddit.submission(id=id)
-        timestamp = submission.created_utc
-        datestamp = dt.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
-
-        if submission.selftext == '[removed]':
-            continue
-        if submission.selftext == '[deleted]':
-            continue
+def find_tickers(matcher, text):
+    """
+    Find the tickers mentioned in a text
+    :param matcher: regex from build_ticker_matcher
+    :param text: text to search
+    :return: set of upper case tickers
+    """
+    if not isinstance(text, str):
+        return set()
+    return {(cashtag or bare).upper() for cashtag, bare in matcher.findall(text)}
 
-        post_dict[datestamp]['title'].append(submission.title)
-        post_dict[datestamp]['body'].append(submission.selftext)
 
-        submission.comments.replace_more(limit=limit)
-        submission.comment_sort = "top"
-        for comment in submission.comments.list():
-            comments_dict[datestamp]["comment_body"].append(comment.body)
+def assign_submissions(submissions, tickers, start_time, end_time, matcher=None, sub=None):
+    """
+    Assign fetched submissions to every ticker they mention. A post goes to the tickers in its title or
+    body along with all its comments, other comments go to the tickers they mention themselves
+    :param submissions: list from fetch_submissions
+    :param tickers: list of tickers
+    :param start_time: start date
+    :param end_time: end date
+    :param matcher: regex from build_ticker_matcher, built from tickers if None
+    :param sub: sub the submissions are from
+    :return: dict of ticker: Documents as from reddit_scrape
+    """
+    if not tickers:
+        return {}
+    if matcher is None:
+        matcher = build_ticker_matcher(tickers)
+    tickers = {t.upper(): t for t in tickers}
+    builders = {t: DocumentBuilder(sub) for t in tickers.values()}
+    window = _window_dates(start_time, end_time)
+
+    for id, datestamp, title, body, comment_ids, comments in submissions:
+        if datestamp not in window:
+            continue
+        mentioned = find_tickers(matcher, title) | find_tickers(matcher, body)
+        for t in mentioned:
+            _add_submission(builders[tickers[t]], id, datestamp, title, body, comment_ids, comments)
+
+        for comment_id, comment in zip(comment_ids, comments):
+            for t in find_tickers(matcher, comment) - mentioned:
+                builders[tickers[t]].add_comment(datestamp, comment_id, comment)
 
-    return post_dict, comments_dict
+    return {t: builder.build() for t, builder in builders.items()}
 
 
-def save_data(dict, filename, mode):
+def download_prices(tickers, start, end):
     """
-    Store data to csv
-    :param dict: dicf df
-    :param filename: output filename
-    :param mode: write or append
-    :return:
+    Download price data for several tickers in one request
+    :param tickers: list of tickers
+    :param start: start date string
+    :param end: end date string, exclusive
+    :return: dict of ticker: df of price data as from yf.download, tickers with no data are left out
     """
+    def download():
+        import yfinance as yf
+        # yfinance makes its own requests rather than using the session, count the download as one
+        record('http_calls:yfinance')
+        data = yf.download(list(tickers), start=start, end=end, group_by='ticker')
+        if not isinstance(data.columns, pd.MultiIndex):
+            return {tickers[0]: data}
+        return {ticker: data[ticker].dropna(how='all') for ticker in tickers if ticker in data.columns.levels[0]}
+
+    cache = get_session().cache
+    if cache is None:
+        return download()
+    # yfinance does its own requests so cache the download rather than the http responses. A failed
+    # download, or a failed ticker in it, comes back empty and is not cached so it is tried again
+    return cache.call('yfinance', '{}:{}:{}'.format(','.join(tickers), start, end), download,
+                      keep=lambda data: len(data) == len(tickers) and not any(d.empty for d in data.values()))
+
+
+def refresh_prices(conn, tickers, start, end):
+    """
+    Download the price history missing from the store for each ticker, usually just the days since the
+    last run. Tickers missing the same dates are downloaded together in one request
+    :param conn: sentiment store connection
+    :param tickers: list of tickers
+    :param start: start date string
+    :param end: end date string, exclusive
+    """
+    missing = {}  # (start, end): tickers
+    for ticker in tickers:
+        covered = store.price_range(conn, ticker)
+        if covered is None:
+            window = (start, end)
+        elif start < covered[0]:
+            # download through to the end of what is stored so the range stays contiguous
+            window = (start, max(end, covered[1]))
+        elif end > covered[1]:
+            window = (covered[1], end)
+        else:
+            continue
+        missing.setdefault(window, []).append(ticker)
 
-    sent_data_df = pd.DataFrame.from_dict(dict, orient='index')
-    if mode == 'w':
-        sent_data_df.to_csv(filename, mode=mode, index_label='date')
-    else:
-        sent_data_df.to_csv(filename, mode=mode, header=False)
+    for (window_start, window_end), group in missing.items():
+        print('downloading stock data for {} from {} to {}'.format(', '.join(group), window_start, window_end))
+        data = download_prices(group, window_start, window_end)
+        for ticker in group:
+            if ticker in data:
+                store.upsert_prices(conn, ticker, data[ticker], window_start, window_end)
 
 
-def read_data(filename):
+def get_stock_data_many(tickers, start, end, store_path=None):
     """
-    Read data from csv to df
-    :param filename: filename
-    :return: df from csv
+    Get daily price data for several tickers, only downloading dates not already in the store
+    :param tickers: list of tickers
+    :param start: start date string
+    :param end: end date string, exclusive
+    :param store_path: sentiment store filename, None to download everything without storing it
+    :return: dict of ticker: df of price data as from yf.download, tickers with no data are left out
     """
-    data = pd.read_csv(filename)
-    return data
+    if store_path is None:
+        return download_prices(tickers, start, end)
+    conn = store.connect(store_path)
+    try:
+        refresh_prices(conn, tickers, start, end)
+        return {ticker: store.read_prices(conn, ticker, start, end) for ticker in tickers
+                if store.price_range(conn, ticker) is not None}
+    finally:
+        conn.close()
 
 
-def get_stock_data(ticker, start, end):
-    return yf.download(ticker, start=start, end=end)
+def get_stock_data(ticker, start, end, store_path=None):
+    """
+    Get daily price data for a ticker, only downloading dates not already in the store
+    :param ticker: stock ticker
+    :param start: start date string
+    :param end: end date string, exclusive
+    :param store_path: sentiment store filename, None to download everything without storing it
+    :return: df of price data as from yf.download
+    """
+    data = get_stock_data_many([ticker], start, end, store_path)
+    if ticker not in data:
+        return pd.DataFrame(columns=list(store.PRICE_COLUMNS))
+    return data[ticker]
 
 
-def process_news(start_time, end_time, all_articles):
+def align_prices(stock_data, dates):
+    """
+    Line up price data with a list of dates. There is no data for weekends or non trading days so the
+    last trading day is carried forward
+    :param stock_data: df of price data from get_stock_data
+    :param dates: list of date strings
+    :return: df indexed by date with open, high, low, close and vol columns
+    """
+    index = pd.Index(dates, name='date')
+    prices = stock_data.reindex(columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+    prices.index = pd.to_datetime(prices.index).strftime('%Y-%m-%d')
+    prices = prices[~prices.index.duplicated(keep='last')]
+    prices = prices.reindex(prices.index.union(index)).sort_index().ffill().reindex(index)
+    prices.columns = ['open', 'high', 'low', 'close', 'vol']
+    return prices
 
-    news_data = {}
-    for date in daterange(start_time, end_time):
-        datestamp = date.strftime("%Y-%m-%d")
-        news_data[datestamp] = {'title': [], 'content': []}
 
-    # loop all_articles['articles']
-    print('processing news data')
-    for article in all_articles['articles']:
-        try:
-            published = article['publishedAt']
-            published_date = dt.datetime.strptime(published, '%Y-%m-%dT%H:%M:%SZ')
-            published_date_str = published_date.strftime('%Y-%m-%d')
-            # print(published, published_date, published_date.strftime('%Y-%m-%d'))
-            news_data[published_date_str]['title'].append(article['title'])
-            news_data[published_date_str]['content'].append(article['content'])
-        except Exception as e:
-            print('error processing news data for article')
-            print(e)
-            news_data[published_date_str] = {'title': [], 'content': []}
-            continue
+def process_news(start_time, end_time, all_articles):
+    """
+    Turn a news response into a documents table
+    :param start_time: start date
+    :param end_time: end date
+    :param all_articles: dict of articles as from get_news
+    :return: Documents with a title and a content row per article
+    """
 
+    print('processing news data')
+    window = sorted(_window_dates(start_time, end_time))
+    articles = pd.DataFrame(all_articles['articles'], columns=['publishedAt', 'title', 'content', 'url'])
+    articles = articles.astype(object).where(articles.notna(), None)
+    # parse every timestamp at once, articles with a bad timestamp or outside the window are dropped
+    published = pd.to_datetime(articles['publishedAt'], format='%Y-%m-%dT%H:%M:%SZ', errors='coerce')
+    articles['date'] = published.dt.strftime('%Y-%m-%d')
+    skipped = ~articles['date'].isin(window)
+    if skipped.any():
+        print('skipped {} news articles with a bad date or outside the window'.format(skipped.sum()))
+    articles = articles[~skipped]
+
+    n = len(articles)
+    news_data = Documents.from_columns(source=['news'] * (2 * n), date=np.repeat(articles['date'].values, 2),
+                                       id=np.repeat(articles['url'].values, 2), kind=['title', 'content'] * n,
+                                       doc=np.repeat(np.arange(n), 2),
+                                       text=np.column_stack([articles['title'].values,
+                                                             articles['content'].values]).ravel())
     print('processed news data')
     return news_data
 
 
-def process_reddit(ticker, subs, start_time, end_time, config, limit):
+def process_reddit(ticker, subs, start_time, end_time, config, limit, limiter=None, report=None):
 
     print('subs to get data from: ', subs)
-    sub_data = {k: {} for k in subs}
+    sub_data = {}
     q = ticker
-    for sub in subs:
+    # one pool of submission fetches and one rate limit shared by every sub
+    if limiter is None:
+        limiter = RateLimiter(config.get('requests_per_minute', 60))
+
+    def scrape_sub(sub):
+        print('fetching reddit data from: ', sub)
+        if report is None:
+            return reddit_scrape(q, sub, start_time, end_time, config, limit=limit, executor=fetch_executor,
+                                 limiter=limiter)
+        with report.stage('reddit:' + sub):
+            return reddit_scrape(q, sub, start_time, end_time, config, limit=limit, executor=fetch_executor,
+                                 limiter=limiter, report=report)
+
+    with ThreadPoolExecutor(max_workers=config.get('concurrency', 8)) as fetch_executor, \
+            ThreadPoolExecutor(max_workers=max(len(subs), 1)) as sub_executor:
+        futures = {sub: sub_executor.submit(scrape_sub, sub) for sub in subs}
+        for sub, future in futures.items():
+            try:
+                sub_data[sub] = future.result()
+                print('fetched reddit data from: ', sub)
+            except Exception as e:
+                print('error fetching reddit data from: ', sub)
+                print(e)
+                continue
+
+    return Documents.concat(sub_data.values())
+
+
+def iter_reddit_stream(ticker, subs, start_time, end_time, config, limit, limiter=None, report=None,
+                       queue_size=1000):
+    """
+    Stream submissions for a ticker from every sub at the same time. Each sub is fetched on its own thread
+    into a bounded queue so fetching runs ahead of whatever consumes the stream, but only by queue_size
+    submissions
+    :param ticker: stock ticker
+    :param subs: subs to search
+    :param start_time: start date
+    :param end_time: end date
+    :param config: reddit config
+    :param limit: limit number of comments
+    :param limiter: RateLimiter shared for reddit fetches, one is made if None
+    :param report: RunReport to count http calls in
+    :param queue_size: submissions held waiting to be consumed
+    :return: generator of (sub, id, datestamp, title, body, comment ids, comments)
+    """
+    if limiter is None:
+        limiter = RateLimiter(config.get('requests_per_minute', 60))
+    submissions = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # give up if the consumer has stopped rather than block on a full queue forever
+        while not stop.is_set():
+            try:
+                submissions.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(sub):
         try:
-            print('fetching reddit data from: ', sub)
-            post_dict, comments_dict = reddit_scrape(q, sub, start_time, end_time, config, limit=limit)
-            sub_data[sub]['posts'] = post_dict
-            sub_data[sub]['comments'] = comments_dict
-            print('fetched reddit data from: ', sub)
+            print('streaming reddit data from: ', sub)
+            for submission in iter_submissions(sub, start_time, end_time, config, limit=limit,
+                                               executor=fetch_executor, limiter=limiter, q=ticker, report=report):
+                if not put((sub,) + submission):
+                    return
+            print('streamed reddit data from: ', sub)
         except Exception as e:
-            print('error fetching reddit data from: ', sub)
+            print('error streaming reddit data from: ', sub)
             print(e)
-            sub_data[sub] = {}
-            continue
+        finally:
+            put(done)
 
-    return sub_data
+    fetch_executor = ThreadPoolExecutor(max_workers=config.get('concurrency', 8))
+    producers = [threading.Thread(target=produce, args=(sub,), daemon=True) for sub in subs]
+    for producer in producers:
+        producer.start()
+    try:
+        remaining = len(producers)
+        while remaining:
+            item = submissions.get()
+            if item is done:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        stop.set()
+        fetch_executor.shutdown(wait=False)
 
 
-def get_news_sentiment(news_data, news_sentiment):
+def process_reddit_stream(ticker, subs, start_time, end_time, config, limit, limiter=None, report=None):
+    """
+    Score reddit posts and comments as they are fetched, keeping only a running count and sum of
+    sentiment per date rather than every text
+    :param ticker: stock ticker
+    :param subs: subs to search
+    :param start_time: start date
+    :param end_time: end date
+    :param config: reddit config
+    :param limit: limit number of comments
+    :param limiter: RateLimiter shared for reddit fetches, one is made if None
+    :param report: RunReport to count documents in
+    :return: df of date, source, count and sum of sentiment
+    """
+    scorer = get_scorer()
+    totals = {}  # date: [count, sum]
+    posts = 0
+    comments = 0
+    for sub, id, datestamp, title, body, comment_ids, comment_bodies in iter_reddit_stream(
+            ticker, subs, start_time, end_time, config, limit, limiter=limiter, report=report):
+        total = totals.setdefault(datestamp, [0, 0.])
+        post_sent = np.mean(scorer.score_many([title, body]))
+        if not np.isnan(post_sent):
+            total[0] += 1
+            total[1] += post_sent
+        posts += 1
+        for comment_sent in scorer.score_many(comment_bodies):
+            if not np.isnan(comment_sent):
+                total[0] += 1
+                total[1] += comment_sent
+        comments += len(comment_bodies)
+
+    if report is not None:
+        report.count('documents:reddit_posts', posts)
+        report.count('documents:reddit_comments', comments)
+    return pd.DataFrame([(d, 'reddit', c, t) for d, (c, t) in totals.items()],
+                        columns=['date', 'source', 'count', 'sum'])
+
+
+def process_reddit_many(tickers, subs, start_time, end_time, config, limit, limiter=None):
+    """
+    Fetch every submission in each sub once and split them between all the tickers they mention
+    rather than searching each sub once per ticker
+    :param tickers: list of tickers
+    :param subs: subs to fetch
+    :param start_time: start date
+    :param end_time: end date
+    :param config: reddit config
+    :param limit: limit number of comments
+    :param limiter: RateLimiter shared for reddit fetches, one is made if None
+    :return: dict of ticker: Documents as from process_reddit
+    """
 
-    print('calculating sentiment for news')
-    for d in news_data.keys():
-        for title, content in zip(news_data[d]['title'], news_data[d]['content']):
+    print('subs to get data from for {} tickers: '.format(len(tickers)), subs)
+    ticker_data = {t: [] for t in tickers}
+    matcher = build_ticker_matcher(tickers)
+    if limiter is None:
+        limiter = RateLimiter(config.get('requests_per_minute', 60))
+
+    def scrape_sub(sub):
+        print('fetching reddit data from: ', sub)
+        return fetch_submissions(sub, start_time, end_time, config, limit=limit, executor=fetch_executor,
+                                 limiter=limiter)
+
+    with ThreadPoolExecutor(max_workers=config.get('concurrency', 8)) as fetch_executor, \
+            ThreadPoolExecutor(max_workers=max(len(subs), 1)) as sub_executor:
+        futures = {sub: sub_executor.submit(scrape_sub, sub) for sub in subs}
+        for sub, future in futures.items():
             try:
-                title_sent = sentiment_analyzer_scores(title)
-                content_sent = sentiment_analyzer_scores(content)
-                news_sentiment[d].append(np.nanmean([title_sent, content_sent]))
+                assigned = assign_submissions(future.result(), tickers, start_time, end_time, matcher, sub=sub)
+                for t, docs in assigned.items():
+                    ticker_data[t].append(docs)
+                print('fetched reddit data from: ', sub)
             except Exception as e:
-                print('error calculating sentiment for news for: ', d)
+                print('error fetching reddit data from: ', sub)
                 print(e)
                 continue
 
-    print('calculated sentiment for news')
+    return {t: Documents.concat(docs) for t, docs in ticker_data.items()}
 
-    return news_sentiment
 
+def _document_sentiment(docs, source, skipna, weighted, key_kinds):
+    """
+    Sentiment of each document of a source, the mean of its scored rows
+    :param docs: Documents scored with score_all
+    :param source: source name
+    :param skipna: score a document on the rows that have a score, else any unscored row makes it nan
+    :param weighted: add a cluster column of the representative of each document's key row
+    :param key_kinds: kinds of row to take the cluster from in order of preference, empty texts last
+    :return: df of date, source and score, one row per document
+    """
+    rows = np.flatnonzero(docs.mask(source))
+    doc_numbers, first, inverse = np.unique(docs.doc[rows], return_index=True, return_inverse=True)
+    scores = docs.score[rows]
+    missing = np.isnan(scores)
+    counts = np.bincount(inverse, weights=~missing, minlength=len(doc_numbers))
+    sums = np.bincount(inverse, weights=np.where(missing, 0., scores), minlength=len(doc_numbers))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        doc_scores = sums / counts
+    if not skipna:
+        doc_scores[np.bincount(inverse, weights=missing, minlength=len(doc_numbers)) > 0] = np.nan
+
+    data = pd.DataFrame({'date': np.datetime_as_string(docs.date[rows[first]], unit='D'), 'source': source,
+                         'score': doc_scores})
+    if weighted:
+        matches = docs.kind[rows, None] == np.array([KINDS.index(k) for k in key_kinds])
+        priority = np.where(matches.any(axis=1), matches.argmax(axis=1), len(key_kinds))
+        empty = (docs.text.lengths()[rows] == 0) | ~docs.text.valid[rows]
+        priority = priority + (len(key_kinds) + 1) * empty
+        # the most preferred row of each document, documents are in order of doc number as is inverse
+        order = np.lexsort((priority, inverse))
+        key_rows = rows[order[np.r_[0, np.flatnonzero(np.diff(inverse[order])) + 1]]] if len(rows) else rows
+        data['cluster'] = docs.cluster[key_rows]
+    return data
 
-def get_reddit_sentiment(sub_data, reddit_sentiment):
 
-    print('calculating sentiment for reddit data')
-    for sub, v in sub_data.items():
-        for d in sub_data[sub]['posts'].keys():
-            #print(sub_data[sub]['posts'][d].keys())
-            try:
-                title_sent = sentiment_analyzer_scores(sub_data[sub]['posts'][d]['title'])
-                body_sent = sentiment_analyzer_scores(sub_data[sub]['posts'][d]['body'])
-                post_sent = np.mean([title_sent, body_sent])
-                reddit_sentiment[d].append(post_sent)
-            except Exception as e:
-                print('error calculating sentiment for reddit post')
-                continue
-        for d in sub_data[sub]['comments'].keys():
-            #print(sub_data[sub]['comments'][d].keys())
-            try:
-                comment_sent = sentiment_analyzer_scores(sub_data[sub]['comments'][d]['comment_body'])
-                reddit_sentiment[d].append(comment_sent)
-            except Exception as e:
-                print('error calculating sentiment for reddit comment')
-                continue
+def get_news_sentiment(news_data, weighted=False):
+    """
+    Score news articles, the mean of title and content sentiment
+    :param news_data: Documents scored with score_all, rows from other sources are ignored
+    :param weighted: add a cluster column of the representative of each article's content, or title if it
+    has no content, as set by cluster_documents
+    :return: df of date, source and score, one row per article
+    """
 
-    print('calculated sentiment for reddit data')
+    print('calculating sentiment for news')
+    # articles without content are scored on the title alone
+    data = _document_sentiment(news_data, 'news', True, weighted, ['content', 'title'])
+    print('calculated sentiment for news')
+    return data
 
-    return reddit_sentiment
 
+def get_reddit_sentiment(sub_data, weighted=False):
+    """
+    Score reddit posts and comments. A post is the mean of title and body sentiment
+    :param sub_data: Documents scored with score_all, rows from other sources are ignored
+    :param weighted: add a cluster column of the representative of each post title and comment, as set by
+    cluster_documents
+    :return: df of date, source and score, one row per post and comment
+    """
+
+    print('calculating sentiment for reddit data')
+    data = _document_sentiment(sub_data, 'reddit', False, weighted, ['title', 'comment', 'body'])
+    print('calculated sentiment for reddit data')
+    return data
 
-def get_final_sentiment(stock_data, sent_data, reddit_sentiment, news_sentiment, twtr_data):
+
+def get_final_sentiment(stock_data, scored, twtr_data, dates, totals=None):
+    """
+    Calculate daily sentiment per source and line it up with price data
+    :param stock_data: df of price data from get_stock_data
+    :param scored: df of date, source and score from get_news_sentiment and get_reddit_sentiment. With a
+    cluster column the copies of a near duplicate text share one vote, each weighted by 1 / copies
+    :param twtr_data: dict of date: socialsentiment.io score
+    :param dates: list of date strings to calculate for
+    :param totals: df of date, source, count and sum of scores already aggregated, e.g. from
+    process_reddit_stream, combined with scored
+    :return: df indexed by date with reddit, news, mean, twitter, open, high, low, close and vol columns
+    """
 
     print('doing final sentiment calculations')
-    for i, d in enumerate(news_sentiment.keys()):
-        # calculate mean sentiment and add to dict for each source
-        try:
-            sent_data[d]['reddit'] = np.mean(reddit_sentiment[d])
-        except Exception as e:
-            print('error calculating reddit sentiment for: ', d)
-            #continue
-        try:
-            sent_data[d]['news'] = np.mean(news_sentiment[d])
-        except Exception as e:
-            print('error calculating news sentiment for: ', d)
-            #continue
-        try:
-            sent_data[d]['mean'] = np.mean([news_sentiment[d]+reddit_sentiment[d]])
-        except Exception as e:
-            print('error calculating mean sentiment for: ', d)
-            #continue
-        try:
-            sent_data[d]['twitter'] = twtr_data[d]/100. # normalise to -1, 1
-        except Exception as e:
-            print('error calculating socialsentiment.io values')
-            sent_data[d]['twitter'] = np.nan
-        # add stock price data to dict
-        try:
-            # no data for weekends or non trading days. nan out
-            #'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'
-            sent_data[d]['open'] = stock_data['Open'][d]
-            sent_data[d]['high'] = stock_data['High'][d]
-            sent_data[d]['low'] = stock_data['Low'][d]
-            sent_data[d]['close'] = stock_data['Close'][d]
-            sent_data[d]['vol'] = stock_data['Volume'][d]
-            lastopen = stock_data['Open'][d]
-            lasthigh = stock_data['High'][d]
-            lastlow = stock_data['Low'][d]
-            lastclose = stock_data['Close'][d]
-            lastvol = stock_data['Volume'][d]
-        except Exception as ed:
-            sent_data[d]['open'] = lastopen
-            sent_data[d]['high'] = lasthigh
-            sent_data[d]['low'] = lastlow
-            sent_data[d]['close'] = lastclose
-            sent_data[d]['vol'] = lastvol
+    index = pd.Index(dates, name='date')
+
+    # count and sum sentiment for each source, means are then sum / count
+    scored = scored.dropna(subset=['score'])
+    if 'cluster' in scored:
+        weights = (1. / scored.groupby('cluster')['score'].transform('size')).fillna(1.)
+        parts = [scored.assign(count=weights, sum=scored['score'] * weights)
+                 .groupby(['date', 'source'])[['count', 'sum']].sum()]
+    else:
+        parts = [scored.groupby(['date', 'source'])['score'].agg(['count', 'sum'])]
+    if totals is not None and not totals.empty:
+        parts.append(totals.groupby(['date', 'source'])[['count', 'sum']].sum())
+    sums = pd.concat(parts).groupby(level=['date', 'source']).sum()
+
+    # calculate mean sentiment for each source and for all sources together. A run that scored nothing has
+    # no sources to unstack, reindex so it gives nan rather than missing columns
+    by_source = sums.unstack('source').reindex(columns=pd.MultiIndex.from_product([['count', 'sum'],
+                                                                                   ['news', 'reddit']]))
+    sent_data = (by_source['sum'] / by_source['count']).reindex(index=index, columns=['reddit', 'news'])
+    by_date = sums.groupby(level='date').sum()
+    sent_data['mean'] = (by_date['sum'] / by_date['count']).reindex(index)
+    sent_data['twitter'] = pd.Series(twtr_data, dtype=float).reindex(index) / 100.  # normalise to -1, 1
+
+    # add stock price data
+    sent_data[['open', 'high', 'low', 'close', 'vol']] = align_prices(stock_data, dates).values
+    sent_data.columns.name = None
 
     print('final sentiment data calculated')
     return sent_data
 
 
-def run_sentiment(ticker):
+def _timed_fetch(name, fetch, report=None):
+    started = time.monotonic()
+    try:
+        if report is None:
+            return fetch()
+        with report.stage('fetch:' + name):
+            return fetch()
+    finally:
+        print('finished fetching {} in {:.2f}s'.format(name, time.monotonic() - started))
+
+
+def fetch_sources(sources, timeouts=None, default_timeout=None, report=None):
+    """
+    Run independent source fetches at the same time. A source that fails or runs past its timeout
+    gives None and does not hold up or break the others
+    :param sources: dict of source name: zero argument fetch function
+    :param timeouts: dict of source name: seconds to wait for that source from the start
+    :param default_timeout: seconds to wait for sources without a timeout, None waits forever
+    :param report: RunReport to time each source in
+    :return: dict of source name: result or None
+    """
+    timeouts = timeouts or {}
+    executor = ThreadPoolExecutor(max_workers=max(len(sources), 1))
+    started = time.monotonic()
+    futures = {name: submit(executor, _timed_fetch, name, fetch, report) for name, fetch in sources.items()}
+
+    results = {}
+    for name, future in futures.items():
+        timeout = timeouts.get(name, default_timeout)
+        remaining = None if timeout is None else max(started + timeout - time.monotonic(), 0)
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            print('timed out fetching {} after {}s'.format(name, timeout))
+            if report is not None:
+                report.count('timeouts:' + name)
+            results[name] = None
+        except Exception as e:
+            print('error fetching', name)
+            print(e)
+            if report is not None:
+                report.count('errors:' + name)
+            results[name] = None
+
+    # do not wait on sources that timed out, their threads finish in the background
+    executor.shutdown(wait=False)
+    print('fetched all sources in {:.2f}s'.format(time.monotonic() - started))
+    return results
+
+
+def load_config(filename='config.yaml'):
+    with open(filename, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def get_time_window(conn, ticker, lookback, store_path=''):
+    """
+    Get the start and end time to fetch for a ticker. Starts from the last stored day, or lookback days
+    ago for a new ticker. Imports an old <TICKER>_sentiment.csv into the store first if there is one
+    :param conn: sentiment store connection
+    :param ticker: stock ticker
+    :param lookback: days of history for a new ticker
+    :param store_path: store filename for messages
+    :return: start time, end time and whether the ticker already has stored data
+    """
+    filename = ticker + "_sentiment.csv"
+
+    # one now for both ends, a start read later than the end would leave today out of the window
+    now = dt.datetime.now()
+    end_time = now - dt.timedelta(days=1)
+    print('end time: ', end_time)
+
+    last_date = store.latest_date(conn, ticker)
+    if last_date is None and os.path.exists(filename):
+        # migrate data from the old per ticker csv
+        print(filename, 'exists, importing into', store_path)
+        store.import_csv(conn, ticker, filename)
+        last_date = store.latest_date(conn, ticker)
+
+    if last_date is not None:
+        print(ticker, 'exists in', store_path)
+        # the last stored day is fetched again as it may have been incomplete
+        start_time = dt.datetime.strptime(last_date, '%Y-%m-%d')
+    else:
+        print(ticker, 'does not exist in', store_path)
+        start_time = now - dt.timedelta(days=lookback)
+    print('start time: ', start_time)
+
+    return start_time, end_time, last_date is not None
+
+
+def run_sentiment(ticker, config=None, prefetched=None, pool=None, limiter=None, report=None):
+    """
+    Fetch, score and store sentiment for a ticker
+    :param ticker: stock ticker
+    :param config: config dict, loaded from config.yaml if None
+    :param prefetched: dict of source name ('price', 'twitter', 'news', 'reddit'): data already fetched
+    for this ticker, those sources are not fetched again
+    :param pool: multiprocessing pool shared for scoring, one is made per run if None
+    :param limiter: RateLimiter shared for reddit fetches, one is made per run if None
+    :param report: RunReport to record stage timings and counters in, one is made per run if None
+    :return: df of stored sentiment and price data for the ticker
+    """
 
     # load config
-    with open('config.yaml', 'r') as file:
-        config = yaml.safe_load(file)
+    if config is None:
+        config = load_config()
+    metrics = config.get('METRICS') or {}
+    report_dir = metrics.get('report_dir')
+    if report is None:
+        report = RunReport(ticker)
+    if metrics.get('prometheus_port'):
+        start_metrics_server(metrics['prometheus_port'])
+
+    try:
+        # http calls, retries and cache hits anywhere in the run are counted in its report
+        with reporting(report):
+            if metrics.get('profile'):
+                filename = os.path.join(report_dir or '.',
+                                        '{}_{}'.format(ticker, report.started.strftime('%Y%m%dT%H%M%S')))
+                with profile(filename, metrics.get('profiler', 'cprofile')):
+                    return _run_sentiment(ticker, config, prefetched, pool, limiter, report)
+            return _run_sentiment(ticker, config, prefetched, pool, limiter, report)
+    finally:
+        REGISTRY.add(report)
+        print(report.summary())
+        if report_dir:
+            print('run report saved to', report.save(report_dir))
+
+
+def _run_sentiment(ticker, config, prefetched, pool, limiter, report):
+
+    prefetched = prefetched or {}
 
     lookback = config['GLOBAL']['lookback']
     sublimit = config['GLOBAL']['sublimit']
     socialsentiment_apikey = config['APIKEYS']['socialsentiment']
     newsapikey = config['APIKEYS']['newsapi']
-
+    # set up the http session once up front with settings from the config
+    get_session(config.get('HTTP'))
+    workers = config.get('SENTIMENT', {}).get('workers')
+    chunksize = config.get('SENTIMENT', {}).get('chunksize', 500)
 
     print('Running for ticker: ', ticker)
     subs = config['REDDIT']['subs']
@@ -380,8 +1273,7 @@ def run_sentiment(ticker):
         print('cannot retrieve company name, stopping...')
         return pd.DataFrame({})
 
-    filename = ticker + "_sentiment.csv"
-    exists = False
+    store_path = config['GLOBAL'].get('store', 'sentiment.db')
 
     try:
         q = ticker + ' OR ' + name # search query
@@ -390,127 +1282,154 @@ def run_sentiment(ticker):
         print('ticker query incorrect, cannot get company name', e)
         q = ticker
 
-    end_time = dt.datetime.now() - dt.timedelta(days=1)
-    print('end time: ', end_time)
-
-    if os.path.exists(filename):
-        print(filename, 'exists')
-        sent_file = read_data(filename)
-        #print(sent_file)
-        #print(list(sent_file['date']))
-        start_time = dt.datetime.strptime(list(sent_file['date'])[-1], '%Y-%m-%d')# +  dt.timedelta(days=1)
-        print('start time: ', start_time)
-        exists = True
-        if start_time >= end_time:
+    conn = store.connect(store_path)
+    try:
+        with report.stage('store_window'):
+            start_time, end_time, exists = get_time_window(conn, ticker, lookback, store_path)
+        if exists and start_time >= end_time:
             print('loading data for plot')
-            data = read_data(filename)
+            data = store.read(conn, ticker)
             return data
-    else:
-        print(filename, 'does not exist')
-        start_time = dt.datetime.now() - dt.timedelta(days=lookback)
-
-        print('start time: ', start_time)
-
-    ## GET PRICE DATA ##
-    print('downloading stock data')
-    stock_data = get_stock_data(ticker, start=start_time.strftime('%Y-%m-%d'), end=end_time.strftime('%Y-%m-%d'))
-    print('downloaded stock data')
-    ## END PRICE DATA ##
-
-    ## GET TWITTER SENTIMENT FROM SOCAILSENTIMENT.IO ##
-    #  7 DAYS DATA ONLY #
-    failed = []
-    twtr_data = {}
-    # get sentiment for each ticker
-    try:
-        print('getting twitter sentiment from socialsentiment.io')
-        status, twtr_dates, twtr_scores, avg_7_days, avg_14_days, avg_30_days = get_twtr_sentiment(ticker, socialsentiment_apikey)
-    except Exception as e:
-        print(e)
-        status = 999
-        twtr_scores = []
-
-    # successful so get sentiment
-    if status == 200:
-        # calc weighted sentiment, weighting latest more than past
-        # these are abtirary weights
-        twtrsent = 0.6 * np.nanmean(avg_7_days) + 0.3 * np.nanmean(avg_14_days) + 0.1 * np.nanmean(avg_30_days)
-        twtrsent = np.round(twtrsent)
-
-        # check not nan
-        if np.isnan(twtrsent):
-            twtrsent = ''
-
-        for date, score in zip(twtr_dates, twtr_scores):
-            twtr_data[date] = score
-        print('got twitter sentiment from socialsentiment.io')
-
-    # failed rate, try again after rest, sleep for a minute to refresh rate
-    elif status == 429:
-        failed.append(ticker)
-        print('failed to get twitter sentiment from socialsentiment.io')
-        pass
-
-    # some other error we don't care. NA value
-    else:
-        print('failed to get twitter sentiment from socialsentiment.io')
-        twtrsent = ''
-
-    ## END TWITTER SENTIMENT ##
 
-    ## GET NEWS ARTICLES FOR TICKER AND COMPANY NAME ##
-    # UP TO 30 DAYS DATA #
-
-    try:
-        print('getting news from newsapi')
-        all_articles = get_news(q, start_time, newsapikey) # title, content
-        print('fetched news articles using newsapi')
-    except Exception as e:
-        print('error getting news from newsapi')
-        print(e)
-
-    news_data = process_news(start_time, end_time, all_articles)
-
-    ## END NEWS SCRAPE ##
-
-    # REDDIT SCRAPE ##
-    # ANY TIME DATA #
-
-    sub_data = process_reddit(ticker, subs, start_time, end_time, config['REDDIT'], limit=sublimit)
-
-    ## END REDDIT SCRAPE ##
-
-    ## ANALYSE SENTIMENT ON ALL DATA ##
-
-    news_sentiment = {}
-    reddit_sentiment = {}
-    sent_data = {}
-    for date in daterange(start_time, end_time):
-        datestamp = date.strftime("%Y-%m-%d")
-        news_sentiment[datestamp] = []
-        reddit_sentiment[datestamp] = []
-        sent_data[datestamp] = {}#{'twitter': [], 'news': [], 'reddit': []}
-
-    news_sentiment = get_news_sentiment(news_data, news_sentiment)
-
-    reddit_sentiment = get_reddit_sentiment(sub_data, reddit_sentiment)
-
-    sent_data = get_final_sentiment(stock_data, sent_data, reddit_sentiment, news_sentiment, twtr_data)
-
-    ## END SENTIMENT ANALYSIS ##
-
-    ## WRITE TO CSV ##
-    print('saving csv data')
-    if exists:
-        save_data(sent_data, filename, mode='a')
-    else:
-        save_data(sent_data, filename, mode='w')
-    print('csv data saved')
-    ## END WRITE TO CSV ##
+        # load the sentiment analyser now there is something to score
+        get_scorer(config.get('SENTIMENT', {}).get('customwords'), config.get('SENTIMENT', {}).get('engine'))
+
+        ## FETCH PRICE, TWITTER, NEWS AND REDDIT DATA AT THE SAME TIME ##
+        print('fetching price data, socialsentiment.io, newsapi and reddit data')
+        sources = {
+            'price': lambda: get_stock_data(ticker, start=start_time.strftime('%Y-%m-%d'),
+                                            end=end_time.strftime('%Y-%m-%d'), store_path=store_path),
+            'twitter': lambda: get_twtr_sentiment(ticker, socialsentiment_apikey),
+            # title, content. The window runs through today so news is fetched up to now, which get_news
+            # rounds down to the hour so runs within the hour share cached responses
+            'news': lambda: get_news(q, start_time, newsapikey, **config.get('NEWS', {})),
+            'reddit': lambda: process_reddit(ticker, subs, start_time, end_time, config['REDDIT'], limit=sublimit,
+                                             limiter=limiter, report=report),
+        }
+        streaming = config['REDDIT'].get('streaming', False) and 'reddit' not in prefetched
+        if streaming:
+            # reddit is scored as it is fetched and only daily totals are kept
+            sources['reddit'] = lambda: process_reddit_stream(ticker, subs, start_time, end_time, config['REDDIT'],
+                                                              limit=sublimit, limiter=limiter, report=report)
+        sources = {k: v for k, v in sources.items() if k not in prefetched}
+        fetched = fetch_sources(sources, timeouts=config['GLOBAL'].get('timeouts'), report=report)
+        fetched.update(prefetched)
+
+        ## PRICE DATA ##
+        stock_data = fetched['price']
+        if stock_data is None:
+            print('failed to download stock data')
+            stock_data = pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'])
+        ## END PRICE DATA ##
+
+        ## TWITTER SENTIMENT FROM SOCAILSENTIMENT.IO ##
+        #  7 DAYS DATA ONLY #
+        twtr_data = {}
+        if fetched['twitter'] is not None:
+            status, twtr_dates, twtr_scores, avg_7_days, avg_14_days, avg_30_days = fetched['twitter']
+        else:
+            status = 999
+            twtr_scores = []
+
+        # successful so get sentiment
+        if status == 200:
+            # calc weighted sentiment, weighting latest more than past
+            # these are abtirary weights
+            twtrsent = 0.6 * np.nanmean(avg_7_days) + 0.3 * np.nanmean(avg_14_days) + 0.1 * np.nanmean(avg_30_days)
+            twtrsent = np.round(twtrsent)
+
+            # check not nan
+            if np.isnan(twtrsent):
+                twtrsent = ''
+
+            for date, score in zip(twtr_dates, twtr_scores):
+                twtr_data[date] = score
+            print('got twitter sentiment from socialsentiment.io')
+
+        # still rate limited after the http client's retries, counted in the run report
+        elif status == 429:
+            report.count('errors:twitter')
+            print('failed to get twitter sentiment from socialsentiment.io, rate limited')
+
+        # some other error we don't care. NA value
+        else:
+            print('failed to get twitter sentiment from socialsentiment.io')
+            twtrsent = ''
 
-    ## NOW LOAD THAT SHIT IN TO PLOT IT ##
-    print('loading data for plot')
-    data = read_data(filename)
-    return data
-    ## END LOADING DATA ##
+        ## END TWITTER SENTIMENT ##
+
+        ## NEWS ARTICLES FOR TICKER AND COMPANY NAME ##
+        # UP TO 30 DAYS DATA #
+
+        all_articles = fetched['news']
+        if all_articles is None:
+            print('error getting news from newsapi')
+            all_articles = {'articles': []}
+
+        with report.stage('process_news'):
+            news_data = process_news(start_time, end_time, all_articles)
+        # the articles are in the table now, drop the response
+        fetched['news'] = all_articles = None
+        report.count('documents:news', news_data.count('news', 'title'))
+
+        ## END NEWS SCRAPE ##
+
+        # REDDIT SCRAPE ##
+        # ANY TIME DATA #
+
+        sub_data = fetched['reddit']
+        reddit_totals = None
+        if sub_data is None:
+            print('error fetching reddit data')
+            sub_data = Documents.empty()
+        elif streaming:
+            reddit_totals = sub_data
+            sub_data = Documents.empty()
+        report.count('documents:reddit_posts', sub_data.count('reddit', 'title'))
+        report.count('documents:reddit_comments', sub_data.count('reddit', 'comment'))
+
+        ## END REDDIT SCRAPE ##
+
+        ## ANALYSE SENTIMENT ON ALL DATA ##
+
+        dates = [date.strftime("%Y-%m-%d") for date in daterange(start_time, end_time)]
+        # one table of every document in the run
+        docs = Documents.concat([news_data, sub_data])
+        news_data = sub_data = fetched['reddit'] = None
+
+        # collapse near duplicates so each is scored once
+        dedupe = config.get('SENTIMENT', {}).get('dedupe')
+        if dedupe is not None:
+            with report.stage('dedupe'):
+                cluster_documents(docs, {k: v for k, v in dedupe.items() if k != 'weight'}, report=report)
+
+        with report.stage('scoring'):
+            score_all(docs, workers=workers, chunksize=chunksize, pool=pool, conn=conn,
+                      max_cached=config['GLOBAL'].get('score_cache_size'), report=report)
+
+        with report.stage('aggregation'):
+            # with weight set copies of a text share one vote in the daily means
+            weighted = dedupe is not None and bool(dedupe.get('weight'))
+            scored = pd.concat([get_news_sentiment(docs, weighted), get_reddit_sentiment(docs, weighted)],
+                               ignore_index=True)
+
+            sent_data = get_final_sentiment(stock_data, scored, twtr_data, dates, totals=reddit_totals)
+
+        ## END SENTIMENT ANALYSIS ##
+
+        ## WRITE TO STORE ##
+        print('saving data to store')
+        with report.stage('store_write'):
+            store.upsert(conn, ticker, sent_data.to_dict(orient='index'))
+        print('data saved')
+        ## END WRITE TO STORE ##
+
+        ## NOW LOAD THAT SHIT IN TO PLOT IT ##
+        print('loading data for plot')
+        with report.stage('store_read'):
+            data = store.read(conn, ticker)
+        return data
+        ## END LOADING DATA ##
+    finally:
+        conn.close()
 
@@ -1,4 +1,7 @@
 import stock_funcs as sf
+import sentiment_store as store
+from analytics import SentimentAnalytics, SOURCES
+from sentiment_jobs import SentimentJobs
 import dash
 from dash import html
 from dash import dcc
@@ -6,8 +9,27 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
+import numpy as np
 import pandas as pd
 
+config = sf.load_config()
+store_path = config['GLOBAL'].get('store', 'sentiment.db')
+app_config = config.get('APP', {})
+# points drawn per line, longer histories are downsampled
+max_points = app_config.get('max_points', 1000)
+# intraday bucket lengths in seconds written by streaming.py
+resolutions = config.get('STREAM', {}).get('resolutions', [60, 3600])
+# seconds of intraday buckets read again on every poll, documents such as polled news land in buckets already drawn
+live_redraw = app_config.get('live_redraw', 900)
+# the scorer is loaded and the scoring processes started when the app is loaded, by this script or a WSGI
+# server, before the server starts any threads. Every job scores on this pool rather than forking its own
+sentiment_config = config.get('SENTIMENT', {})
+sf.get_scorer(sentiment_config.get('customwords'), sentiment_config.get('engine'))
+jobs = SentimentJobs(workers=app_config.get('workers', 2), ttl=app_config.get('cache_ttl', 3600),
+                     pool=sf.make_score_pool(sentiment_config.get('workers')))
+# rolling metrics for the tickers run, updated with the days each run stores
+analytics = SentimentAnalytics(**config.get('ANALYTICS', {}))
+
 ## WEB APP ##
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
@@ -27,61 +49,120 @@ app.layout = html.Div(children=[
         dcc.Graph(id='stock-data'),
     ]),
 
-    # Hidden div inside the app that stores the intermediate value
-    html.Div(id='intermediate-value', style={'display': 'none'})
+    html.Div([
+        dcc.Dropdown(id='source', options=[{'label': s, 'value': s} for s in SOURCES], value='reddit',
+                     clearable=False),
+        dcc.Graph(id='analytics'),
+    ]),
+
+    html.Div([
+        dcc.RadioItems(id='resolution', value=resolutions[0], labelStyle={'display': 'inline-block'},
+                       options=[{'label': '{} min'.format(r // 60) if r < 3600 else '{} hour'.format(r // 3600),
+                                 'value': r} for r in resolutions]),
+        dcc.Graph(id='intraday'),
+    ]),
+
+    # polls the store for intraday buckets written by streaming.py
+    dcc.Interval(id='live-poll', interval=app_config.get('live_interval', 5) * 1000),
+    # ticker, resolution and last bucket drawn on the intraday graph
+    dcc.Store(id='intraday-state'),
+    # a new intraday figure, or the buckets to merge into the one drawn
+    dcc.Store(id='intraday-update'),
+
+    # key of the running job, polled until it finishes
+    dcc.Store(id='job'),
+    dcc.Interval(id='poll', interval=2000, disabled=True),
+
+    # key of the finished job, its data is read from the store
+    dcc.Store(id='intermediate-value'),
+
+    # ticker and last date drawn on the graph so later runs only send new days
+    dcc.Store(id='graph-state'),
+    # a new figure, or the days to merge into the one drawn
+    dcc.Store(id='graph-update')
     ])
 
 
-@app.callback(Output('output', 'children'),
-              [Input('submit-button-state', 'n_clicks')],
-              [Input('intermediate-value', 'children')],
-              [State('ticker', 'value')])
-def invalid_ticker(n_clicks, value, ticker):
-    if ticker == 'TICKER':
-        return ''
-    if value is None:
-        return 'cannot get data for ' + ticker
-
-
-@app.callback(Output('intermediate-value', 'children'),
-              [Input('submit-button-state', 'n_clicks')],
-              [State('ticker', 'value')])
-def get_data(n_clicks, ticker):
-    if n_clicks > 0:
-        # call func to get data
-        data = sf.run_sentiment(ticker)
-        df = data.to_json(date_format='iso', orient='split', index=False)
-        return df
-
-
-@app.callback(Output('stock-data', 'figure'),
-              [Input('intermediate-value', 'children')],
-              [State('ticker', 'value')])
-def update_graph(data, ticker):
-    if data is None:
+@app.callback([Output('job', 'data'),
+               Output('poll', 'disabled'),
+               Output('intermediate-value', 'data'),
+               Output('output', 'children')],
+              [Input('submit-button-state', 'n_clicks'),
+               Input('poll', 'n_intervals')],
+              [State('ticker', 'value'),
+               State('job', 'data')])
+def get_data(n_clicks, n_intervals, ticker, job):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'submit-button-state.n_clicks' in triggered:
+        if n_clicks == 0 or ticker == 'TICKER':
+            raise PreventUpdate
+        # start the job, or join one already running or finished today for this ticker
+        job = jobs.submit(ticker)
+    elif job is None:
         raise PreventUpdate
 
-    # load data into dataframe
-    df = pd.read_json(data, orient='split')
-    if df.empty:
-        return
+    status = jobs.status(job)
+    if status == 'running':
+        return job, False, dash.no_update, 'running sentiment analysis for ' + job[0] + '...'
+    if status == 'failed':
+        return None, True, None, 'cannot get data for ' + job[0]
+    return None, True, job, ''
+
+
+# graph traces in order, column and whether it is drawn on the sentiment axis
+TRACES = [('news', 'News', 'firebrick', True),
+          ('reddit', 'Reddit', 'royalblue', True),
+          ('twitter', 'socialsentiment.io', 'orange', True),
+          ('close', 'Price', 'black', False)]
 
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
 
-    dates = list(df['date'])
+def lttb(y, threshold):
+    """
+    Downsample a series with largest triangle three buckets, keeping the points that best preserve
+    its shape. Points are taken as evenly spaced
+    :param y: array of values, no nans
+    :param threshold: number of points to keep
+    :return: array of indices of the points kept
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=float)
+    x = np.arange(n, dtype=float)
+    keep = np.empty(threshold, dtype=int)
+    keep[0] = 0
+    keep[-1] = n - 1
+    # first and last points are always kept, the rest are split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def _values(series):
+    # json has no nan so send missing values as null
+    return [None if np.isnan(v) else float(v) for v in series]
+
+
+def build_figure(df, ticker):
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
 
     # Create and style traces
-    fig.add_trace(go.Scatter(x=dates, y=df['news'], name='News',
-                             line=dict(color='firebrick')), secondary_y=True, )
-    fig.add_trace(go.Scatter(x=dates, y=df['reddit'], name='Reddit',
-                             line=dict(color='royalblue')), secondary_y=True, )
-    fig.add_trace(go.Scatter(x=dates, y=df['twitter'], name='socialsentiment.io',
-                             line=dict(color='orange')), secondary_y=True, )
+    for column, name, color, sentiment in TRACES:
+        data = df[['date', column]].dropna()
+        keep = lttb(data[column].values, max_points)
+        fig.add_trace(go.Scatter(x=list(data['date'].values[keep]), y=list(data[column].values[keep]), name=name,
+                                 line=dict(color=color)), secondary_y=sentiment, )
     # fig.add_trace(go.Scatter(x=dates, y=df['mean'], name='Mean',
     #                         line=dict(color='orange')), secondary_y=True, )
-    fig.add_trace(go.Scatter(x=dates, y=df['close'], name='Price',
-                             line=dict(color='black')),
-                  secondary_y=False, )  # dash options include 'dash', 'dot', and 'dashdot'
 
     # Add figure title
     fig.update_layout(title_text=ticker)
@@ -96,5 +177,212 @@ def update_graph(data, ticker):
     return fig
 
 
+def graph_update(conn, ticker, shown=None):
+    """
+    Data to update the graph with after a run
+    :param conn: sentiment store connection
+    :param ticker: stock ticker
+    :param shown: graph-state of the graph drawn, None if nothing is drawn
+    :return: graph-update data, either a figure or the days from the last one drawn, and the new graph-state.
+    None if there is nothing stored
+    """
+    if shown is not None and shown['ticker'] == ticker:
+        # same ticker already drawn, only read and send the days from the last one drawn. Every run fetches
+        # the last stored day again so it is sent again with its corrected values
+        df = store.read(conn, ticker, start=shown['last_date'])
+    else:
+        df = store.read(conn, ticker)
+    if df.empty:
+        return None
+
+    state = {'ticker': ticker, 'last_date': df['date'].iloc[-1]}
+    if shown is not None and shown['ticker'] == ticker:
+        data = [df[['date', column]].dropna() for column, name, color, s in TRACES]
+        update = {'from': shown['last_date'], 'x': [list(d['date']) for d in data],
+                  'y': [_values(d[column]) for d, (column, name, color, s) in zip(data, TRACES)]}
+        return update, state
+    return {'figure': build_figure(df, ticker).to_plotly_json()}, state
+
+
+@app.callback([Output('graph-update', 'data'),
+               Output('graph-state', 'data')],
+              [Input('intermediate-value', 'data')],
+              [State('graph-state', 'data')])
+def update_graph(job, shown):
+    if job is None:
+        raise PreventUpdate
+    conn = store.connect(store_path)
+    try:
+        result = graph_update(conn, job[0], shown)
+    finally:
+        conn.close()
+    if result is None:
+        raise PreventUpdate
+    return result
+
+
+# a new figure is drawn as it is, otherwise the points from the first x sent are replaced with the points sent,
+# keeping the last max_points if given. extendData can only add points so points already drawn that have changed,
+# the last day each run corrects or buckets late documents land in, are merged here in the browser
+MERGE_FIGURE = """
+    function(update, figure) {
+        if (!update) {
+            return window.dash_clientside.no_update;
+        }
+        if (update.figure) {
+            return update.figure;
+        }
+        var data = figure.data.map(function(trace, i) {
+            var keep = 0;
+            while (keep < trace.x.length && trace.x[keep] < update.from) {
+                keep++;
+            }
+            var x = trace.x.slice(0, keep).concat(update.x[i]);
+            var y = trace.y.slice(0, keep).concat(update.y[i]);
+            if (update.max_points && x.length > update.max_points) {
+                x = x.slice(-update.max_points);
+                y = y.slice(-update.max_points);
+            }
+            return Object.assign({}, trace, {x: x, y: y});
+        });
+        return Object.assign({}, figure, {data: data});
+    }
+    """
+
+app.clientside_callback(
+    MERGE_FIGURE,
+    Output('stock-data', 'figure'),
+    [Input('graph-update', 'data')],
+    [State('stock-data', 'figure')])
+
+
+def build_analytics_figure(ticker, source):
+    fig = make_subplots(rows=1, cols=2, column_widths=[0.7, 0.3],
+                        subplot_titles=('{} sentiment z-score'.format(source), 'correlation with returns by lag'))
+    z = analytics.query(source + '_z', [ticker])
+    if not z.empty:
+        data = z[ticker].dropna()
+        keep = lttb(data.values, max_points)
+        fig.add_trace(go.Scatter(x=list(data.index[keep]), y=list(data.values[keep]), name='z-score',
+                                 line=dict(color='royalblue')), row=1, col=1)
+    lags = analytics.lead_lag(ticker, source)
+    fig.add_trace(go.Bar(x=list(lags.index), y=_values(lags), name='correlation', marker_color='firebrick'),
+                  row=1, col=2)
+    fig.update_xaxes(title_text='lag days, positive is sentiment leading', row=1, col=2)
+    fig.update_yaxes(range=[-1, 1], row=1, col=2)
+    fig.update_layout(title_text=ticker, showlegend=False)
+    return fig
+
+
+@app.callback(Output('analytics', 'figure'),
+              [Input('intermediate-value', 'data'),
+               Input('source', 'value')])
+def update_analytics(job, source):
+    if job is None:
+        raise PreventUpdate
+    ticker = job[0]
+    if 'intermediate-value.data' in [t['prop_id'] for t in dash.callback_context.triggered]:
+        # a run finished, add the days it stored
+        conn = store.connect(store_path)
+        try:
+            analytics.refresh(conn, [ticker])
+        finally:
+            conn.close()
+    return build_analytics_figure(ticker, source)
+
+
+# intraday traces in order, source and colour, then the count of documents per bucket
+LIVE_TRACES = [('news', 'firebrick'), ('reddit', 'royalblue')]
+
+
+def intraday_values(df):
+    """
+    Mean sentiment per source and the number of documents in each bucket
+    :param df: df from store.read_intraday
+    :return: list of bucket times, list of values for each trace in LIVE_TRACES then the counts
+    """
+    sources = [source for source, color in LIVE_TRACES]
+    counts = df.groupby('bucket')['count'].sum()
+    means = (df.pivot(index='bucket', columns='source', values='sum')
+             / df.pivot(index='bucket', columns='source', values='count')).reindex(index=counts.index, columns=sources)
+    times = [t.isoformat() for t in pd.to_datetime(counts.index, unit='s')]
+    return times, [_values(means[source]) for source in sources] + [_values(counts.astype(float))]
+
+
+def build_intraday_figure(df, ticker):
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    times, values = intraday_values(df)
+    for (source, color), y in zip(LIVE_TRACES, values):
+        fig.add_trace(go.Scatter(x=times, y=y, name=source, line=dict(color=color)), secondary_y=True)
+    fig.add_trace(go.Bar(x=times, y=values[-1], name='documents', marker_color='lightgrey'), secondary_y=False)
+    fig.update_layout(title_text=ticker + ' intraday (UTC)')
+    fig.update_yaxes(title_text="Documents", secondary_y=False)
+    fig.update_yaxes(title_text="Negative <- Sentiment -> Positive", range=[-1, 1], secondary_y=True)
+    return fig
+
+
+def intraday_update(conn, ticker, resolution, shown=None):
+    """
+    Data to update the intraday graph with from the store
+    :param conn: sentiment store connection
+    :param ticker: stock ticker
+    :param resolution: bucket length in seconds
+    :param shown: intraday-state of the graph drawn, None if nothing is drawn
+    :return: intraday-update data, either a figure or the buckets from the first one read again, and the new
+    intraday-state. None if there is nothing new to draw
+    """
+    same = shown is not None and shown['ticker'] == ticker and shown['resolution'] == resolution
+    # buckets after the last one drawn, and the last live_redraw seconds before it again as documents are
+    # bucketed by when they were posted so can arrive after their bucket was drawn
+    start = (shown['bucket'] + resolution - live_redraw) // resolution * resolution if same else None
+    df = store.read_intraday(conn, ticker, resolution, start=start)
+    # the latest bucket may still be filling so it is drawn once the stream moves on to the next
+    df = df[df['bucket'] < df['bucket'].max()]
+    if df.empty:
+        if same:
+            return None
+        return {'figure': build_intraday_figure(df, ticker).to_plotly_json()}, \
+            {'ticker': ticker, 'resolution': resolution, 'bucket': -resolution}
+
+    state = {'ticker': ticker, 'resolution': resolution, 'bucket': int(df['bucket'].max())}
+    if same:
+        times, values = intraday_values(df)
+        return {'from': times[0], 'x': [times for v in values], 'y': values, 'max_points': max_points}, state
+
+    # start with the latest max_points buckets
+    df = df[df['bucket'] > state['bucket'] - max_points * resolution]
+    return {'figure': build_intraday_figure(df, ticker).to_plotly_json()}, state
+
+
+@app.callback([Output('intraday-update', 'data'),
+               Output('intraday-state', 'data')],
+              [Input('live-poll', 'n_intervals'),
+               Input('resolution', 'value')],
+              [State('ticker', 'value'),
+               State('intraday-state', 'data')])
+def update_intraday(n_intervals, resolution, ticker, shown):
+    if not ticker or ticker == 'TICKER':
+        raise PreventUpdate
+    conn = store.connect(store_path)
+    try:
+        result = intraday_update(conn, ticker.upper(), resolution, shown)
+    finally:
+        conn.close()
+    if result is None:
+        raise PreventUpdate
+    return result
+
+
+app.clientside_callback(
+    MERGE_FIGURE,
+    Output('intraday', 'figure'),
+    [Input('intraday-update', 'data')],
+    [State('intraday', 'figure')])
+
+
 if __name__ == '__main__':
-    app.run_server(debug=True)
+    try:
+        app.run_server(debug=True)
+    finally:
+        jobs.pool.close()
+        jobs.pool.join()
@@ -0,0 +1,362 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import stock_funcs as sf
+import sentiment_store as store
+from batch_sentiment import read_watchlist
+
+# seconds in each aggregate bucket, per minute and per hour
+RESOLUTIONS = (60, 3600)
+
+
+class IntradayAggregates:
+    """
+    Running count, sum and sum of squares of sentiment per ticker, source and time bucket at each
+    resolution. Only totals not yet flushed to the store are held, so memory depends on the tickers and
+    the flush interval rather than the documents seen
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.resolutions = tuple(resolutions)
+        self.lock = threading.Lock()
+        self.totals = {}  # (ticker, resolution, bucket, source): [count, sum, sumsq]
+
+    def add(self, tickers, source, timestamp, score):
+        """
+        Add a scored document to the buckets it falls in
+        :param tickers: tickers the document is about
+        :param source: source name e.g. reddit or news
+        :param timestamp: unix time the document was posted
+        :param score: sentiment score, nan is ignored
+        """
+        if np.isnan(score):
+            return
+        with self.lock:
+            for resolution in self.resolutions:
+                bucket = int(timestamp // resolution * resolution)
+                for ticker in tickers:
+                    total = self.totals.setdefault((ticker, resolution, bucket, source), [0, 0., 0.])
+                    total[0] += 1
+                    total[1] += score
+                    total[2] += score * score
+
+    def drain(self):
+        """
+        Take the totals added since the last drain
+        :return: list of (ticker, resolution, bucket, source, count, sum, sumsq) for store.add_intraday
+        """
+        with self.lock:
+            totals, self.totals = self.totals, {}
+        return [key + tuple(total) for key, total in totals.items()]
+
+
+class StreamProcessor:
+    """
+    Scores streamed documents, adds them to the aggregates of every watched ticker they mention and
+    flushes the aggregates to the store in batches. Documents are dicts of source, id, time (unix),
+    texts (parts scored and averaged e.g. title and body) and optionally the tickers they are about,
+    otherwise tickers are found in the texts
+    """
+
+    def __init__(self, tickers, conn, resolutions=RESOLUTIONS, flush_interval=10., flush_size=1000,
+                 seen_size=100000, posts_size=10000):
+        self.tickers = {t.upper(): t for t in tickers}
+        self.matcher = sf.build_ticker_matcher(tickers)
+        self.conn = conn
+        self.scorer = sf.get_scorer()
+        self.aggregates = IntradayAggregates(resolutions)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.last_flush = time.monotonic()
+        self.unflushed = 0
+        self.documents = 0
+        # ids recently processed, streams can repeat documents on reconnect and news polls overlap
+        self.seen = OrderedDict()
+        self.seen_size = seen_size
+        # tickers of recent posts, their comments count for the same tickers as in the daily runs
+        self.posts = OrderedDict()
+        self.posts_size = posts_size
+
+    @staticmethod
+    def _remember(cache, key, value, size):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > size:
+            cache.popitem(last=False)
+
+    def _tickers(self, doc):
+        if doc.get('tickers') is not None:
+            mentioned = {t.upper() for t in doc['tickers']}
+        else:
+            mentioned = set()
+            for text in doc['texts']:
+                mentioned |= sf.find_tickers(self.matcher, text)
+        if doc.get('parent') is not None:
+            mentioned |= self.posts.get(doc['parent'], set())
+        mentioned &= self.tickers.keys()
+        if doc.get('post'):
+            self._remember(self.posts, doc['id'], mentioned, self.posts_size)
+        return [self.tickers[t] for t in mentioned]
+
+    def process(self, docs):
+        """
+        Score a batch of documents and add them to the aggregates, flushing if due
+        :param docs: list of document dicts
+        :return: number of documents added to at least one ticker
+        """
+        added = 0
+        todo = []
+        for doc in docs:
+            if doc['id'] in self.seen:
+                continue
+            self._remember(self.seen, doc['id'], None, self.seen_size)
+            tickers = self._tickers(doc)
+            if tickers:
+                todo.append((doc, tickers))
+        # score every text in the batch in one call
+        scores = iter(self.scorer.score_many([text for doc, tickers in todo for text in doc['texts']]))
+        for doc, tickers in todo:
+            parts = [next(scores) for text in doc['texts']]
+            score = np.mean(parts) if parts else np.nan
+            self.aggregates.add(tickers, doc['source'], doc['time'], score)
+            added += 1
+        self.documents += added
+        self.unflushed += added
+        if self.unflushed >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+        return added
+
+    def flush(self):
+        """
+        Write the aggregates to the store
+        :return: number of rows written
+        """
+        rows = self.aggregates.drain()
+        written = store.add_intraday(self.conn, rows) if rows else 0
+        self.last_flush = time.monotonic()
+        self.unflushed = 0
+        return written
+
+
+def reddit_source(subs, config, stop):
+    """
+    Follow new posts and comments in subs
+    :param subs: subs to follow
+    :param config: reddit config
+    :param stop: event to stop following
+    :return: generator of documents
+    """
+    reddit = sf.get_reddit_client(config)
+    subreddit = reddit.subreddit('+'.join(subs))
+    # pause_after=-1 yields None whenever a stream has nothing new so both streams are followed in turn
+    posts = subreddit.stream.submissions(pause_after=-1, skip_existing=True)
+    comments = subreddit.stream.comments(pause_after=-1, skip_existing=True)
+    while not stop.is_set():
+        for post in posts:
+            if post is None or stop.is_set():
+                break
+            yield {'source': 'reddit', 'id': 'reddit:' + post.id, 'time': post.created_utc,
+                   'texts': [post.title, post.selftext], 'post': True}
+        for comment in comments:
+            if comment is None or stop.is_set():
+                break
+            yield {'source': 'reddit', 'id': 'reddit:' + comment.id, 'time': comment.created_utc,
+                   'texts': [comment.body], 'parent': 'reddit:' + comment.link_id.split('_', 1)[-1]}
+
+
+def _utcnow():
+    # newsapi reads times without a timezone as UTC
+    return pd.Timestamp.now(tz='UTC').tz_localize(None)
+
+
+def news_source(tickers, apikey, stop, interval=300, news_config=None, overlap=None):
+    """
+    Poll newsapi for new articles about each ticker
+    :param tickers: list of tickers
+    :param apikey: newsapi key
+    :param stop: event to stop polling
+    :param interval: seconds between polls
+    :param news_config: NEWS section of config.yaml passed to get_news
+    :param overlap: seconds each poll reaches back before the end of the last one so articles indexed late
+    are not missed, None for interval. Articles seen before are dropped by StreamProcessor
+    :return: generator of documents
+    """
+    news_config = dict(news_config or {})
+    overlap = pd.Timedelta(seconds=interval if overlap is None else overlap)
+    since = {ticker: _utcnow() - pd.Timedelta(seconds=interval) for ticker in tickers}
+    while not stop.is_set():
+        for ticker in tickers:
+            now = _utcnow()
+            try:
+                articles = sf.get_news(ticker, (since[ticker] - overlap).to_pydatetime(), apikey,
+                                       to_date=now.to_pydatetime(), align=False, **news_config)['articles']
+            except Exception as e:
+                print('error polling news for', ticker)
+                print(e)
+                continue
+            since[ticker] = now
+            for article in articles:
+                published = pd.to_datetime(article.get('publishedAt'), format='%Y-%m-%dT%H:%M:%SZ', errors='coerce')
+                if pd.isna(published):
+                    continue
+                # articles without content are scored on the title alone, as in the daily runs
+                texts = [t for t in (article.get('title'), article.get('content')) if t]
+                if not texts:
+                    continue
+                yield {'source': 'news', 'id': 'news:' + (article.get('url') or texts[0]),
+                       'time': published.timestamp(), 'texts': texts, 'tickers': [ticker]}
+        stop.wait(interval)
+
+
+def replay_source(filename, stop, speed=60.):
+    """
+    Replay documents recorded with run_stream(record=...), keeping their original times
+    :param filename: recorded json lines file
+    :param stop: event to stop replaying
+    :param speed: how many times faster than recorded to replay, 0 for as fast as possible
+    :return: generator of documents
+    """
+    started = time.monotonic()
+    first = None
+    with open(filename, 'r') as file:
+        for line in file:
+            if stop.is_set():
+                return
+            doc = json.loads(line)
+            if speed:
+                # wait until this document is due at the replay speed
+                first = doc['received'] if first is None else first
+                wait = (doc['received'] - first) / speed - (time.monotonic() - started)
+                if wait > 0 and stop.wait(wait):
+                    return
+            yield doc
+
+
+def run_stream(tickers, conn, sources, stop=None, resolutions=RESOLUTIONS, flush_interval=10., flush_size=1000,
+               record=None):
+    """
+    Score documents from every source as they arrive until stopped or every source ends. Each source runs
+    on its own thread, a source that fails is restarted after a pause
+    :param tickers: list of tickers to aggregate
+    :param conn: store connection
+    :param sources: dict of name: function taking the stop event and returning a generator of documents
+    :param stop: event to stop streaming, one is made if None
+    :param resolutions: bucket lengths in seconds
+    :param flush_interval: most seconds between writes to the store
+    :param flush_size: documents added before writing early
+    :param record: filename to append every document received to, for replay_source
+    :return: StreamProcessor with the totals processed
+    """
+    stop = stop or threading.Event()
+    docs = queue.Queue(maxsize=10000)
+    processor = StreamProcessor(tickers, conn, resolutions=resolutions, flush_interval=flush_interval,
+                                flush_size=flush_size)
+
+    def follow(name, source):
+        while not stop.is_set():
+            try:
+                for doc in source(stop):
+                    while not stop.is_set():
+                        try:
+                            docs.put(doc, timeout=0.5)
+                            break
+                        except queue.Full:
+                            continue
+                return
+            except Exception as e:
+                print('error streaming from {}, restarting in 30s'.format(name))
+                print(e)
+                stop.wait(30)
+
+    threads = [threading.Thread(target=follow, args=item, daemon=True) for item in sources.items()]
+    for thread in threads:
+        thread.start()
+    recording = open(record, 'a') if record else None
+    try:
+        while not stop.is_set() and (any(t.is_alive() for t in threads) or not docs.empty()):
+            batch = []
+            try:
+                batch.append(docs.get(timeout=min(flush_interval, 1.)))
+                while len(batch) < flush_size:
+                    batch.append(docs.get_nowait())
+            except queue.Empty:
+                pass
+            if recording is not None:
+                now = time.time()
+                for doc in batch:
+                    recording.write(json.dumps(dict(doc, received=doc.get('received', now))) + '\n')
+            if batch:
+                processor.process(batch)
+            elif time.monotonic() - processor.last_flush >= flush_interval:
+                processor.flush()
+    finally:
+        stop.set()
+        processor.flush()
+        if recording is not None:
+            recording.close()
+    print('streamed {} documents'.format(processor.documents))
+    return processor
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream reddit and news sentiment into intraday aggregates')
+    parser.add_argument('tickers', nargs='*', help='tickers to follow')
+    parser.add_argument('-w', '--watchlist', help='file of tickers, one per line or comma separated')
+    parser.add_argument('-c', '--config', default='config.yaml', help='config file')
+    parser.add_argument('--replay', help='replay documents recorded with --record instead of streaming live')
+    parser.add_argument('--speed', type=float, help='how many times faster than recorded to replay, 0 for as '
+                                                    'fast as possible')
+    parser.add_argument('--record', help='append every document received to this file')
+    parser.add_argument('--no-reddit', action='store_true', help='do not follow reddit')
+    parser.add_argument('--no-news', action='store_true', help='do not poll newsapi')
+    args = parser.parse_args()
+
+    tickers = [t.upper() for t in args.tickers]
+    if args.watchlist:
+        tickers.extend(read_watchlist(args.watchlist))
+    if not tickers:
+        parser.error('no tickers given')
+
+    config = sf.load_config(args.config)
+    stream_config = config.get('STREAM', {})
+    sf.get_session(config.get('HTTP'))
+    sf.get_scorer(config.get('SENTIMENT', {}).get('customwords'), config.get('SENTIMENT', {}).get('engine'))
+
+    if args.replay:
+        speed = args.speed if args.speed is not None else stream_config.get('replay_speed', 60)
+        sources = {'replay': lambda stop: replay_source(args.replay, stop, speed=speed)}
+    else:
+        sources = {}
+        if not args.no_reddit:
+            sources['reddit'] = lambda stop: reddit_source(config['REDDIT']['subs'], config['REDDIT'], stop)
+        if not args.no_news:
+            sources['news'] = lambda stop: news_source(tickers, config['APIKEYS']['newsapi'], stop,
+                                                       interval=stream_config.get('news_interval', 300),
+                                                       news_config=config.get('NEWS'),
+                                                       overlap=stream_config.get('news_overlap'))
+        if not sources:
+            parser.error('no sources to stream from')
+
+    conn = store.connect(config['GLOBAL'].get('store', 'sentiment.db'))
+    stop = threading.Event()
+    try:
+        run_stream(tickers, conn, sources, stop=stop, resolutions=stream_config.get('resolutions', RESOLUTIONS),
+                   flush_interval=stream_config.get('flush_interval', 10),
+                   flush_size=stream_config.get('flush_size', 1000), record=args.record)
+    except KeyboardInterrupt:
+        stop.set()
+        print('stopped streaming')
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# the modules live in the repo root rather than a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def config(tmp_path):
+    """
+    Minimal run config with the store in a temporary directory and nothing that needs api keys
+    """
+    return {
+        'GLOBAL': {'lookback': 5, 'sublimit': 1, 'store': str(tmp_path / 'sentiment.db'), 'timeouts': {}},
+        'APIKEYS': {'socialsentiment': 'key', 'newsapi': 'key'},
+        'REDDIT': {'subs': ['stocks'], 'concurrency': 2, 'requests_per_minute': 0},
+        'SENTIMENT': {'engine': 'fast', 'workers': 1},
+        'METRICS': {},
+    }
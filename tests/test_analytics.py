@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import sentiment_store as store
+from analytics import FIELDS, SentimentAnalytics, compute, to_panel
+
+
+def make_rows(tickers=('ABC', 'XYZ'), days=40, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2021-01-01', periods=days, freq='D').strftime('%Y-%m-%d')
+    rows = []
+    for ticker in tickers:
+        data = pd.DataFrame(rng.uniform(-1, 1, size=(days, len(FIELDS))), columns=FIELDS)
+        data['close'] = 100 + np.cumsum(rng.normal(0, 1, days))
+        data['vol'] = rng.uniform(1e5, 1e6, days)
+        # a day missing from a source
+        data.loc[days // 2, 'news'] = np.nan
+        data.insert(0, 'date', dates)
+        data.insert(0, 'ticker', ticker)
+        rows.append(data)
+    return pd.concat(rows, ignore_index=True)
+
+
+def test_updates_match_full_compute():
+    data = make_rows()
+    analytics = SentimentAnalytics(window=10, max_lag=2, min_periods=3)
+    dates = sorted(data['date'].unique())
+    # a first batch, then a day at a time with the last day seen sent again corrected as runs do. A new
+    # ticker joins part way through
+    analytics.update(data[(data['date'] < dates[20]) & (data['ticker'] == 'ABC')])
+    stale = data[data['date'] == dates[20]].assign(reddit=0.)
+    analytics.update(stale)
+    analytics.update(data[(data['date'] < dates[20]) & (data['ticker'] == 'XYZ')])
+    for i in range(20, len(dates)):
+        analytics.update(data[data['date'].isin(dates[i - 1:i + 1])])
+
+    expected = compute(to_panel(data), 10, 2, 3)
+    metrics = analytics.metrics.reindex(index=expected.index, columns=expected.columns)
+    pd.testing.assert_frame_equal(metrics, expected, check_names=False)
+
+
+def test_quiet_ticker_gets_metrics_once_it_has_data(tmp_path):
+    conn = store.connect(str(tmp_path / 'sentiment.db'))
+    analytics = SentimentAnalytics(window=5, max_lag=1, min_periods=2)
+    assert analytics.lead_lag('ABC').isna().all()
+    # a run with nothing for any source or price stores empty days
+    store.upsert(conn, 'ABC', {'2021-01-01': {}, '2021-01-02': {}})
+    assert analytics.refresh(conn, ['ABC']).empty
+
+    data = make_rows(['ABC'], days=10)
+    store.upsert(conn, 'ABC', data.drop(columns='ticker').set_index('date').to_dict(orient='index'))
+    metrics = analytics.refresh(conn, ['ABC'])
+    conn.close()
+    assert not metrics.empty
+    assert not analytics.lead_lag('ABC').isna().all()
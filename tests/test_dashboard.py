@@ -0,0 +1,51 @@
+import importlib
+import json
+
+import pytest
+
+import sentiment_store as store
+
+
+@pytest.fixture
+def dashboard(tmp_path, monkeypatch):
+    # the dashboard loads config.yaml from the working directory when it is imported
+    (tmp_path / 'config.yaml').write_text(json.dumps({'GLOBAL': {'store': str(tmp_path / 'sentiment.db')},
+                                                      'SENTIMENT': {'engine': 'fast', 'workers': 1}}))
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module('stock_sentiment_analysis')
+
+
+def test_graph_update_resends_last_day(dashboard, tmp_path):
+    conn = store.connect(str(tmp_path / 'sentiment.db'))
+    store.upsert(conn, 'ABC', {'2021-01-01': {'reddit': 0.1, 'close': 10.},
+                               '2021-01-02': {'reddit': 0.2, 'close': 11.}})
+    figure, shown = dashboard.graph_update(conn, 'ABC')
+    assert 'figure' in figure and shown == {'ticker': 'ABC', 'last_date': '2021-01-02'}
+
+    # the next run rewrites the last day and adds a new one
+    store.upsert(conn, 'ABC', {'2021-01-02': {'reddit': 0.5, 'close': 12.}, '2021-01-03': {'reddit': 0.3}})
+    update, shown = dashboard.graph_update(conn, 'ABC', shown)
+    conn.close()
+    reddit = [column for column, name, color, s in dashboard.TRACES].index('reddit')
+    assert update['from'] == '2021-01-02'
+    assert update['x'][reddit] == ['2021-01-02', '2021-01-03'] and update['y'][reddit] == [0.5, 0.3]
+    assert shown['last_date'] == '2021-01-03'
+
+
+def test_intraday_update_resends_late_documents(dashboard, tmp_path):
+    conn = store.connect(str(tmp_path / 'sentiment.db'))
+    # reddit comments in minutes 0 to 10, minute 10 still filling
+    store.add_intraday(conn, [('ABC', 60, 60 * m, 'reddit', 1, 0.5, 0.25) for m in range(11)])
+    figure, shown = dashboard.intraday_update(conn, 'ABC', 60)
+    assert 'figure' in figure and shown['bucket'] == 540
+
+    # a news article posted in minute 5 arrives with the next poll, after minute 5 was drawn
+    store.add_intraday(conn, [('ABC', 60, 300, 'news', 1, -0.8, 0.64), ('ABC', 60, 660, 'reddit', 1, 0.5, 0.25)])
+    update, shown = dashboard.intraday_update(conn, 'ABC', 60, shown)
+    conn.close()
+    assert shown['bucket'] == 600
+    news = [source for source, color in dashboard.LIVE_TRACES].index('news')
+    times = update['x'][news]
+    assert update['from'] == times[0] <= '1970-01-01T00:05:00'
+    assert update['y'][news][times.index('1970-01-01T00:05:00')] == -0.8
+    assert times[-1] == '1970-01-01T00:10:00'
@@ -0,0 +1,57 @@
+import random
+
+import numpy as np
+
+import sentiment_store as store
+import stock_funcs as sf
+from dedupe import MinHashLSH
+from documents import Documents
+
+WORDS = ['stock', 'moon', 'buy', 'sell', 'calls', 'puts', 'earnings', 'guidance', 'up', 'down', 'hold', 'dip']
+
+
+def make_texts(n=300, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 300)))
+        texts.append(text)
+        if rng.random() < 0.3:
+            # an edited copy
+            words = text.split()
+            words[len(words) // 2] = 'tendies'
+            texts.append(' '.join(words))
+        if rng.random() < 0.1:
+            texts.append(rng.choice([None, texts[0]]))
+    return texts
+
+
+def test_signatures_same_when_split_into_chunks():
+    texts = [t for t in make_texts() if t is not None and len(t.split()) >= 6]
+    assert np.array_equal(MinHashLSH().signatures(texts), MinHashLSH(max_shingles=50).signatures(texts))
+
+
+def test_cluster_documents_matches_clusters():
+    texts = make_texts()
+    n = len(texts)
+    docs = Documents.from_columns(source=['reddit'] * n, date=['2021-01-01'] * n, id=[str(i) for i in range(n)],
+                                  kind=['comment'] * n, doc=np.arange(n), text=texts)
+    clusters = sf.cluster_documents(docs, {'threshold': 0.8}, batch=37)
+    assert clusters.tolist() == MinHashLSH(threshold=0.8).clusters(texts)
+
+
+def test_near_duplicate_scores_not_cached(tmp_path):
+    texts = ['great earnings for the quarter', 'good earnings for the quarter']
+    docs = Documents.from_columns(['news'] * 2, ['2021-01-01'] * 2, ['a', 'b'], ['title'] * 2, [0, 1], texts)
+    # the second text is a near duplicate of the first and given its score
+    docs.cluster = np.array([0, 0])
+    conn = store.connect(str(tmp_path / 'sentiment.db'))
+    try:
+        sf.get_scorer(sf.DEFAULT_CUSTOMWORDS)
+        scores = sf.score_all(docs, workers=1, conn=conn)
+        assert scores[0] == scores[1]
+        # without dedupe the copy is scored as itself rather than served its representative's score
+        docs = Documents.from_columns(['news'] * 2, ['2021-01-01'] * 2, ['a', 'b'], ['title'] * 2, [0, 1], texts)
+        assert list(sf.score_all(docs, workers=1, conn=conn)) == sf.get_scorer().score_many(texts)
+    finally:
+        conn.close()
@@ -0,0 +1,58 @@
+import pytest
+from vaderSentiment import vaderSentiment as vader
+
+from fast_vader import FastSentimentAnalyzer
+
+# the edge cases VADER handles with special rules, each should score exactly the same
+SENTENCES = [
+    # idioms and special cases
+    'The stock is the shit', 'This rally is the bomb', 'That earnings call was bad ass',
+    'Their guidance is the bomb and kiss of death', 'He is yeah right a genius', 'This one will break a leg',
+    'Cut the mustard or hand to mouth', 'Back handed compliment from the ceo', 'It is the shit!!! :)',
+    # "but" shifts the weight to the clause after it
+    'The stock is good but the ceo is terrible', 'Bad quarter, BUT great guidance', 'but but but good',
+    'not bad but not great', 'good but', 'But it crashed',
+    # least and at least
+    'least good stock', 'at least it is good', 'this is the least bad option', 'very least bad', 'least',
+    # booster phrases
+    'kind of good', 'sort of bad', 'kind of', 'It is kinda good', 'sorta bad earnings', 'kind of kind of great',
+    'the very kind of good', 'extremely good', 'barely good', 'slightly bad', 'hardly good at all',
+    # never so and never this
+    'never so good', 'never this bad', 'it was never so very good', 'never good', 'never ever so bad',
+    # negations and contractions
+    'not good', "isn't good", "wasn't very good", 'not bad at all', 'no good', 'nothing good',
+    'without doubt good', "don't not like it", 'not the best', 'never not good', "aint good", 'no',
+    'no no no', 'No.', 'no!', 'not really good', 'wouldnt buy', 'not very not good',
+    # caps differentials
+    'GOOD', 'This is GOOD', 'VERY good', 'very GOOD', 'NOT GOOD', 'I LOVE THIS STOCK', 'I LOVE this stock',
+    'GREAT earnings but BAD guidance', 'KIND OF GOOD', 'SUPER bad', 'A', 'OK',
+    # punctuation emphasis
+    'good!', 'good!!!', 'good!!!!!!!', 'good?', 'good??', 'good???', 'bad?!?!', 'good!?', 'great!!! or not?',
+    # emoji and emoticons
+    '\U0001F600', '\U0001F600 good', 'good\U0001F680\U0001F680', 'crash \U0001F62D', ':)', ':(', ':-)',
+    ':D good', 'to the moon \U0001F680\U0001F31D', 'bad :(', '<3', '❤️',
+    # mixed and odd text
+    '', ' ', '!!!', '...', 'the', 'good bad good bad', 'good, bad; good. bad', 'go0d', 'GOOD-ish',
+    'Tendies!!! CALLS to the MOON', 'The stock is not very good, but at least it is not terrible!!!',
+    'https://example.com/good', '$ABC is good', '@user bad', '#good', 'good\nbad', 'good\tbad',
+]
+
+
+@pytest.fixture(scope='module')
+def analysers():
+    return vader.SentimentIntensityAnalyzer(), FastSentimentAnalyzer()
+
+
+@pytest.mark.parametrize('sentence', SENTENCES)
+def test_matches_vader(analysers, sentence):
+    slow, fast = analysers
+    assert fast.compound(sentence) == slow.polarity_scores(sentence)['compound']
+
+
+def test_custom_words_match_vader():
+    customwords = {'moon': 3.0, 'tendies': 2.5, 'bagholder': -2.0, 'good': -1.0}
+    slow, fast = vader.SentimentIntensityAnalyzer(), FastSentimentAnalyzer()
+    slow.lexicon.update(customwords)
+    fast.lexicon.update(customwords)
+    for sentence in ['to the moon', 'not tendies', 'BAGHOLDER but moon', 'kind of good', 'never so moon!!!']:
+        assert fast.compound(sentence) == slow.polarity_scores(sentence)['compound'], sentence
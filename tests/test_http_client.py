@@ -0,0 +1,30 @@
+import requests
+
+from http_client import HTTPSession, ResponseCache
+
+
+def test_revalidates_with_lower_case_etag(tmp_path, monkeypatch):
+    sent = []
+
+    def request(session, method, url, **kwargs):
+        sent.append(dict(kwargs.get('headers') or {}))
+        response = requests.Response()
+        response.url = url
+        if len(sent) == 1:
+            response.status_code = 200
+            response.headers['etag'] = '"v1"'
+            response._content = b'{"value": 1}'
+        else:
+            response.status_code = 304
+            response._content = b''
+        return response
+
+    monkeypatch.setattr(requests.Session, 'request', request)
+    cache = ResponseCache(str(tmp_path / 'cache.db'), ttls={'example.com': 60})
+    session = HTTPSession(cache=cache)
+    assert session.get('https://example.com/data').json() == {'value': 1}
+    # make the cached response stale
+    cache.conn.execute('UPDATE responses SET stored = 0')
+    response = session.get('https://example.com/data')
+    assert sent[1]['If-None-Match'] == '"v1"'
+    assert response.json() == {'value': 1}
@@ -0,0 +1,73 @@
+import datetime as dt
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import stock_funcs as sf
+
+LATENCY = 0.01
+START = dt.datetime(2021, 1, 1)
+END = dt.datetime(2021, 1, 3)
+
+
+class FakePushshift:
+    """
+    Stands in for psaw, returning n submissions for a sub after one round trip
+    """
+
+    def __init__(self, n):
+        self.n = n
+
+    def search_submissions(self, subreddit, **kwargs):
+        time.sleep(LATENCY)
+        for i in range(self.n):
+            # psaw results end with the dict of the submission
+            yield (subreddit + str(i), {'id': '{}_{}'.format(subreddit, i)})
+
+
+class FakeComments:
+
+    def __init__(self, id):
+        self.id = id
+
+    def replace_more(self, limit=1):
+        time.sleep(LATENCY)
+
+    def list(self):
+        return [SimpleNamespace(id=self.id + '_c' + str(i), body='comment {} on {}'.format(i, self.id))
+                for i in range(2)]
+
+
+class FakeReddit:
+    """
+    Stands in for praw, each submission and comment tree takes one round trip
+    """
+
+    def submission(self, id):
+        time.sleep(LATENCY)
+        return SimpleNamespace(created_utc=START.timestamp() + 3600, selftext='body of ' + id, title='title of ' + id,
+                               comments=FakeComments(id))
+
+
+@pytest.fixture
+def fake_reddit(monkeypatch):
+    monkeypatch.setattr(sf, 'get_reddit_client', lambda config: FakeReddit())
+    monkeypatch.setattr(sf, 'get_pushshift_client', lambda: FakePushshift(24))
+
+
+def scrape(concurrency):
+    config = {'concurrency': concurrency, 'requests_per_minute': 0}
+    started = time.perf_counter()
+    docs = sf.process_reddit('ABC', ['stocks', 'investing'], START, END, config, 1)
+    return docs, time.perf_counter() - started
+
+
+def test_concurrent_scrape_matches_serial(fake_reddit):
+    serial, serial_time = scrape(1)
+    concurrent, concurrent_time = scrape(8)
+    # 2 subs of 24 submissions, each with a title, body and 2 comments
+    assert len(serial) == 2 * 24 * 4
+    assert serial.frame().equals(concurrent.frame())
+    # every fetch waits on the fake servers, so 8 at a time should be several times faster
+    assert serial_time / concurrent_time > 3
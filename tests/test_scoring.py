@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+import pytest
+
+import sentiment_store as store
+import stock_funcs as sf
+from documents import Documents
+from instrumentation import RunReport
+
+WORDS = ['the', 'stock', 'is', 'not', 'very', 'good', 'bad', 'calls', 'puts', 'tendies', 'moon', 'crash', '!',
+         'GREAT', ':)', 'but', 'kind', 'of', 'least']
+
+
+@pytest.mark.parametrize('engine', ['vader', 'fast'])
+def test_pool_scores_match_serial(engine):
+    rng = random.Random(0)
+    texts = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 30))) for _ in range(2000)] + [None, '']
+    sf.get_scorer(engine=engine)
+    serial = sf.get_scorer().score_many(texts)
+    pool = sf.make_score_pool(2)
+    try:
+        pooled = sf.score_texts(texts, chunksize=64, pool=pool)
+    finally:
+        pool.close()
+        pool.join()
+    assert np.array_equal(np.array(pooled), np.array(serial), equal_nan=True)
+
+
+def make_docs(texts):
+    n = len(texts)
+    ids = ['https://example.com/{}'.format(i) for i in range(n)]
+    return Documents.from_columns(['news'] * n, ['2021-01-01'] * n, ids, ['title'] * n, list(range(n)), texts)
+
+
+def test_score_cache_misses_after_custom_words_change(tmp_path):
+    texts = ['great earnings', 'great guidance but weak sales']
+    conn = store.connect(str(tmp_path / 'sentiment.db'))
+    try:
+        sf.get_scorer(sf.DEFAULT_CUSTOMWORDS)
+        first = sf.score_all(make_docs(texts), workers=1, conn=conn).copy()
+        sf.get_scorer(dict(sf.DEFAULT_CUSTOMWORDS, great=-4.0))
+        report = RunReport('ABC')
+        rescored = sf.score_all(make_docs(texts), workers=1, conn=conn, report=report)
+        assert report.counters['score_cache_hits:news'] == 0
+        assert list(rescored) == sf.get_scorer().score_many(texts)
+        assert (rescored < first).all()
+    finally:
+        sf.get_scorer(sf.DEFAULT_CUSTOMWORDS)
+        conn.close()
+
+
+def test_score_all_makes_one_pool_for_every_batch(monkeypatch):
+    pools = []
+    make_score_pool = sf.make_score_pool
+
+    def counted(workers=None):
+        pools.append(workers)
+        return make_score_pool(workers)
+
+    monkeypatch.setattr(sf, 'make_score_pool', counted)
+    rng = random.Random(1)
+    texts = [' '.join(rng.choice(WORDS) for _ in range(10)) + ' ' + str(i) for i in range(300)]
+    sf.get_scorer(engine='fast')
+    scores = sf.score_all(make_docs(texts), workers=2, chunksize=16, batch=100)
+    assert pools == [2]
+    assert list(scores) == sf.get_scorer().score_many(texts)
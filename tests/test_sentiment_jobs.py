@@ -0,0 +1,18 @@
+import pandas as pd
+
+from sentiment_jobs import SentimentJobs
+
+
+def test_jobs_share_one_pool():
+    pools = []
+
+    def run(ticker, pool=None):
+        pools.append(pool)
+        return pd.DataFrame({'date': ['2021-01-01'], 'reddit': [0.1]})
+
+    pool = object()
+    jobs = SentimentJobs(workers=2, run=run, pool=pool)
+    keys = [jobs.submit(ticker) for ticker in ('ABC', 'XYZ')]
+    jobs.executor.shutdown(wait=True)
+    assert pools == [pool, pool]
+    assert [jobs.status(key) for key in keys] == ['done', 'done']
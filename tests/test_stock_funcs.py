@@ -0,0 +1,164 @@
+import datetime as dt
+import sqlite3
+from urllib.parse import urlparse
+
+import pandas as pd
+import pytest
+import requests
+
+import stock_funcs as sf
+from documents import Documents
+from instrumentation import RunReport
+
+EMPTY_PRICES = pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'])
+TWITTER = b'[{"date": "2021-01-01", "score": 10, "avg_7_days": 1, "avg_14_days": 1, "avg_30_days": 1}]'
+
+
+def test_final_sentiment_no_documents():
+    scored = pd.concat([sf.get_news_sentiment(Documents.empty()), sf.get_reddit_sentiment(Documents.empty())],
+                       ignore_index=True)
+    dates = ['2021-01-01', '2021-01-02']
+    data = sf.get_final_sentiment(EMPTY_PRICES, scored, {}, dates)
+    assert list(data.index) == dates
+    assert data[['reddit', 'news', 'mean']].isna().all().all()
+
+
+def test_run_sentiment_no_documents(config):
+    # news came back empty and reddit failed, a quiet ticker or a dead api
+    prefetched = {'price': EMPTY_PRICES, 'twitter': None, 'news': {'articles': []}, 'reddit': None}
+    data = sf.run_sentiment('QUIET', config=config, prefetched=prefetched)
+    assert not data.empty
+    assert data[['reddit', 'news', 'mean']].isna().all().all()
+
+
+def test_run_sentiment_reports_twitter_rate_limit(config):
+    report = RunReport('ABC')
+    prefetched = {'price': EMPTY_PRICES, 'twitter': (429, [], [], [], [], []), 'news': {'articles': []},
+                  'reddit': None}
+    sf.run_sentiment('ABC', config=config, prefetched=prefetched, report=report)
+    assert report.counters['errors:twitter'] == 1
+
+
+def test_refresh_prices_failed_download_not_covered(tmp_path, monkeypatch):
+    calls = []
+
+    def download(tickers, start, end):
+        calls.append((tuple(tickers), start, end))
+        # yfinance gives an empty frame when a download fails
+        return {t: EMPTY_PRICES for t in tickers}
+
+    monkeypatch.setattr(sf, 'download_prices', download)
+    conn = sf.store.connect(str(tmp_path / 'sentiment.db'))
+    try:
+        sf.refresh_prices(conn, ['ABC'], '2021-01-01', '2021-01-08')
+        assert sf.store.price_range(conn, 'ABC') is None
+        sf.refresh_prices(conn, ['ABC'], '2021-01-01', '2021-01-08')
+        assert len(calls) == 2
+    finally:
+        conn.close()
+
+
+def test_refresh_prices_covers_up_to_last_row(tmp_path, monkeypatch):
+    prices = pd.DataFrame({'Open': [1., 2.], 'High': [1., 2.], 'Low': [1., 2.], 'Close': [1., 2.],
+                           'Adj Close': [1., 2.], 'Volume': [10., 20.]},
+                          index=pd.to_datetime(['2021-01-04', '2021-01-05']))
+    monkeypatch.setattr(sf, 'download_prices', lambda tickers, start, end: {t: prices for t in tickers})
+    conn = sf.store.connect(str(tmp_path / 'sentiment.db'))
+    try:
+        sf.refresh_prices(conn, ['ABC'], '2021-01-01', '2021-01-08')
+        assert sf.store.price_range(conn, 'ABC') == ('2021-01-01', '2021-01-06')
+    finally:
+        conn.close()
+
+
+class FakeNewsApi:
+
+    def __init__(self):
+        self.calls = []
+
+    def get_everything(self, **params):
+        self.calls.append(params)
+        return {'status': 'ok', 'totalResults': 0, 'articles': []}
+
+
+def test_get_news_same_windows_across_runs(monkeypatch):
+    newsapi = FakeNewsApi()
+    monkeypatch.setattr(sf, 'get_newsapi_client', lambda apikey: newsapi)
+    windows = []
+    for minutes in (5, 47):
+        newsapi.calls = []
+        offset = dt.timedelta(minutes=minutes, seconds=minutes)
+        sf.get_news('ABC', dt.datetime(2021, 1, 1, 9) + offset, 'key', to_date=dt.datetime(2021, 1, 4, 9) + offset,
+                    workers=1)
+        windows.append(sorted((c['from_param'], c['to']) for c in newsapi.calls))
+    assert windows[0] == windows[1]
+    assert windows[0][0] == (dt.datetime(2021, 1, 1), dt.datetime(2021, 1, 2))
+    assert windows[0][-1] == (dt.datetime(2021, 1, 4), dt.datetime(2021, 1, 4, 9))
+
+
+def test_run_sentiment_keeps_todays_news(config, monkeypatch):
+    published = dt.datetime.now() - dt.timedelta(hours=1)
+
+    class TodaysNews(FakeNewsApi):
+
+        def get_everything(self, **params):
+            # newsapi only returns the article to queries covering when it was published
+            articles = [{'publishedAt': published.strftime('%Y-%m-%dT%H:%M:%SZ'), 'title': 'ABC beats earnings',
+                         'content': 'great quarter', 'url': 'https://example.com/abc'}] \
+                if params['from_param'] <= published < params['to'] else []
+            return {'status': 'ok', 'totalResults': len(articles), 'articles': articles}
+
+    monkeypatch.setattr(sf, 'get_newsapi_client', lambda apikey: TodaysNews())
+    report = RunReport('ABC')
+    prefetched = {'price': EMPTY_PRICES, 'twitter': None, 'reddit': None}
+    data = sf.run_sentiment('ABC', config=config, prefetched=prefetched, report=report)
+    assert report.counters['documents:news'] == 1
+    assert data.set_index('date').loc[published.strftime('%Y-%m-%d'), 'news'] > 0
+
+
+def test_run_report_counts_requests_and_retries(config, monkeypatch):
+    requests_made = []
+
+    def request(session, method, url, **kwargs):
+        host = urlparse(url).hostname
+        requests_made.append(host)
+        response = requests.Response()
+        response.url = url
+        # socialsentiment.io fails once before answering
+        response.status_code = 503 if requests_made.count(host) == 1 and host == 'socialsentiment.io' else 200
+        response._content = TWITTER if host == 'socialsentiment.io' else \
+            b'{"status": "ok", "totalResults": 0, "articles": []}'
+        return response
+
+    monkeypatch.setattr(requests.Session, 'request', request)
+    config['HTTP'] = {'retries': 2, 'backoff': 0}
+    report = RunReport('ABC')
+    sf.run_sentiment('ABC', config=config, prefetched={'price': EMPTY_PRICES, 'reddit': None}, report=report)
+    news_requests = requests_made.count('newsapi.org')
+    assert news_requests > 1
+    assert report.counters['http_calls:newsapi.org'] == news_requests
+    assert report.counters['http_calls:socialsentiment.io'] == 2
+    assert report.counters['http_retries:socialsentiment.io'] == 1
+    assert 'http_calls:price' not in report.counters
+
+
+def test_run_sentiment_closes_store_on_error(config, monkeypatch):
+    connections = []
+    connect = sf.store.connect
+
+    def tracked(path):
+        conn = connect(path)
+        connections.append(conn)
+        return conn
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('aggregation failed')
+
+    monkeypatch.setattr(sf.store, 'connect', tracked)
+    monkeypatch.setattr(sf, 'get_final_sentiment', fail)
+    prefetched = {'price': EMPTY_PRICES, 'twitter': None, 'news': {'articles': []}, 'reddit': None}
+    with pytest.raises(RuntimeError):
+        sf.run_sentiment('FAIL', config=config, prefetched=prefetched)
+    assert len(connections) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        connections[0].execute('SELECT 1')
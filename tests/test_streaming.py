@@ -0,0 +1,23 @@
+import datetime as dt
+import threading
+
+import streaming
+
+
+def test_news_source_polls_utc_with_overlap(monkeypatch):
+    calls = []
+    stop = threading.Event()
+
+    def get_news(q, from_date, apikey, to_date=None, **kwargs):
+        calls.append((from_date, to_date))
+        if len(calls) == 2:
+            stop.set()
+        return {'articles': []}
+
+    monkeypatch.setattr(streaming.sf, 'get_news', get_news)
+    assert list(streaming.news_source(['ABC'], 'key', stop, interval=0, overlap=60)) == []
+    utcnow = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+    (first_from, first_to), (second_from, second_to) = calls
+    assert abs((utcnow - second_to).total_seconds()) < 60
+    # each poll reaches back over the end of the one before
+    assert second_from <= first_to - dt.timedelta(seconds=60)